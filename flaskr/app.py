@@ -1,21 +1,39 @@
 #!/usr/bin/python3
 """The Flask app."""
 # Created: sáb jul  6 11:11:48 2024 (+0200)
-# Last-Updated: jue nov 13 16:24:41 2025 (+0100)
+# Last-Updated: lun oct 19 10:13:39 2026 (+0200)
 # Filename: main.py
 # Author: Joaquin Moncanut <quimm2003@gmail.es>
 
+import functools
 import logging
 import os
 import sys
 import threading
+import time
 from logging.handlers import RotatingFileHandler
 
 from data.data import Data
+from data.job_worker import run_worker_command
+from data.marker_tiles import build_current_marker_tiles, build_marker_tiles_command
+from data.serving_snapshot import ServingSnapshot
 from db import db
-from flask import Flask
+from db.benchmark import benchmark_db_command
+from db.leader import IngestionLeader
+from db.query_stats import QueryStats
+from db.snapshot import export_snapshot, export_snapshot_command
+from db.statements import PreparedStatementsStats, Statements
+from flask import Flask, abort, current_app, jsonify, request
+from graphs.graph_scheduler import get_graph_scheduler
 from osmap.os_map import OSMap
 
+# Commands which only use the database or the data, without serving the app nor running the data processing
+CLI_COMMANDS = {'init-db', 'migrate-db', 'benchmark-db', 'export-snapshot', 'build-marker-tiles'}
+
+# Holds the ingestion advisory lock while this process lives, if it is the leader.
+# Created by the data-handler thread, so its id has the pid of the process running it, not the one of a pre-fork master
+ingestion_leader = None
+
 
 def configure_logging(app):
     """Configure handlers and loggers.
@@ -62,17 +80,105 @@ def verbose_formatter():
     )
 
 
+def internal_only(view):
+    """Decorate a route so only the clients in METRICS_ALLOWED_ADDRESSES can read it. Other clients get 403."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.remote_addr not in current_app.config['METRICS_ALLOWED_ADDRESSES']:
+            abort(403)
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _become_ingestion_leader(app: Flask) -> None:
+    """Wait until this process holds the ingestion advisory lock.
+
+    Only the leader runs the data processing, the other processes only serve.
+    If the leader dies, one of the waiting processes takes over.
+    """
+    global ingestion_leader
+
+    if ingestion_leader is None:
+        ingestion_leader = IngestionLeader()
+
+    waiting = False
+
+    while True:
+        try:
+            if ingestion_leader.try_acquire():
+                app.logger.info("Process %s is the ingestion leader", ingestion_leader.leader_id)
+                return
+        except Exception:
+            app.logger.exception("Could not check the ingestion advisory lock")
+
+        if not waiting:
+            app.logger.info("Another process runs the data processing, %s only serves", ingestion_leader.leader_id)
+            waiting = True
+
+        time.sleep(app.config['LEADER_RETRY_INTERVAL'])
+
+
+def _record_ingestion_failure(app: Flask, stmt: Statements, error: Exception) -> None:
+    """Roll back the failed data processing and set the 'failed' ingestion status, logging instead of raising if any of them fails.
+
+    The status is written through the connection of a new app context, as the one of the data processing may be broken.
+    """
+    try:
+        stmt.rollback()
+    except Exception:
+        app.logger.exception("Could not roll back the failed data processing")
+
+    try:
+        with app.app_context():
+            Statements().set_ingestion_status(ingestion_leader.leader_id, 'failed', str(error))
+    except Exception:
+        app.logger.exception("Could not set the failed ingestion status")
+
+
 def _process_data_async(app: Flask, providers) -> None:
     """Run data handling in a background thread under app context."""
     with app.app_context():
+        _become_ingestion_leader(app)
+
+        # The leader renders the graphs, and applies the promotions of the other processes from now on
+        get_graph_scheduler().start()
+
+        stmt = Statements()
+
         try:
             app.logger.info("Background data processing started (providers=%d)", len(providers) if providers else 0)
+            stmt.set_ingestion_status(ingestion_leader.leader_id, 'running')
+            query_stats = QueryStats.snapshot()
             data = Data()
             data.providers = providers
             data.handle_data()
+
+            # Publish a new data version, then export it to the snapshot
+            stmt.set_ingestion_status(ingestion_leader.leader_id, 'done')
+
+            try:
+                stations = export_snapshot(app.config['SQLITE_SNAPSHOT_LOCATION'])
+                app.logger.info("SQLite snapshot exported with %d stations", stations)
+            except Exception:
+                app.logger.exception("Could not export the SQLite snapshot, serving nodes keep the previous one")
+
+            # Swap the in-memory data of this process once it is rebuilt, the other processes see the new version on their next check
+            ServingSnapshot.refresh()
+
+            if app.config['MARKER_TILES_ENABLED']:
+                try:
+                    written, removed = build_current_marker_tiles()
+                    app.logger.info("Marker tiles built: %d written, %d removed", written, removed)
+                except Exception:
+                    app.logger.exception("Could not build the marker tiles, the map keeps the previous ones")
+
             app.logger.info("Background data processing completed successfully")
-        except Exception:
+            QueryStats.log_summary(app.logger, since=query_stats)
+        except Exception as e:
             app.logger.exception("Background data processing failed")
+            _record_ingestion_failure(app, stmt, e)
         finally:
             app.logger.debug("Background data processing thread exiting")
 
@@ -80,7 +186,10 @@ def _process_data_async(app: Flask, providers) -> None:
 def create_app():
     """Configure the Factory function to create the Flask app."""
     # Check if we only want to initialize the database
-    init_db = True if 'init-db' in sys.argv else False
+    init_db = bool(CLI_COMMANDS & set(sys.argv))
+
+    # Check if we only want to run a worker draining the jobs table
+    run_worker = 'run-worker' in sys.argv
 
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
@@ -99,7 +208,7 @@ def create_app():
             pass
 
         # Routes
-        @app.route('/station/<station_id>', methods=['GET'])
+        @app.route('/station/<int:station_id>', methods=['GET'])
         def station(station_id):
             data = Data()
             return data.get_station_data(station_id)
@@ -109,15 +218,56 @@ def create_app():
             data = Data()
             return data.get_station_popup(station_id)
 
+        @app.route('/popups', methods=['GET'])
+        def popups():
+            data = Data()
+            return jsonify(data.get_station_popups(request.args.get('ids', ''), request.args.get('clicked', '')))
+
         @app.route('/stationsmarkers', methods=['GET'])
         def stations_markers():
             data = Data()
-            data.initialize_providers()
-            return data.get_stations_markers()
+            return data.get_stations_markers_response()
+
+        @app.route('/stationsmarkers/<int:provider_id>/<cn>', methods=['GET'])
+        def country_markers(provider_id, cn):
+            data = Data()
+            return data.get_country_markers_response(provider_id, cn)
+
+        @app.route('/stationsmarkers/<int:provider_id>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+        def tile_markers(provider_id, z, x, y):
+            data = Data()
+            return data.get_tile_markers_response(provider_id, z, x, y)
+
+        @app.route('/ingestion/status', methods=['GET'])
+        def ingestion_status():
+            data = Data()
+            return jsonify(data.get_ingestion_status())
+
+        @app.route('/db/statements', methods=['GET'])
+        @internal_only
+        def prepared_statements_stats():
+            return jsonify(PreparedStatementsStats.get())
+
+        @app.route('/metrics', methods=['GET'])
+        @internal_only
+        def metrics():
+            return jsonify({'queries': QueryStats.get(), 'prepared_statements': PreparedStatementsStats.get()})
+
+        # Register database commands and return the connections to the pool on teardown
+        db.init_app(app)
 
         if init_db:
-            # Register database commands
-            db.init_app(app)
+            # Register the database benchmark
+            app.cli.add_command(benchmark_db_command)
+
+            # Register the export of the serving snapshot
+            app.cli.add_command(export_snapshot_command)
+
+            # Register the build of the static marker tiles
+            app.cli.add_command(build_marker_tiles_command)
+        elif run_worker:
+            # Register the worker command
+            app.cli.add_command(run_worker_command)
         else:
             # Initialize providers once in main thread
             data = Data()
@@ -135,11 +285,11 @@ def create_app():
                 bg_thread.start()
                 app.logger.info("Started background data processing thread: %s", bg_thread.name)
 
-            # Get the stations locations and info (may be empty on first run)
-            all_stations_markers = data.get_stations_markers()
+            # Load the data the read routes serve from memory
+            ServingSnapshot.get()
 
-            # Instantiate Map
-            osmap = OSMap(markers=all_stations_markers, providers=providers)
+            # Instantiate Map. The markers of the selected provider and country are fetched by the page
+            osmap = OSMap()
             app.register_blueprint(osmap.bp)
 
     return app
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Module to configure the Flask application."""
 # Created: sáb jul  6 12:46:59 2024 (+0200)
-# Last-Updated: vie nov 14 19:49:58 2025 (+0100)
+# Last-Updated: lun oct 19 10:06:59 2026 (+0200)
 # Filename: config.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 from pathlib import Path
@@ -141,3 +141,311 @@ class Config:
         :rtype: boolean
         """
         return False
+
+    @property
+    def PRERENDER_GRAPHS(self):
+        """Controls if all the stations graphs are rendered in background after each data update.
+
+        Otherwise graphs are rendered the first time they are requested, or when their country is requested through the map.
+
+        :return: True to pre-render all the graphs. False otherwise.
+        :rtype: boolean
+        """
+        return False
+
+    @property
+    def GRAPH_CACHE_MAX_ENTRIES(self):
+        """The max number of stations graphs kept in memory.
+
+        :return: the number of graphs.
+        :rtype: int
+        """
+        return 32
+
+    @property
+    def GRAPH_CACHE_MAX_DISK_FILES(self):
+        """The max number of stations graph files kept on disk per provider.
+
+        :return: the number of graph files.
+        :rtype: int
+        """
+        return 5000
+
+    @property
+    def GRAPH_WARMUP_TOP_N(self):
+        """The number of most viewed stations whose graphs are rendered after each data update.
+
+        :return: the number of stations.
+        :rtype: int
+        """
+        return 100
+
+    @property
+    def STATION_VIEWS_FLUSH_INTERVAL(self):
+        """The seconds between two flushes of the station views counters to the database.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 60
+
+    @property
+    def GRAPH_INTEREST_TTL(self):
+        """The seconds a country or bounding box requested through the map gets its graphs rendered first.
+
+        Each process promotes the same country or bounding box at most once in this period.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 900
+
+    @property
+    def JOB_QUEUE_ENABLED(self):
+        """Controls if the stations graphs are queued in the jobs table, to be rendered by run-worker processes.
+
+        Otherwise they are rendered by a background thread of the web app.
+
+        :return: True to use the jobs table. False otherwise.
+        :rtype: boolean
+        """
+        return False
+
+    @property
+    def JOB_LEASE_SECONDS(self):
+        """The seconds a worker owns a claimed job. After that, other workers can claim it again.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 600
+
+    @property
+    def JOB_MAX_ATTEMPTS(self):
+        """The number of times a job is tried before it is marked as failed.
+
+        :return: the number of attempts.
+        :rtype: int
+        """
+        return 3
+
+    @property
+    def JOB_RETRY_DELAY(self):
+        """The seconds to wait before retrying a failed job. It grows with the square of the attempts.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 60
+
+    @property
+    def JOB_POLL_INTERVAL(self):
+        """The seconds a worker waits when there are no jobs to run.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 5
+
+    @property
+    def JOB_KEEP_DAYS(self):
+        """The days the done jobs are kept in the jobs table.
+
+        :return: the number of days.
+        :rtype: int
+        """
+        return 7
+
+    @property
+    def LEADER_RETRY_INTERVAL(self):
+        """The seconds a process waits before trying again to become the ingestion leader.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 60
+
+    @property
+    def DB_POOL_MIN_CONNECTIONS(self):
+        """The connections opened by each process when the first one is needed.
+
+        :return: the number of connections.
+        :rtype: int
+        """
+        return 1
+
+    @property
+    def DB_POOL_MAX_CONNECTIONS(self):
+        """The max connections each process keeps open, idle or in use.
+
+        :return: the number of connections.
+        :rtype: int
+        """
+        return 10
+
+    @property
+    def DB_POOL_TIMEOUT(self):
+        """The seconds a request waits for a free connection when all of them are in use.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 30
+
+    @property
+    def DB_POOL_CHECK_INTERVAL(self):
+        """The seconds an idle connection is used without checking it is still alive.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 30
+
+    @property
+    def GRAPH_DATA_SOURCE(self):
+        """Where the graphs read the daily values from.
+
+        'files' reads the provider data files. 'database' reads the observations table, which the ingestion leader fills,
+        so any node with access to the database can render graphs.
+        :return: 'files' or 'database'.
+        :rtype: str
+        """
+        return 'files'
+
+    @property
+    def OBSERVATIONS_BATCH_SIZE(self):
+        """The stations whose observations are copied in each transaction.
+
+        :return: the number of stations.
+        :rtype: int
+        """
+        return 200
+
+    @property
+    def DB_ITERSIZE(self):
+        """The rows fetched per round trip when iterating large results through server side cursors.
+
+        :return: the number of rows.
+        :rtype: int
+        """
+        return 2000
+
+    @property
+    def SERVING_BACKEND(self):
+        """Where the web workers read the stations, popups and markers from.
+
+        'postgres' queries the database. 'sqlite' reads the snapshot the ingestion leader exports to SQLITE_SNAPSHOT_LOCATION,
+        without network round trips; it falls back to the database while there is no snapshot.
+        :return: 'postgres' or 'sqlite'.
+        :rtype: str
+        """
+        return 'postgres'
+
+    @property
+    def SQLITE_SNAPSHOT_LOCATION(self):
+        """The path to the SQLite snapshot of the serving data.
+
+        :return: The path to the snapshot file.
+        :rtype: Path
+        """
+        return self.CURRENT_DATA_LOCATION.joinpath('snapshot.sqlite3')
+
+    @property
+    def SQLITE_MMAP_SIZE(self):
+        """The bytes of the SQLite snapshot memory mapped by each connection.
+
+        :return: the number of bytes.
+        :rtype: int
+        """
+        return 256 * 1024 * 1024
+
+    @property
+    def SLOW_QUERY_THRESHOLD(self):
+        """The milliseconds from which a call of a Statements function is logged as a slow query, with its parameters.
+
+        :return: the number of milliseconds.
+        :rtype: int
+        """
+        return 200
+
+    @property
+    def SLOW_STAGE_QUERY_THRESHOLD(self):
+        """The milliseconds from which a call of a Statements function is logged as a slow query in the pipeline stages (ingestion, scheduling, jobs).
+
+        Their bulk statements, as the copy of the observations of a station, take longer than the queries of the routes.
+        :return: the number of milliseconds.
+        :rtype: int
+        """
+        return 10000
+
+    @property
+    def METRICS_ALLOWED_ADDRESSES(self):
+        """The client addresses allowed to read the /metrics and /db/statements routes. Other clients get 403.
+
+        :return: the IP addresses.
+        :rtype: tuple
+        """
+        return ('127.0.0.1', '::1')
+
+    @property
+    def DATA_VERSION_CHECK_INTERVAL(self):
+        """The seconds the in-memory serving snapshot and the cached graphs are served before checking if the ingestion has published a new data version.
+
+        :return: the number of seconds.
+        :rtype: int
+        """
+        return 30
+
+    @property
+    def MARKERS_CACHE_MAX_ENTRIES(self):
+        """The sets of serialized markers (countries, tiles...) kept in memory by each process.
+
+        :return: the number of sets.
+        :rtype: int
+        """
+        return 5000
+
+    @property
+    def CLUSTER_GRID_SIZE(self):
+        """The cells per side of a map tile the stations are clustered by.
+
+        :return: the number of cells.
+        :rtype: int
+        """
+        return 8
+
+    @property
+    def CLUSTER_MAX_ZOOM(self):
+        """The map zoom from which the stations are not clustered.
+
+        :return: the zoom level.
+        :rtype: int
+        """
+        return 10
+
+    @property
+    def MARKER_TILES_ENABLED(self):
+        """Whether the ingestion leader writes the static pyramid of marker tiles and the map reads it instead of the tiles route.
+
+        :return: True to use the static tiles. False otherwise.
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def MARKER_TILES_LOCATION(self):
+        """The path to the static pyramid of marker tiles.
+
+        :return: The path to the tiles directory.
+        :rtype: Path
+        """
+        return Path(current_app.root_path).joinpath('static/tiles').resolve()
+
+    @property
+    def POPUPS_BATCH_MAX(self):
+        """The most popups requested at once through the popups route.
+
+        :return: the number of popups.
+        :rtype: int
+        """
+        return 200
@@ -1,32 +1,27 @@
 #!/usr/bin/python3
 """Module to handle the averages for each measurement."""
 # Created: dom sep 22 13:39:25 2024 (+0200)
-# Last-Updated:
+# Last-Updated: lun oct 19 10:10:39 2026 (+0200)
 # Filename: ecad_average.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 import math
 
 
 class Average():
-    """Class to handle the Ecad data averages."""
+    """Class to handle the Ecad data averages.
 
-    # Averages per decade and per measurement
-    averages = {}
-
-    # Averages per decade for one measurement
-    average = {}
+    Each instance keeps its own data, so graphs can be rendered concurrently.
+    """
 
     def __init__(self):
         """Initialize the class."""
+        # Averages per decade and per measurement
+        self.averages = {}
 
-    @classmethod
-    def initialize(cls):
-        """Initialize the class attributes."""
-        cls.averages = {}
-        cls.average = {}
+        # Averages per decade for one measurement
+        self.average = {}
 
-    @classmethod
-    def _compute_decade(cls, meas_date):
+    def _compute_decade(self, meas_date):
         """Get the decade corresponding to meas_date.
 
         :param meas_date: the date from which the decade will be computed
@@ -40,31 +35,28 @@ class Average():
 
         return decade
 
-    @classmethod
-    def set_value(cls, meas_date, meas_value):
+    def set_value(self, meas_date, meas_value):
         """Add a value to the dictionary."""
-        decade = cls._compute_decade(meas_date)
+        decade = self._compute_decade(meas_date)
 
-        if decade not in cls.average:
-            cls.average[decade] = {'value': 0, 'count': 0, 'average': None}
+        if decade not in self.average:
+            self.average[decade] = {'value': 0, 'count': 0, 'average': None}
 
-        cls.average[decade]['value'] += meas_value
-        cls.average[decade]['count'] += 1
+        self.average[decade]['value'] += meas_value
+        self.average[decade]['count'] += 1
 
-    @classmethod
-    def calculate_averages(cls):
+    def calculate_averages(self):
         """Calculate the average of all data processed."""
-        for decade in cls.average.keys():
-            if cls.average[decade]['count'] > 0:
-                mean = float(cls.average[decade]['value']) / cls.average[decade]['count']
-                cls.average[decade]['average'] = round(math.ceil(mean * 100) / 100, 2)
+        for decade in self.average.keys():
+            if self.average[decade]['count'] > 0:
+                mean = float(self.average[decade]['value']) / self.average[decade]['count']
+                self.average[decade]['average'] = round(math.ceil(mean * 100) / 100, 2)
             else:
-                cls.average[decade]['average'] = math.nan
+                self.average[decade]['average'] = math.nan
 
-        return cls.average
+        return self.average
 
-    @classmethod
-    def merge_measurement_averages(cls, meas_average, graph_line_name):
+    def merge_measurement_averages(self, meas_average, graph_line_name):
         """Merge the averages of the different measurements.
 
         Set the measurement average into the average dict.
@@ -77,16 +69,15 @@ class Average():
         for decade, data in meas_average.items():
             if 'average' in data:
                 if data['average'] is not None:
-                    if decade not in cls.averages:
-                        cls.averages[decade] = {}
+                    if decade not in self.averages:
+                        self.averages[decade] = {}
 
-                    if graph_line_name not in cls.averages[decade]:
-                        cls.averages[decade][graph_line_name] = {}
+                    if graph_line_name not in self.averages[decade]:
+                        self.averages[decade][graph_line_name] = {}
 
-                    cls.averages[decade][graph_line_name]['average'] = data['average']
+                    self.averages[decade][graph_line_name]['average'] = data['average']
 
-    @classmethod
-    def normalize_averages(cls):
+    def normalize_averages(self):
         """Normalize the decades and measurements values on the dictionary.
 
         It has to meet the Bokeh plots requirements.
@@ -95,27 +86,27 @@ class Average():
         max_lines = 0
         dec = 0
 
-        decades = list(cls.averages)
+        decades = list(self.averages)
 
         for decade in decades:
-            mx_lines = max(len(cls.averages[decade].keys()), max_lines)
+            mx_lines = max(len(self.averages[decade].keys()), max_lines)
             if mx_lines > max_lines:
                 max_lines = mx_lines
                 dec = decade
 
-        line_names = list(cls.averages[dec].keys())
+        line_names = list(self.averages[dec].keys())
 
         # If a decade does not has max_lines, delete it from the dictionary
         for decade in decades:
-            keys = cls.averages[decade].keys()
+            keys = self.averages[decade].keys()
 
             if len(keys) < max_lines:
                 missing_lines = [item for item in line_names if item not in keys]
 
                 for miss_line in missing_lines:
-                    cls.averages[decade][miss_line] = {'average': math.nan}
+                    self.averages[decade][miss_line] = {'average': math.nan}
 
-        return cls.averages
+        return self.averages
 
     @classmethod
     def get_average_tooltips_line_name(cls, averages):
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+"""Module to keep the country names tables in memory."""
+# Created: lun oct 19 09:43:05 2026 (+0200)
+# Last-Updated: lun oct 19 09:43:10 2026 (+0200)
+# Filename: country_names.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import threading
+from types import MappingProxyType
+
+from country_list import countries_for_language
+
+# Languages the country names are shown in, the first one is the default
+LANGUAGES = ('en', 'es')
+
+
+class CountryNames():
+    """Class to share the country names of each language, loaded once per process."""
+
+    # Country names by alpha_2 code, by language
+    names = {}
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def get(cls, lang):
+        """Return the country names of a language.
+
+        :param lang: the language code, i.e. 'es'.
+        :type lang: str
+        :return: the country names by alpha_2 code.
+        :rtype: types.MappingProxyType
+        """
+        names = cls.names.get(lang)
+
+        if names is None:
+            with cls._lock:
+                if lang not in cls.names:
+                    cls.names[lang] = MappingProxyType(dict(countries_for_language(lang)))
+
+                names = cls.names[lang]
+
+        return names
@@ -1,14 +1,36 @@
 #!/usr/bin/python3
 """Base class for data with common methods and common info."""
 # Created: sáb jul  6 18:31:59 2024 (+0200)
-# Last-Updated: sáb nov  8 19:14:39 2025 (+0100)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
 # Filename: download_data.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
-from data.ecad.ecad import Ecad
+import re
 
+from data.ecad.ecad import Ecad
+from data.markers_cache import MarkersCache, payload_response
+from data.providers_catalogue import ProvidersCatalogue
+from data.serving_snapshot import ServingSnapshot, station_marker
+from data.station_grid import StationGrid, tile_bbox
+from data.station_views import StationViews
+
+from db.leader import INGESTION_LOCK_KEY
+from db.snapshot import get_serving_statements
 from db.statements import Statements
 
-from flask import current_app
+from flask import abort, current_app
+from graphs.graph_scheduler import get_graph_scheduler
+
+# Country codes of the stations table
+COUNTRY_CODE = re.compile('[A-Z]{2}')
+
+# Highest zoom of the map tiles
+MAX_TILE_ZOOM = 18
+
+# The tiles from CLUSTER_MAX_ZOOM promote the stations of their ancestor tile this many zooms above it, so a map view makes a few promotions
+PROMOTED_TILE_ZOOM_OUT = 2
+
+# The compact markers carry the coordinates as integers, multiplied by this scale (about 1 m)
+COORDINATES_SCALE = 100000
 
 
 class Data:
@@ -50,7 +72,7 @@ class Data:
         provider_data['dirs']['tmp_graph_dir'] = self.tmp_graph_dir
 
     def _get_provider_data(self, provider_id):
-        """Get a provider's data.
+        """Get a copy of a provider's data, with the app directories paths.
 
         :param provider_id: the id of the provider
         :type provider_id: int
@@ -58,13 +80,13 @@ class Data:
         provider_data = None
 
         if provider_id in self.providers.keys():
-            provider_data = self.providers[provider_id]
+            provider_data = ProvidersCatalogue.get_provider(provider_id)
             self._add_directories_paths(provider_data)
 
         return provider_data
 
     def _get_provider_data_by_station_id(self, data_station_id):
-        """Get provider data from database using the station's id.
+        """Get provider data using the station's id, looked up in the serving snapshot.
 
         :param data_station_id: the id of the station in the database table
         :type data_station_id: int
@@ -73,17 +95,19 @@ class Data:
         provider_data = None
 
         if data_station_id:
-            stmt = Statements()
+            provider_id = ServingSnapshot.get().station_providers.get(data_station_id)
 
-            provider_id, provider_data = stmt.get_provider_data_bystation_id(data_station_id)
+            if provider_id is not None:
+                if self.providers is None:
+                    self.initialize_providers()
+
+                provider_data = self._get_provider_data(provider_id)
 
         return provider_id, provider_data
 
     def initialize_providers(self):
-        """Get providers info from the database."""
-        stmt = Statements()
-
-        self.providers = stmt.get_providers_data()
+        """Get providers info, loaded from the database once per process."""
+        self.providers = ProvidersCatalogue.get()
 
     def handle_data(self):
         """Initialize the providers instances for each provider."""
@@ -93,6 +117,9 @@ class Data:
             prov_inst = self._get_provider_instance(provider_id, provider_data)
             prov_inst.handle_data()
 
+        # The ingestion may have changed the providers metadata
+        ProvidersCatalogue.invalidate()
+
     def get_station_data(self, data_station_id):
         """Get station data.
 
@@ -100,79 +127,277 @@ class Data:
         :param data_station_id: the id of the station in the database table
         :type data_station_id: int
         """
+        html = None
+
         provider_id, provider_data = self._get_provider_data_by_station_id(data_station_id)
-        self._add_directories_paths(provider_data)
 
-        prov_inst = self._get_provider_instance(provider_id, provider_data)
+        if provider_data:
+            prov_inst = self._get_provider_instance(provider_id, provider_data)
+
+            if prov_inst is not None:
+                html = prov_inst.get_station_data(data_station_id)
+
+        if html is None:
+            abort(404)
+
+        StationViews.record(data_station_id)
+
+        return html
+
+    def render_station_graph(self, data_station_id, write=False, provider_id=None):
+        """Render the graph of a station, if it is not cached yet.
+
+        :param data_station_id: the id of the station in the database table
+        :type data_station_id: int
+        :param write: True to write the graph file even if the graph is cached in memory.
+        :type write: bool
+        :param provider_id: the id of the provider of the station, if known. Otherwise it is looked up in the serving snapshot.
+        :type provider_id: int|None
+        :return: the html of the graph or None if the station has no graph.
+        :rtype: str|None
+        """
+        html = None
+
+        if provider_id is None:
+            provider_id, provider_data = self._get_provider_data_by_station_id(data_station_id)
+        else:
+            if self.providers is None:
+                self.initialize_providers()
+
+            provider_data = self._get_provider_data(provider_id)
+
+        if provider_data:
+            prov_inst = self._get_provider_instance(provider_id, provider_data)
+
+            if prov_inst is not None:
+                html = prov_inst.render_station_graph(data_station_id, write)
+
+        return html
+
+    def aggregate_station(self, data_station_id, provider_id):
+        """Compute and store the averages per decade of a station.
+
+        :param data_station_id: the id of the station in the database table
+        :type data_station_id: int
+        :param provider_id: the id of the provider of the station.
+        :type provider_id: int
+        :return: the number of averages stored or None if the station has no sources.
+        :rtype: int|None
+        """
+        res = None
+
+        if self.providers is None:
+            self.initialize_providers()
+
+        provider_data = self._get_provider_data(provider_id)
+
+        if provider_data:
+            prov_inst = self._get_provider_instance(provider_id, provider_data)
+
+            if prov_inst is not None:
+                res = prov_inst.aggregate_station(data_station_id)
+
+        return res
+
+    def _promote_stations_countries(self, data_station_ids):
+        """Render first the graphs of the stations of the countries of some stations.
+
+        The countries are found in the serving snapshot, and each one is promoted at most once per GRAPH_INTEREST_TTL by the scheduler,
+        so the popup routes do not touch the database.
+        :param data_station_ids: the ids of the stations in the database table
+        :type data_station_ids: list
+        """
+        snapshot = ServingSnapshot.get()
+        countries = set()
+
+        for data_station_id in data_station_ids:
+            provider_id = snapshot.station_providers.get(data_station_id)
 
-        return prov_inst.get_station_data(data_station_id)
+            if provider_id is not None:
+                countries.add((provider_id, snapshot.station_countries[data_station_id]))
+
+        for provider_id, cn in countries:
+            get_graph_scheduler().promote_country(provider_id, cn)
 
     def get_station_popup(self, data_station_id):
-        """Get station popup.
+        """Get station popup, from the serving snapshot.
 
         This is a Flask route.
         :param data_station_id: the id of the station in the database table
         :type data_station_id: int
         """
+        if not str(data_station_id).isdigit():
+            return []
+
+        # The country of a station shown in the map gets its graphs rendered first
+        self._promote_stations_countries([int(data_station_id)])
+
+        popup = ServingSnapshot.get().popups.get(int(data_station_id))
+
+        return [(popup,)] if popup is not None else []
+
+    def get_station_popups(self, ids, clicked=''):
+        """Get the popups of several stations, i.e. the ones visible in the map, from the serving snapshot.
+
+        This is a Flask route.
+        :param ids: the ids of the stations in the database table, separated by commas. At most POPUPS_BATCH_MAX.
+        :type ids: str
+        :param clicked: the ids of the stations clicked in the map, separated by commas. At most POPUPS_BATCH_MAX.
+        :type clicked: str
+        :return: the popup of each station by id, None if it has no popup or does not exist.
+        :rtype: dict
+        """
+        try:
+            data_station_ids = [int(data_station_id) for data_station_id in ids.split(',') if data_station_id]
+            clicked_station_ids = [int(data_station_id) for data_station_id in clicked.split(',') if data_station_id]
+        except ValueError:
+            abort(400)
+
+        if len(data_station_ids) > current_app.config['POPUPS_BATCH_MAX'] or len(clicked_station_ids) > current_app.config['POPUPS_BATCH_MAX']:
+            abort(400)
+
+        # The countries of the stations clicked in the map get their graphs rendered first
+        self._promote_stations_countries(clicked_station_ids)
+
+        popups = ServingSnapshot.get().popups
+
+        return {data_station_id: popups.get(data_station_id) for data_station_id in data_station_ids}
+
+    def get_ingestion_status(self):
+        """Get the state of the ingestion pipeline, as written by the process leading it.
+
+        This is a Flask route.
+        :return: a dict with the leader, state, started_at, finished_at, message and leader_alive keys.
+        :rtype: dict
+        """
         stmt = Statements()
 
-        return stmt.get_station_popup(data_station_id)
+        status = stmt.get_ingestion_status(INGESTION_LOCK_KEY)
+
+        for key in ('started_at', 'finished_at'):
+            if status[key] is not None:
+                status[key] = status[key].isoformat()
+
+        return status
+
+    def get_tile_markers_response(self, provider_id, z, x, y):
+        """Get the markers of the stations of a provider inside a map tile, clustered by a grid of CLUSTER_GRID_SIZE cells per side.
+
+        This is a Flask route. The markers are computed once per tile and data version.
+        From CLUSTER_MAX_ZOOM on the stations are not clustered, and the graphs of the stations of the tile and its neighbours,
+        inside its ancestor tile PROMOTED_TILE_ZOOM_OUT zooms above, are rendered first.
+        :param provider_id: the id of the provider
+        :type provider_id: int
+        :param z: the zoom of the tile
+        :type z: int
+        :param x: the column of the tile
+        :type x: int
+        :param y: the row of the tile
+        :type y: int
+        :rtype: flask.Response
+        """
+        # Only known keys are cached
+        if provider_id not in ServingSnapshot.get().providers or z > MAX_TILE_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            abort(404)
+
+        max_zoom = current_app.config['CLUSTER_MAX_ZOOM']
+
+        if z >= max_zoom:
+            # The tiles of a view share a few ancestors, and each one is promoted once per GRAPH_INTEREST_TTL
+            promoted_zoom = max(0, max_zoom - PROMOTED_TILE_ZOOM_OUT)
+            get_graph_scheduler().promote_bbox(provider_id, tile_bbox(promoted_zoom, x >> (z - promoted_zoom), y >> (z - promoted_zoom)))
+
+        def build(snapshot):
+            cells = StationGrid.get(snapshot.version, lambda: snapshot.markers)
+
+            return StationGrid.cluster(cells, provider_id, z, x, y, current_app.config['CLUSTER_GRID_SIZE'], max_zoom)
+
+        return payload_response(MarkersCache.get(('tile', provider_id, z, x, y), build))
 
     def get_stations_markers(self):
         """Build a dict containing the information to place a marker in the map, including its popup and css class name.
 
-        The info is retrieved from the stations database table.
+        The info is retrieved from the stations database table, or from the SQLite snapshot if it is the serving backend.
 
         :returns: a dict of list per provider containing the markers to be placed into the map.
         :rtype: list
         """
-        stmt = Statements()
+        stmt = get_serving_statements()
 
         st_markers = {}
 
         for provider_id in self.providers.keys():
-            stations = stmt.get_stations_data(provider_id)
-
-            if stations:
-                for row in stations:
-                    data_staid = row[0]
-                    station_name = row[2]
-                    country = row[3]
-                    lat = row[4]
-                    lon = row[5]
-                    popup = row[7]
-
-                    # Derive a clean text tooltip (no HTML, no None)
-                    if popup:
-                        # Use only the header part before the first <br to avoid long HTML content
-                        header = str(popup).split('<br', 1)[0]
-                        tooltip = header
-                        popup_html = f'<br />{popup}'
-                    else:
-                        # Fallback to a simple, human-readable tooltip
-                        if station_name:
-                            tooltip = f'{station_name} ({country})'
-                        else:
-                            tooltip = f'Station {data_staid}'
-                        popup_html = f'<br />{tooltip}'
-
-                    marker = {
-                        'lat': lat,
-                        'lon': lon,
-                        'popup': popup_html,
-                        'tooltip': tooltip,
-                        'station_id': f'{data_staid}',
-                        'provider_id': f'{provider_id}',
-                        'country': country
-                    }
-
-                    if provider_id not in st_markers:
-                        st_markers[provider_id] = []
-
-                    st_markers[provider_id].append(marker)
+            for row in stmt.iter_stations_data(provider_id):
+                marker = station_marker(row)
+                marker['provider_id'] = f'{provider_id}'
+
+                if provider_id not in st_markers:
+                    st_markers[provider_id] = []
+
+                st_markers[provider_id].append(marker)
 
         return st_markers
 
+    def _compact_markers(self, markers):
+        """Encode markers as parallel arrays, without key names repeated and without popups, which are requested when a marker is clicked.
+
+        :param markers: the markers, as built by station_marker.
+        :type markers: list
+        :return: a dict with the keys scale; station_id, lat and lon (integers, the coordinates multiplied by scale);
+            countries (the country codes) and country (the index of the country code of each marker); and tooltip.
+        :rtype: dict
+        """
+        countries = {}
+
+        for marker in markers:
+            if marker['country'] not in countries:
+                countries[marker['country']] = len(countries)
+
+        return {
+            'scale': COORDINATES_SCALE,
+            'station_id': [int(marker['station_id']) for marker in markers],
+            'lat': [round(float(marker['lat']) * COORDINATES_SCALE) for marker in markers],
+            'lon': [round(float(marker['lon']) * COORDINATES_SCALE) for marker in markers],
+            'countries': list(countries),
+            'country': [countries[marker['country']] for marker in markers],
+            'tooltip': [marker['tooltip'] for marker in markers],
+        }
+
+    def get_stations_markers_response(self):
+        """Get the stations markers, serialized once per data version.
+
+        This is a Flask route. It answers 304 Not Modified if the client has the current markers.
+        The markers of each provider, from the serving snapshot, are sent in the compact form of _compact_markers.
+        :rtype: flask.Response
+        """
+        def build(snapshot):
+            return {provider_id: self._compact_markers(markers) for provider_id, markers in snapshot.markers.items() if markers}
+
+        return payload_response(MarkersCache.get('all', build))
+
+    def get_country_markers_response(self, provider_id, cn):
+        """Get the markers of the stations of a provider in a country, serialized once per data version.
+
+        This is a Flask route. The markers, from the serving snapshot, are sent in the compact form of _compact_markers.
+        The graphs of the stations of the country are rendered first. The scheduler promotes each country once per GRAPH_INTEREST_TTL,
+        so the cached hits do not touch the database.
+        :param provider_id: the id of the provider
+        :type provider_id: int
+        :param cn: the country code
+        :type cn: str
+        :rtype: flask.Response
+        """
+        # Only known keys are cached
+        if provider_id not in ServingSnapshot.get().providers or not COUNTRY_CODE.fullmatch(cn):
+            abort(404)
+
+        get_graph_scheduler().promote_country(provider_id, cn)
+
+        def build(snapshot):
+            return self._compact_markers(snapshot.country_markers.get((provider_id, cn), ()))
+
+        return payload_response(MarkersCache.get(('country', provider_id, cn), build))
+
     def dms_to_dd(self, dms: str) -> int:
         """Convert degrees, minutes, seconds to decimal.
 
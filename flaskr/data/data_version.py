@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""Module to share the version of the data published by the ingestion."""
+# Created: lun oct 19 09:45:12 2026 (+0200)
+# Last-Updated: lun oct 19 10:08:06 2026 (+0200)
+# Filename: data_version.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import threading
+import time
+
+from db.statements import Statements
+from flask import current_app
+
+
+class DataVersion():
+    """Class to share the data version of the process, as stored in the ingestion_status table.
+
+    It is read from the database at most every DATA_VERSION_CHECK_INTERVAL seconds.
+    The caches built from the data (graphs, source files, providers...) keep the version they were built from and drop their entries when it changes.
+    """
+
+    # The last data version read
+    version = None
+
+    # Monotonic time of the last data version check
+    _checked_at = None
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def get(cls):
+        """Return the data version, reading it from the database if the last check is too old.
+
+        :rtype: int
+        """
+        with cls._lock:
+            now = time.monotonic()
+
+            if cls.version is None or now - cls._checked_at >= current_app.config['DATA_VERSION_CHECK_INTERVAL']:
+                cls.version = Statements().get_data_version()
+                cls._checked_at = now
+
+            return cls.version
+
+    @classmethod
+    def refresh(cls):
+        """Read the data version from the database now, whatever the time of the last check.
+
+        :rtype: int
+        """
+        version = Statements().get_data_version()
+
+        with cls._lock:
+            cls.version = version
+            cls._checked_at = time.monotonic()
+
+        return version
+
+    @classmethod
+    def publish(cls):
+        """Publish a new data version, once the new data is committed, so the other processes drop what they built from the previous one.
+
+        :return: the new data version.
+        :rtype: int
+        """
+        version = Statements().publish_data_version()
+
+        with cls._lock:
+            cls.version = version
+            cls._checked_at = time.monotonic()
+
+        return version
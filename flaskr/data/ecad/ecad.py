@@ -1,16 +1,29 @@
 """Facade class to the classes handling Ecad data."""
 # Created: vie jul 12 09:08:29 2024 (+0200)
-# Last-Updated: sáb nov  8 18:40:25 2025 (+0100)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
 # Filename: ecad_data.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
+import threading
+
+from data.data_version import DataVersion
 from data.ecad.ecad_get_data import EcadGetData
+from data.ecad.ecad_observations import EcadObservations
 from data.ecad.ecad_save_data import EcadSaveData
+from data.serving_snapshot import ServingSnapshot
+from db import db
+from db.query_stats import query_source
+from flask import current_app
 from graphs.ecad.ecad_graphs import EcadGraphs
+from graphs.graph_scheduler import get_graph_scheduler
 
 
 class Ecad():
     """Facade class to handle Ecad data."""
 
+    # EcadSourceFiles instances per provider id, shared by the requests rendering graphs on demand, in the form {provider_id: (data_version, source_files)}
+    loaded_source_files = {}
+    _source_files_lock = threading.Lock()
+
     def __init__(self, provider_id, provider_data):
         """Initialize class."""
         self.provider_id = provider_id
@@ -33,14 +46,42 @@ class Ecad():
         return need_to_save, what_to_save
 
     def _save_data(self, what_to_save):
-        """Save data to the database."""
+        """Save data to the database.
+
+        The stations and elements are saved in a transaction, then the source files are parsed with no transaction open,
+        and their popup markers are saved in another transaction.
+        """
         ecad_save_data = EcadSaveData(self.provider_id, self.provider_data, self)
-        self.source_files = ecad_save_data.save_data(what_to_save)
 
-    def _generate_stations_html_graphs(self):
-        """Generate the stations graphs as html files."""
-        ecad_graphs = EcadGraphs(self.provider_id, self.provider_data)
-        return ecad_graphs.generate_stations_html_graphs(self.source_files)
+        with db.unit_of_work():
+            ecad_save_data.save_data(what_to_save)
+
+        self.source_files = ecad_save_data.parse_source_files()
+
+        with db.unit_of_work():
+            ecad_save_data.save_source_popup_markers()
+
+    def _get_source_files(self):
+        """Get the parsed source files, loading them from the pickle file if this process has not done it yet for the current data version.
+
+        With GRAPH_DATA_SOURCE 'database' the values are read from the observations table instead.
+        :return: The EcadSourceFiles or EcadObservations instance object.
+        :rtype: EcadSourceFiles|EcadObservations|None
+        """
+        if current_app.config['GRAPH_DATA_SOURCE'] == 'database':
+            return EcadObservations(self.provider_id, self.provider_data)
+
+        version = DataVersion.get()
+
+        with self._source_files_lock:
+            loaded_version, source_files = Ecad.loaded_source_files.get(self.provider_id, (None, None))
+
+            if loaded_version != version:
+                ecad_save_data = EcadSaveData(self.provider_id, self.provider_data, self)
+                source_files = ecad_save_data.load_source_files()
+                Ecad.loaded_source_files[self.provider_id] = (version, source_files)
+
+            return source_files
 
     def handle_data(self):
         """Handle the Ecad datasets."""
@@ -48,5 +89,69 @@ class Ecad():
 
         # if need_to_save:
         if True:
-            self._save_data(what_to_save)
-            self._generate_stations_html_graphs()
+            with query_source(f'{self.provider}:save'):
+                self._save_data(what_to_save)
+
+            source_files = self.source_files
+
+            if current_app.config['GRAPH_DATA_SOURCE'] == 'database':
+                source_files = EcadObservations(self.provider_id, self.provider_data)
+
+                with query_source(f'{self.provider}:observations'):
+                    if need_to_save or not source_files.is_loaded():
+                        source_files.save_source_files(self.source_files)
+
+            # Publish the new data before scheduling the graphs, so the graphs rendered with the old data are dropped by every process
+            if need_to_save:
+                DataVersion.publish()
+
+            # The requests of this process render with the parsed files, without loading them again
+            with self._source_files_lock:
+                Ecad.loaded_source_files[self.provider_id] = (DataVersion.get(), self.source_files)
+
+            ecad_graphs = EcadGraphs(self.provider_id, self.provider_data)
+
+            # Render in background the most viewed and the most wanted stations first
+            with query_source(f'{self.provider}:schedule'):
+                ecad_graphs.schedule_stations_html_graphs(source_files, current_app.config['GRAPH_WARMUP_TOP_N'])
+
+    def get_station_data(self, data_station_id):
+        """Get the html graph of a station.
+
+        :param data_station_id: the id of the station in the database table
+        :type data_station_id: int
+        :return: the html of the graph or None if the station has no graph.
+        :rtype: str|None
+        """
+        cn = ServingSnapshot.get().station_countries.get(int(data_station_id))
+
+        if cn is not None:
+            get_graph_scheduler().demand(self.provider_id, int(data_station_id), cn)
+
+        return self.render_station_graph(data_station_id)
+
+    def render_station_graph(self, data_station_id, write=False):
+        """Render the html graph of a station, if it is not cached yet.
+
+        :param data_station_id: the id of the station in the database table
+        :type data_station_id: int
+        :param write: True to write the graph file even if the graph is cached in memory.
+        :type write: bool
+        :return: the html of the graph or None if the station has no graph.
+        :rtype: str|None
+        """
+        ecad_graphs = EcadGraphs(self.provider_id, self.provider_data)
+
+        return ecad_graphs.get_station_graph(data_station_id, self._get_source_files, write)
+
+    def aggregate_station(self, data_station_id):
+        """Compute and store the averages per decade of a station.
+
+        :param data_station_id: the id of the station in the database table
+        :type data_station_id: int
+        :return: the number of averages stored or None if the station has no sources.
+        :rtype: int|None
+        """
+        ecad_graphs = EcadGraphs(self.provider_id, self.provider_data)
+
+        return ecad_graphs.aggregate_station(data_station_id, self._get_source_files)
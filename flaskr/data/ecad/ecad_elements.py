@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Module to save the Ecad elements into the database."""
 # Created: lun ago  5 07:26:27 2024 (+0200)
-# Last-Updated: sáb nov  8 18:09:57 2025 (+0100)
+# Last-Updated: lun oct 19 09:25:01 2026 (+0200)
 # Filename: ecad_elements.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 from db.statements import Statements
@@ -48,23 +48,6 @@ class EcadElements():
 
         return unit, factor
 
-    def _check_element(self, eleid):
-        """Check if the element exists in the database.
-
-        :param eleid: the id of the element as stated by Ecad
-        :type eleid: str
-        :return: True if the element exists; False otherwise
-        :rtype: boolean
-        """
-        res = False
-
-        element = self.stmt.get_ecad_element(self.ecad.provider_id, self.magnitude_id, self.measurement_id, eleid)
-
-        if element and element[0][0] == eleid:
-            res = True
-
-        return res
-
     def _set_priority(self, eleid):
         """Set the priority of the element id in the database.
 
@@ -83,23 +66,24 @@ class EcadElements():
         return priority
 
     def save_data(self):
-        """Save elements into the database."""
+        """Save elements into the database.
+
+        All the elements of the file are upserted, with their priorities, in a single statement and transaction.
+        """
         if self.elements_filename.exists():
             # The description contains commas, so we can not read the file as csv
             colspecs = [(0, 5), (6, 156), (158, 169)]
             df = pd.read_fwf(self.elements_filename, header=10, encoding='ISO-8859-1', colspecs=colspecs, index_column=0)
 
             if df is not None:
-                df = df.reset_index()
-
-                for _, row in df.iterrows():
-                    eleid = row.iloc[1].strip()
-                    descr = row.iloc[2].strip()
-                    factor_unit = row.iloc[3]
+                # Keyed by element id, a statement can not upsert the same row twice
+                elements = {}
 
+                for eleid, descr, factor_unit in zip(df.iloc[:, 0].str.strip(), df.iloc[:, 1].str.strip(), df.iloc[:, 2]):
                     unit, factor = self._get_unit_factor(factor_unit)
 
                     priority = self._set_priority(eleid)
 
-                    if self._check_element(eleid) is False:
-                        self.stmt.insert_ecad_element(self.ecad.provider_id, self.magnitude_id, self.measurement_id, eleid, descr, unit, factor, priority)
+                    elements[eleid] = (eleid, descr, unit, factor, priority)
+
+                self.stmt.upsert_ecad_elements(self.ecad.provider_id, self.magnitude_id, self.measurement_id, list(elements.values()))
@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+"""Module to copy the Ecad daily values to the observations table and read them back."""
+# Created: lun oct 19 14:37:05 2026 (+0200)
+# Last-Updated: lun oct 19 10:13:50 2026 (+0200)
+# Filename: ecad_observations.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import io
+import math
+from datetime import datetime, timezone
+
+from data.averages import Average
+
+from db import db
+from db.statements import Statements
+
+from flask import current_app
+
+import pandas as pd
+
+
+class EcadObservation():
+    """The valid daily values of a measurement of a station, read from the observations table.
+
+    It offers the start, end and read interface of EcadSourceFile, so graphs can be built from any of them.
+    """
+
+    def __init__(self, days, values):
+        """Initialize the class.
+
+        :param days: the days with valid data, sorted.
+        :type days: list
+        :param values: the value of each day.
+        :type values: list
+        """
+        self._days = days
+        self._values = values
+        self._start_valid_data_date = self._to_datetime(days[0])
+        self._end_valid_data_date = self._to_datetime(days[-1])
+
+    def _to_datetime(self, day):
+        """Convert a date to a datetime in UTC, as EcadSourceFile dates."""
+        return datetime(day.year, day.month, day.day, 0, 0, 0, 0, tzinfo=timezone.utc)
+
+    @property
+    def start(self):
+        """Return the date where first valid data is detected."""
+        return self._start_valid_data_date
+
+    @start.setter
+    def start(self, date_start):
+        """Set the start valid date."""
+        self._start_valid_data_date = date_start
+
+    @property
+    def end(self):
+        """Return the date where last valid data is detected."""
+        return self._end_valid_data_date
+
+    @end.setter
+    def end(self, date_end):
+        """Set the end valid date."""
+        self._end_valid_data_date = date_end
+
+    def read(self, compute_averages=True):
+        """Get the values between the start and end dates.
+
+        :param compute_averages: False to skip the averages, when they are already computed.
+        :type compute_averages: bool
+        :return: the same as EcadSourceFile.read: the dates, the values (NaN if missing) and the averages.
+        :rtype: tuple
+        """
+        dates = pd.date_range(self._start_valid_data_date, self._end_valid_data_date, freq='D', tz='UTC').to_pydatetime().tolist()
+
+        values = [math.nan for i in range(len(dates))]
+
+        meas_average = Average() if compute_averages else None
+
+        for day, value in zip(self._days, self._values):
+            meas_date = self._to_datetime(day)
+            ind = (meas_date - self._start_valid_data_date).days
+
+            if 0 <= ind < len(dates):
+                values[ind] = value
+
+                # compute average
+                if meas_average is not None:
+                    meas_average.set_value(meas_date, value)
+
+        return dates, values, meas_average.calculate_averages() if meas_average is not None else None
+
+
+class EcadObservations():
+    """Class to copy the parsed Ecad source files to the observations table and read them back.
+
+    It offers the get_source_files interface of EcadSourceFiles, so graphs can be rendered
+    by any node with access to the database, without the data files.
+    """
+
+    def __init__(self, provider_id, provider_data):
+        """Initialize the class."""
+        self.provider_id = provider_id
+        self.provider = provider_data['name']
+        self.magnitudes = provider_data['magnitudes']
+
+        # Names of the measurements by id, in the order the source files are parsed
+        self.measurements = {}
+
+        for magnitude in self.magnitudes.values():
+            self.measurements.update(magnitude['measurements'])
+
+        self._partitions = set()
+
+    def _write_station(self, stmt, station_id, ecad_source_files):
+        """Replace the observations of a station with the values of its source files.
+
+        :return: the number of rows copied.
+        :rtype: int
+        """
+        frames = []
+
+        for ecad_file in ecad_source_files.values():
+            if ecad_file.factor is None:
+                current_app.logger.warning(f'{self.provider.title()}: {ecad_file.filepath} has no factor, its observations are not saved')
+                continue
+
+            df = ecad_file.observations()
+            df.insert(0, 'measurement_id', ecad_file.meas_id)
+            frames.append(df)
+
+        if not frames:
+            return 0
+
+        df = pd.concat(frames, ignore_index=True)
+        df.insert(0, 'station_id', station_id)
+        df.insert(0, 'provider_id', self.provider_id)
+
+        missing = set((df['day'] // 100000 * 10).unique().tolist()) - self._partitions
+
+        if missing:
+            raise ValueError(f'No partition of the observations for the decades {sorted(missing)}')
+
+        # The days are written as YYYYMMDD, which PostgreSQL reads as dates
+        buffer = io.StringIO()
+        df.to_csv(buffer, sep='\t', header=False, index=False, na_rep='\\N')
+        buffer.seek(0)
+
+        return stmt.replace_station_observations(self.provider_id, station_id, buffer)
+
+    def _create_partitions(self, stmt, source_files):
+        """Create the partitions of the observations table the source files need, in their own transaction.
+
+        :param source_files: The EcadSourceFiles instance object.
+        :type source_files: EcadSourceFiles
+        """
+        decades = set()
+
+        for ecad_source_files in source_files.station_source_files.values():
+            for ecad_file in ecad_source_files.values():
+                if ecad_file.factor is None:
+                    continue
+
+                try:
+                    first_day, last_day = ecad_file.day_range()
+                except (OSError, IndexError, ValueError):
+                    current_app.logger.warning(f'{self.provider.title()}: Could not read the days of {ecad_file.filepath}')
+                    continue
+
+                decades.update(range(first_day // 100000 * 10, last_day // 100000 * 10 + 1, 10))
+
+        decades -= self._partitions
+
+        if decades:
+            stmt.ensure_observations_partitions(self.provider_id, sorted(decades))
+            self._partitions.update(decades)
+
+    def save_source_files(self, source_files):
+        """Copy the daily values of all the parsed source files to the observations table.
+
+        The partitions are created first, in their own transaction, so the copy does not lock the observations table.
+        Then the stations are copied in batches of OBSERVATIONS_BATCH_SIZE, one transaction per batch.
+        Each station runs in a savepoint: a station which can not be copied keeps its old values.
+        :param source_files: The EcadSourceFiles instance object.
+        :type source_files: EcadSourceFiles
+        """
+        stmt = Statements()
+        rows = 0
+
+        self._create_partitions(stmt, source_files)
+
+        stations = list(source_files.station_source_files.items())
+        batch_size = current_app.config['OBSERVATIONS_BATCH_SIZE']
+
+        current_app.logger.info(f'{self.provider.title()}: Copying observations of {len(stations)} stations')
+
+        for start in range(0, len(stations), batch_size):
+            with db.unit_of_work():
+                for station_id, ecad_source_files in stations[start:start + batch_size]:
+                    try:
+                        with db.unit_of_work():
+                            rows += self._write_station(stmt, int(station_id), ecad_source_files)
+                    except Exception:
+                        current_app.logger.exception(f'{self.provider.title()}: Could not copy the observations of station {station_id}')
+
+        current_app.logger.info(f'{self.provider.title()}: {rows} observations copied')
+
+    def is_loaded(self):
+        """Check if the observations of the provider have been copied.
+
+        :rtype: bool
+        """
+        stmt = Statements()
+
+        return stmt.has_observations(self.provider_id)
+
+    def get_source_files(self, station_id):
+        """Get the observations of a station for each measurement.
+
+        :param station_id: the provider's id for the station.
+        :type station_id: int
+        :return: A dict containing the EcadObservation instances for each measurement name.
+        :rtype: dict|None
+        """
+        stmt = Statements()
+        rows = stmt.get_station_observations(self.provider_id, int(station_id))
+
+        if not rows:
+            return None
+
+        measurements = {}
+
+        for measurement_id, day, value in rows:
+            if measurement_id not in measurements:
+                measurements[measurement_id] = ([], [])
+
+            measurements[measurement_id][0].append(day)
+            measurements[measurement_id][1].append(value)
+
+        ecad_observations = {}
+
+        for measurement_id, measurement in self.measurements.items():
+            if measurement_id in measurements:
+                ecad_observations[measurement] = EcadObservation(*measurements[measurement_id])
+
+        if not ecad_observations:
+            return None
+
+        # The graph lines need the same dates. EcadSourceFiles._normalize_dates sets every measurement to the latest start
+        # and the latest end of all of them (max for both, not min for the start), so the graphs read from the database and
+        # from the files cover the same days: values before the latest start are dropped, days after an earlier end are NaN
+        date_start = max(observation.start for observation in ecad_observations.values())
+        date_end = max(observation.end for observation in ecad_observations.values())
+
+        for observation in ecad_observations.values():
+            observation.start = date_start
+            observation.end = date_end
+
+        return ecad_observations
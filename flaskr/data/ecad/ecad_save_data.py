@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Module to save Ecad data into the database."""
 # Created: dom sep 22 12:53:18 2024 (+0200)
-# Last-Updated:
+# Last-Updated: lun oct 19 09:58:32 2026 (+0200)
 # Filename: ecad_save_data.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 import pickle
@@ -62,32 +62,91 @@ class EcadSaveData(EcadHandleData):
 
         self.source_files = source_files
 
-    def save_data(self, what_to_save):
-        """Save Ecad data."""
-        curr_file_date = None
+    def load_source_files(self):
+        """Load the parsed source files of the current data, parsing them if they were not serialized.
+
+        :return: The EcadSourceFiles instance object or None if there is no current data.
+        :rtype: EcadSourceFiles|None
+        """
+        for magnitude_id in self.magnitudes.keys():
+            magnitude = self.magnitudes[magnitude_id]['name']
+
+            for measurement in self.magnitudes[magnitude_id]['measurements'].values():
+                curr_file_date = self.get_ecad_data_timestamp(self.current_data_dir / magnitude / measurement / self.ecad_date_filename)
+
+                if curr_file_date is not None:
+                    self._serialize_unserialize_sources(curr_file_date)
+
+                    return self.source_files
+
+        return None
+
+    def _save_stations(self, what_to_save):
+        """Save the new stations of all the stations files to be saved at once.
+
+        :param what_to_save: the data to be saved per provider, magnitude and measurement.
+        :type what_to_save: dict
+        """
+        stations_filenames = []
+
+        for magnitude_id in self.magnitudes.keys():
+            magnitude = self.magnitudes[magnitude_id]['name']
+
+            for measurement in self.magnitudes[magnitude_id]['measurements'].values():
+                if self.provider in what_to_save and magnitude_id in what_to_save[self.provider] and measurement in what_to_save[self.provider][magnitude_id]:
+                    if what_to_save[self.provider][magnitude_id][measurement]['stations'] is True:
+                        stations_filenames.append(self.current_data_dir / magnitude / measurement / 'stations.txt')
+
+        if stations_filenames:
+            current_app.logger.info(f'{self.provider.title()}: Saving Stations from {len(stations_filenames)} files')
+
+            t1 = time.time()
+
+            ecad_stations = EcadStations(self.provider_id, self.provider_data)
+            inserted = ecad_stations.save_stations(stations_filenames)
+
+            t2 = time.time()
+            current_app.logger.info(f'{self.provider.title()}: {inserted} stations added. Elapsed time: {timedelta(seconds=t2 - t1)}')
+
+    def parse_source_files(self):
+        """Parse the source files of the current data, or load them if they were serialized.
+
+        It runs outside any unit of work, so no transaction is kept open while parsing,
+        after the one of save_data, because the factors of the files are read from the saved elements.
+        :return: The EcadSourceFiles instance object or None if there is no current data.
+        :rtype: EcadSourceFiles|None
+        """
+        if not self.current_data_dir.exists():
+            return None
 
+        current_app.logger.info(f'{self.provider.title()} Parsing source files')
+
+        t1 = time.time()
+
+        self.load_source_files()
+
+        t2 = time.time()
+
+        # End the transaction of the factor lookups, so it is not left open
+        self.stmt.commit()
+
+        if self.source_files is not None:
+            current_app.logger.info(f'{self.provider.title()}: {self.source_files.num_files_processed} files processed, {self.source_files.num_files_added} files added to pickle file. Elapsed time: {timedelta(seconds=t2 - t1)}')
+
+        return self.source_files
+
+    def save_data(self, what_to_save):
+        """Save the stations and elements of the Ecad data."""
         if self.current_data_dir.exists():
+            self._save_stations(what_to_save)
+
             for magnitude_id in self.magnitudes.keys():
                 magnitude = self.magnitudes[magnitude_id]['name']
 
                 for measurement_id, measurement in self.magnitudes[magnitude_id]['measurements'].items():
-                    stations_filename = self.current_data_dir / magnitude / measurement / 'stations.txt'
                     elements_filename = self.current_data_dir / magnitude / measurement / 'elements.txt'
 
-                    if curr_file_date is None:
-                        curr_file_date = self.get_ecad_data_timestamp(self.current_data_dir / magnitude / measurement / self.ecad_date_filename)
-
                     if self.provider in what_to_save and magnitude_id in what_to_save[self.provider] and measurement in what_to_save[self.provider][magnitude_id]:
-                        # Save stations first
-                        if what_to_save[self.provider][magnitude_id][measurement]['stations'] is True:
-                            if stations_filename.exists():
-                                current_app.logger.info(f'{self.provider.title()} {magnitude} {measurement}: Saving Stations')
-
-                                ecad_stations = EcadStations(self.provider_id, self.provider_data, stations_filename=stations_filename, measurement=measurement)
-                                ecad_stations.save_data()
-                            else:
-                                current_app.logger.error(f"stations filename {stations_filename} does not exist")
-
                         # Save elements
                         if what_to_save[self.provider][magnitude_id][measurement]['elements'] is True:
                             if elements_filename.exists():
@@ -99,20 +158,9 @@ class EcadSaveData(EcadHandleData):
                                 ecad_elements = EcadElements(self.ecad, elements_filename, magnitude_id, measurement_id)
                                 ecad_elements.save_data()
 
-                # Process sources
-                # if what_to_save[self.provider]['sources'] is True:
-                if True:
-                    current_app.logger.info(f'{self.provider.title()} Parsing source files')
-
-                    t1 = time.time()
-
-                    self._serialize_unserialize_sources(curr_file_date)
-
-                    t2 = time.time()
-                    current_app.logger.info(f'{self.provider.title()}: {self.source_files.num_files_processed} files processed, {self.source_files.num_files_added} files added to pickle file. Elapsed time: {timedelta(seconds=t2 - t1)}')
-
-                    current_app.logger.info(f'{self.provider.title()}: Saving source popup markers')
-                    ecad_stations = EcadStations(self.provider_id, self.provider_data)
-                    ecad_stations.save_source_popup_markers(self.source_files)
-
-        return self.source_files
+    def save_source_popup_markers(self):
+        """Save the popup markers of the source files parsed with parse_source_files."""
+        if self.source_files is not None:
+            current_app.logger.info(f'{self.provider.title()}: Saving source popup markers')
+            ecad_stations = EcadStations(self.provider_id, self.provider_data)
+            ecad_stations.save_source_popup_markers(self.source_files)
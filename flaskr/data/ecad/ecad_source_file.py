@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Class representing an ecad file with source data."""
 # Created: jue sep 12 08:56:31 2024 (+0200)
-# Last-Updated: sáb nov 15 12:48:48 2025 (+0100)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
 # Filename: ecad_source_files.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 import math
@@ -123,6 +123,11 @@ class EcadSourceFile():
         """Return the measurement id."""
         return self._measurement_id
 
+    @property
+    def factor(self):
+        """Return the factor to multiply the values by."""
+        return self._factor
+
     @property
     def par_name(self):
         """Return the participant name."""
@@ -205,8 +210,51 @@ class EcadSourceFile():
         self._get_source_data()
         self._get_factor_unit()
 
-    def read(self):
-        """Read the data from file."""
+    def observations(self):
+        """Read all the daily values of the file, to be copied to the observations table.
+
+        :return: the columns day (int in the form YYYYMMDD), value (multiplied by the factor, NaN if missing) and quality.
+        :rtype: pandas.DataFrame
+        """
+        column_names = ['    DATE', f'   {self._measurement_alias}', f' Q_{self._measurement_alias}']
+
+        df = pd.read_csv(self._filepath, header=13, encoding='ISO-8859-1', usecols=column_names)
+        df = df.rename(columns=lambda x: x.strip())
+
+        values = df[self._measurement_alias]
+
+        return pd.DataFrame({
+            'day': df['DATE'],
+            'value': values.where(values != -9999) * self._factor,
+            'quality': df[f'Q_{self._measurement_alias}'],
+        })
+
+    def day_range(self):
+        """Read the first and last days of the file, valid or not, without parsing it.
+
+        :return: the first and last days as int in the form YYYYMMDD.
+        :rtype: tuple
+        """
+        with open(self._filepath, 'rb') as f:
+            # The first data line is the first one starting with the station id, after the description and the header
+            for first_line in f:
+                if first_line.split(b',')[0].strip().isdigit():
+                    break
+
+            size = f.seek(0, 2)
+            f.seek(max(0, size - 256))
+            last_line = [line for line in f.read().splitlines() if line.strip()][-1]
+
+        return int(first_line.split(b',')[2]), int(last_line.split(b',')[2])
+
+    def read(self, compute_averages=True):
+        """Read the data from file.
+
+        :param compute_averages: False to skip the averages, when they are already computed.
+        :type compute_averages: bool
+        :return: the dates, the values (NaN if missing) and the averages per decade, or None if not computed.
+        :rtype: tuple
+        """
         # Generate the list of dates using pandas date_range function
         # and convert the result to a list of datetime objects
         dates = pd.date_range(self._start_valid_data_date, self._end_valid_data_date, freq='D', tz='UTC').to_pydatetime().tolist()
@@ -224,6 +272,8 @@ class EcadSourceFile():
         # The values list has to had equal number of elements than the dates list
         values = [math.nan for i in range(len(dates))]
 
+        meas_average = Average() if compute_averages else None
+
         # Iterate on data
         for _, row in df.iterrows():
             # Get the date
@@ -252,10 +302,9 @@ class EcadSourceFile():
                             values[ind] = meas_value
 
                             # compute average
-                            Average.set_value(meas_date, meas_value)
+                            if meas_average is not None:
+                                meas_average.set_value(meas_date, meas_value)
                         except ValueError:
                             pass
 
-        average = Average.calculate_averages()
-
-        return dates, values, average
+        return dates, values, meas_average.calculate_averages() if meas_average is not None else None
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """Class to manage all data regarding meteorological stations."""
 # Created: vie jul 19 13:29:08 2024 (+0200)
-# Last-Updated: sáb nov  8 17:51:06 2025 (+0100)
+# Last-Updated: lun oct 19 09:55:16 2026 (+0200)
 # Filename: ecad_stations.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 from db.statements import Statements
@@ -55,33 +55,70 @@ class EcadStations():
 
         return dd
 
-    def save_data(self):
-        """Save the data from the station to the database."""
-        if self.stations_filename.exists():
-            df = pd.read_csv(self.stations_filename, header=13, encoding='UTF-8')
-            df = df.rename(columns=lambda x: x.strip())
+    def dms_series_to_dd(self, dms):
+        """Convert a column of degrees, minutes, seconds to decimal, as dms_to_dd does for a single value.
 
-            if df is not None:
-                df = df.reset_index()
+        :param dms: strings containing the degrees, minutes and seconds in the format: degrees:minutes:seconds
+        :type dms: pandas.Series
+        :returns: The decimal translation of the values.
+        :rtype: pandas.Series
+        """
+        dms = dms.str.strip()
+        dms_split = dms.str.split(':', expand=True).astype(float)
+
+        # Minutes and seconds take the sign of the degrees, even of -0 degrees
+        sign = dms.str.startswith('-').map({True: -1.0, False: 1.0})
+
+        return dms_split[0] + sign * (dms_split[1] / 60 + dms_split[2] / 3600)
+
+    def _read_stations(self, stations_filename):
+        """Read a stations file.
+
+        :param stations_filename: path to the file containing the station data.
+        :type stations_filename: pathlib.Path
+        :returns: The stations, with the coordinates in decimal format.
+        :rtype: pandas.DataFrame
+        """
+        df = pd.read_csv(stations_filename, header=13, encoding='UTF-8')
+        df = df.rename(columns=lambda x: x.strip())
 
-                for _, row in df.iterrows():
-                    staid = row['STAID']
-                    staname = row['STANAME'].strip()
-                    cn = row['CN'].strip()
-                    dmslat = row['LAT'].strip()
-                    dmslon = row['LON'].strip()
-                    height = row['HGHT']
+        df['STANAME'] = df['STANAME'].str.strip()
+        df['CN'] = df['CN'].str.strip()
+        df['LAT'] = self.dms_series_to_dd(df['LAT'])
+        df['LON'] = self.dms_series_to_dd(df['LON'])
 
-                    # Convert dms to dec
-                    lat = self.dms_to_dd(dmslat)
-                    lon = self.dms_to_dd(dmslon)
+        return df[['STAID', 'STANAME', 'CN', 'LAT', 'LON', 'HGHT']]
 
-                    station_data = self.stmt.check_station(self.provider_id, staid)
+    def save_stations(self, stations_filenames):
+        """Save the new stations of several stations files to the database.
 
-                    if not station_data:
-                        self.stmt.insert_station(self.provider_id, staid, staname, cn, lat, lon, height)
-        else:
-            current_app.logger.error(f'stations filename {self.stations_filename} does not exist')
+        The files are deduplicated by STAID, diffed against the stations already saved
+        and the new ones are inserted with a single statement and transaction.
+        :param stations_filenames: paths to the files containing the station data.
+        :type stations_filenames: list
+        :returns: The number of stations inserted.
+        :rtype: int
+        """
+        dfs = []
+
+        for stations_filename in stations_filenames:
+            if stations_filename.exists():
+                dfs.append(self._read_stations(stations_filename))
+            else:
+                current_app.logger.error(f'stations filename {stations_filename} does not exist')
+
+        if not dfs:
+            return 0
+
+        df = pd.concat(dfs, ignore_index=True).drop_duplicates('STAID')
+
+        existing = self.stmt.get_station_ids(self.provider_id)
+        df = df[~df['STAID'].isin(existing)]
+
+        # tolist converts the numpy values to python types, which psycopg2 can adapt
+        stations = list(zip(df['STAID'].tolist(), df['STANAME'].tolist(), df['CN'].tolist(), df['LAT'].tolist(), df['LON'].tolist(), df['HGHT'].tolist()))
+
+        return self.stmt.insert_stations(self.provider_id, stations)
 
     def _get_marker_source_data(self, ecad_source_files):
         """Extract source information to place it in the marker information shown when marker gets clicked.
@@ -142,9 +179,10 @@ class EcadStations():
         :param source_files: instance of EcadSourceFiles
         :type source_files: EcadSourceFiles
         """
-        stations = self.stmt.get_stations_data(self.provider_id)
+        # Changed popups in the form (data_station_id, popup), updated once all the stations are read
+        popups = []
 
-        for row in stations:
+        for row in self.stmt.iter_stations_data(self.provider_id):
             data_station_id = row[0]
             station_id = row[1]
             staname = row[2].replace("'", "\'")
@@ -161,4 +199,7 @@ class EcadStations():
 
                 popup = f'Station: {data_station_id} - {staname} - {cn} - Height: {height}<br/>{source_popup}<br/><br/>{anchor}'
 
-                self.stmt.update_source_popup_marker(popup, data_station_id)
+                if popup != row[7]:
+                    popups.append((data_station_id, popup))
+
+        self.stmt.update_source_popup_markers(popups)
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""Worker draining the jobs table. Any number of them can run, in this host or in other nodes."""
+# Created: lun oct 19 11:36:27 2026 (+0200)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
+# Filename: job_worker.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import socket
+import time
+
+import click
+from data.data import Data
+from data.data_version import DataVersion
+from db.query_stats import query_source
+from db.statements import Statements
+from flask import current_app
+from flask.cli import with_appcontext
+from graphs.graph_scheduler import BULK, POPULAR
+
+
+def _check_station(data_station_id):
+    """Read the current data version and check the station of a job exists.
+
+    The station is looked up in PostgreSQL, with the current data version, instead of the serving snapshot,
+    which may not have the stations of a data version published during the last DATA_VERSION_CHECK_INTERVAL.
+    :param data_station_id: the id of the station in the database table.
+    :type data_station_id: int
+    :raises LookupError: if the station is not found, so the job is retried.
+    """
+    DataVersion.refresh()
+
+    if Statements().get_station_data_by_id(data_station_id) is None:
+        raise LookupError(f'Station {data_station_id} not found')
+
+
+def _aggregate_station(provider_id, data_station_id):
+    """Compute the averages per decade of a station, stored for the graph jobs.
+
+    :param provider_id: the id of the provider.
+    :type provider_id: int
+    :param data_station_id: the id of the station in the database table.
+    :type data_station_id: int
+    :raises LookupError: if the station is not found, so the job is retried.
+    """
+    _check_station(data_station_id)
+
+    data = Data()
+
+    if data.aggregate_station(data_station_id, provider_id) is None:
+        current_app.logger.warning(f'Station {data_station_id} has no data to compute its averages')
+
+
+def _render_station_graph(provider_id, data_station_id):
+    """Render the graph of a station, writing its file even if this worker has it in memory, so other processes find it on disk.
+
+    :param provider_id: the id of the provider.
+    :type provider_id: int
+    :param data_station_id: the id of the station in the database table.
+    :type data_station_id: int
+    :raises LookupError: if the station is not found, so the job is retried.
+    """
+    _check_station(data_station_id)
+
+    data = Data()
+
+    if data.render_station_graph(data_station_id, write=True, provider_id=provider_id) is None:
+        current_app.logger.warning(f'Station {data_station_id} has no data to render its graph')
+
+
+class JobWorker():
+    """Claim jobs from the jobs table and run them.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait for each other.
+    A claimed job is leased to the worker; if the worker dies, the job is claimed again when the lease expires.
+    """
+
+    # Functions running each kind of job, called as handler(provider_id, data_station_id)
+    handlers = {
+        'station_aggregates': _aggregate_station,
+        'station_graph': _render_station_graph,
+    }
+
+    def __init__(self, worker_id=None):
+        """Initialize the class.
+
+        :param worker_id: the identifier of the worker. Defaults to host:pid.
+        :type worker_id: str|None
+        """
+        self.worker_id = worker_id if worker_id else f'{socket.gethostname()}:{os.getpid()}'
+        self.lease_seconds = current_app.config['JOB_LEASE_SECONDS']
+        self.poll_interval = current_app.config['JOB_POLL_INTERVAL']
+        self.retry_delay = current_app.config['JOB_RETRY_DELAY']
+        self.max_priority = BULK if current_app.config['PRERENDER_GRAPHS'] else POPULAR
+
+    def run_once(self):
+        """Claim and run one job.
+
+        :return: True if a job was claimed, False if there was nothing to run.
+        :rtype: bool
+        """
+        stmt = Statements()
+        job = stmt.claim_job(self.worker_id, self.lease_seconds, self.max_priority)
+
+        if job is None:
+            return False
+
+        job_id, kind, provider_id, data_station_id, attempts = job
+
+        try:
+            handler = self.handlers[kind]
+
+            with query_source(f'job:{kind}'):
+                handler(provider_id, data_station_id)
+        except Exception as e:
+            current_app.logger.exception(f'Job {job_id} ({kind} {data_station_id}) failed, attempt {attempts}')
+            stmt.rollback()
+            stmt.fail_job(job_id, self.worker_id, f'{type(e).__name__}: {e}', self.retry_delay)
+        else:
+            if stmt.complete_job(job_id, self.worker_id) == 0:
+                current_app.logger.warning(f'Job {job_id} ({kind} {data_station_id}) finished after its lease expired')
+
+        return True
+
+    def run(self):
+        """Run jobs until interrupted, waiting poll_interval seconds when the queue is empty."""
+        current_app.logger.info(f'Worker {self.worker_id} started. Jobs: {Statements().count_jobs()}')
+
+        while True:
+            with current_app.app_context():
+                if not self.run_once():
+                    Statements().cleanup_jobs(current_app.config['JOB_KEEP_DAYS'])
+                    time.sleep(self.poll_interval)
+
+
+@click.command('run-worker')
+@click.option('--worker-id', default=None, help='Identifier of the worker. Defaults to host:pid.')
+@with_appcontext
+def run_worker_command(worker_id):
+    """
+    Run a worker draining the jobs table.
+
+    Use command: export PYTHONPATH=/path/to/flaskr_directory; flask --app flaskr/app run-worker. Enable JOB_QUEUE_ENABLED in the config of the web app to queue the jobs.
+    """
+    worker = JobWorker(worker_id)
+
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        click.echo(f'Worker {worker.worker_id} stopped.')
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""Module to write the stations markers as a static pyramid of z/x/y tiles."""
+# Created: lun oct 19 09:38:10 2026 (+0200)
+# Last-Updated: lun oct 19 09:38:52 2026 (+0200)
+# Filename: marker_tiles.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import gzip
+import hashlib
+import json
+import os
+
+import click
+from data.data import Data
+from data.station_grid import StationGrid
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Hash of the content of each tile written, by tile path
+MANIFEST = 'manifest.json'
+
+
+def _write_file(path, content):
+    """Write a file through a temporary one, so readers never see it partially written."""
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def build_marker_tiles(tiles_dir, stations_markers, grid, max_zoom):
+    """Write the clustered markers of each tile with stations, from zoom 0 to max_zoom, as <provider_id>/<z>/<x>/<y>.json.
+
+    Each tile is also written gzipped (.json.gz) for web servers sending precompressed files.
+    The tiles are computed in memory, but only the ones whose content changed are written, and the ones left without stations are removed.
+    :param tiles_dir: the root directory of the pyramid.
+    :type tiles_dir: Path
+    :param stations_markers: the markers of all the stations, as returned by Data.get_stations_markers.
+    :type stations_markers: dict
+    :param grid: the number of clustering cells per tile side.
+    :type grid: int
+    :param max_zoom: the highest zoom of the pyramid, from which the stations are not clustered.
+    :type max_zoom: int
+    :return: the number of tiles written and removed.
+    :rtype: tuple
+    """
+    manifest_path = tiles_dir / MANIFEST
+
+    try:
+        old_manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        old_manifest = {}
+
+    manifest = {}
+    written = 0
+
+    cells = StationGrid.index(stations_markers)
+
+    for provider_id in stations_markers:
+        for z in range(max_zoom + 1):
+            for x, y in StationGrid.tiles(cells, provider_id, z):
+                tile = f'{provider_id}/{z}/{x}/{y}'
+                body = json.dumps(StationGrid.cluster(cells, provider_id, z, x, y, grid, max_zoom), separators=(',', ':')).encode('utf-8')
+                digest = hashlib.sha1(body).hexdigest()
+
+                manifest[tile] = digest
+
+                if old_manifest.get(tile) == digest:
+                    continue
+
+                path = tiles_dir / f'{tile}.json'
+                path.parent.mkdir(parents=True, exist_ok=True)
+
+                _write_file(path, body)
+                _write_file(path.with_name(f'{path.name}.gz'), gzip.compress(body, 9, mtime=0))
+                written += 1
+
+    removed = 0
+
+    for tile in old_manifest.keys() - manifest.keys():
+        for suffix in ('.json', '.json.gz'):
+            (tiles_dir / f'{tile}{suffix}').unlink(missing_ok=True)
+
+        removed += 1
+
+    tiles_dir.mkdir(parents=True, exist_ok=True)
+    _write_file(manifest_path, json.dumps(manifest, sort_keys=True).encode('utf-8'))
+
+    return written, removed
+
+
+def build_current_marker_tiles():
+    """Write the marker tiles of the current stations to MARKER_TILES_LOCATION.
+
+    :return: the number of tiles written and removed.
+    :rtype: tuple
+    """
+    data = Data()
+    data.initialize_providers()
+
+    config = current_app.config
+
+    return build_marker_tiles(config['MARKER_TILES_LOCATION'], data.get_stations_markers(), config['CLUSTER_GRID_SIZE'], config['CLUSTER_MAX_ZOOM'])
+
+
+@click.command('build-marker-tiles')
+@with_appcontext
+def build_marker_tiles_command():
+    """
+    Write the static pyramid of marker tiles the map reads when MARKER_TILES_ENABLED is set.
+
+    Use command: export PYTHONPATH=/path/to/flaskr_directory; flask --app flaskr/app build-marker-tiles. The ingestion leader also builds it after each ingestion if MARKER_TILES_ENABLED is set.
+    """
+    try:
+        written, removed = build_current_marker_tiles()
+        click.echo(f'Marker tiles built in {current_app.config["MARKER_TILES_LOCATION"]}: {written} written, {removed} removed.')
+    except Exception as e:
+        click.echo(f'Failed to build marker tiles: {e}')
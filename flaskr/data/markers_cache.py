@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""Module to cache the serialized stations markers per data version."""
+# Created: lun oct 19 09:35:02 2026 (+0200)
+# Last-Updated: lun oct 19 09:42:32 2026 (+0200)
+# Filename: markers_cache.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+from data.serving_snapshot import ServingSnapshot
+from flask import Response, current_app, request
+
+# A serialized payload: its strong ETag, the JSON bytes and the same bytes gzipped
+MarkersPayload = namedtuple('MarkersPayload', ['version', 'etag', 'body', 'gzip_body'])
+
+
+def build_payload(version, value):
+    """Serialize a value to JSON once, with its ETag and its gzipped bytes.
+
+    :param version: the data version the value was built from.
+    :type version: int
+    :param value: the value to serialize.
+    :type value: dict|list
+    :rtype: MarkersPayload
+    """
+    body = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    etag = f'{version}-{hashlib.sha1(body).hexdigest()[:16]}'
+
+    return MarkersPayload(version, etag, body, gzip.compress(body, 6))
+
+
+def payload_response(payload):
+    """Build the response of a payload for the current request.
+
+    The gzipped bytes are sent to clients accepting them, and 304 Not Modified if the client has them already.
+    :param payload: the payload.
+    :type payload: MarkersPayload
+    :rtype: flask.Response
+    """
+    gzipped = 'gzip' in request.accept_encodings
+
+    # Each representation has its own strong ETag
+    etag = f'{payload.etag}-gz' if gzipped else payload.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload.gzip_body if gzipped else payload.body, mimetype='application/json')
+
+        if gzipped:
+            response.content_encoding = 'gzip'
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+
+    # Clients keep the payload but check its ETag before using it
+    response.cache_control.no_cache = True
+
+    return response
+
+
+class MarkersCache():
+    """Class to share the serialized stations markers of the process.
+
+    Each set of markers (all of them, the ones of a country, the clusters of a tile...) is built once per data version,
+    from the ServingSnapshot of that version, so most requests only read the cached bytes.
+    Up to MARKERS_CACHE_MAX_ENTRIES sets are kept, the least recently used are dropped.
+    """
+
+    # The data version the payloads were built from
+    version = None
+
+    # Payloads by key, the least recently used first
+    payloads = OrderedDict()
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def get(cls, key, build):
+        """Return the serialized markers of the current data version, building them if needed.
+
+        :param key: the key of the set of markers.
+        :type key: hashable
+        :param build: function returning the markers from the ServingSnapshot it receives, only called when they are not cached for its data version.
+        :type build: callable
+        :rtype: MarkersPayload
+        """
+        snapshot = ServingSnapshot.get()
+
+        with cls._lock:
+            if snapshot.version != cls.version:
+                cls.payloads = OrderedDict()
+                cls.version = snapshot.version
+
+            if key in cls.payloads:
+                cls.payloads.move_to_end(key)
+            else:
+                cls.payloads[key] = build_payload(snapshot.version, build(snapshot))
+
+                while len(cls.payloads) > current_app.config['MARKERS_CACHE_MAX_ENTRIES']:
+                    cls.payloads.popitem(last=False)
+
+            return cls.payloads[key]
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+"""Module to cache the providers, magnitudes and measurements tree."""
+# Created: lun oct 19 14:02:48 2026 (+0200)
+# Last-Updated: lun oct 19 09:56:06 2026 (+0200)
+# Filename: providers_catalogue.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import threading
+from types import MappingProxyType
+
+from data.data_version import DataVersion
+from db.statements import Statements
+
+
+def _freeze(value):
+    """Return a read only view of a tree of dictionaries."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+
+    return value
+
+
+def _thaw(value):
+    """Return a mutable copy of a frozen tree of dictionaries."""
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+
+    return value
+
+
+class ProvidersCatalogue():
+    """Class to share the providers data of the process.
+
+    The tree is loaded once per data version and kept read only, so Data, OSMap and every request use the same object.
+    Every process reloads it when the ingestion publishes a new data version, and the ingestion leader also after invalidate is called.
+    """
+
+    # Read only providers data, as returned by Statements.get_providers_data
+    providers = None
+
+    # The data version the providers data was loaded for
+    version = None
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def get(cls):
+        """Return the providers data, loading it if needed.
+
+        :return: read only mapping in the form {provider_id: {'name': ..., 'magnitudes': {...}, ...}}
+        :rtype: types.MappingProxyType
+        """
+        version = DataVersion.get()
+
+        with cls._lock:
+            if cls.providers is None or cls.version != version:
+                stmt = Statements()
+                cls.providers = _freeze(stmt.get_providers_data())
+                cls.version = version
+
+            return cls.providers
+
+    @classmethod
+    def get_provider(cls, provider_id):
+        """Return a mutable copy of the data of a provider.
+
+        Provider instances add their directories to it and pickle it, which a read only mapping does not allow.
+        :param provider_id: the id of the provider
+        :type provider_id: int
+        :return: the provider data or None if it does not exist.
+        :rtype: dict|None
+        """
+        provider_data = cls.get().get(provider_id)
+
+        return _thaw(provider_data) if provider_data is not None else None
+
+    @classmethod
+    def invalidate(cls):
+        """Drop the cached data, so it is loaded again on next use."""
+        with cls._lock:
+            cls.providers = None
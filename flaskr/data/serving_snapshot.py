@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+"""Module to keep in memory the stations data the read routes serve."""
+# Created: lun oct 19 09:40:40 2026 (+0200)
+# Last-Updated: lun oct 19 10:06:16 2026 (+0200)
+# Filename: serving_snapshot.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import threading
+import time
+from types import MappingProxyType
+
+from data.country_names import LANGUAGES, CountryNames
+from data.providers_catalogue import ProvidersCatalogue
+from db.snapshot import get_serving_statements
+from flask import current_app
+
+
+def station_marker(row, popup=True):
+    """Build the marker of a station.
+
+    :param row: the station row, as returned by get_stations_data.
+    :type row: tuple
+    :param popup: False to leave the popup out of the marker.
+    :type popup: bool
+    :return: a dict with the lat, lon, tooltip, station_id and country keys, and popup if requested.
+    :rtype: dict
+    """
+    data_staid = row[0]
+    station_name = row[2]
+    country = row[3]
+    lat = row[4]
+    lon = row[5]
+    station_popup = row[7]
+
+    # Derive a clean text tooltip (no HTML, no None)
+    if station_popup:
+        # Use only the header part before the first <br to avoid long HTML content
+        header = str(station_popup).split('<br', 1)[0]
+        tooltip = header
+        popup_html = f'<br />{station_popup}'
+    else:
+        # Fallback to a simple, human-readable tooltip
+        if station_name:
+            tooltip = f'{station_name} ({country})'
+        else:
+            tooltip = f'Station {data_staid}'
+        popup_html = f'<br />{tooltip}'
+
+    marker = {
+        'lat': lat,
+        'lon': lon,
+        'tooltip': tooltip,
+        'station_id': f'{data_staid}',
+        'country': country
+    }
+
+    if popup:
+        marker['popup'] = popup_html
+
+    return marker
+
+
+class ServingSnapshot():
+    """Read only copy of the markers, popups and countries of the stations of a data version.
+
+    The current snapshot is replaced as a whole, with a single assignment, when a new one has been built in the background,
+    so the read routes always see a complete data version and never wait for the database.
+    """
+
+    # The snapshot the routes read
+    current = None
+
+    # Monotonic time of the last data version check
+    _checked_at = None
+
+    # The thread building a new snapshot, if any
+    _builder = None
+
+    _lock = threading.Lock()
+
+    def __init__(self, version, providers, markers, popups, station_providers, station_countries):
+        """Initialize the class.
+
+        :param version: the data version.
+        :type version: int
+        :param providers: the providers data, as returned by ProvidersCatalogue.get.
+        :type providers: types.MappingProxyType
+        :param markers: the markers of the stations of each provider, without popups.
+        :type markers: dict
+        :param popups: the popup of each station by id.
+        :type popups: dict
+        :param station_providers: the provider id of each station by id.
+        :type station_providers: dict
+        :param station_countries: the country code of each station by id.
+        :type station_countries: dict
+        """
+        self.version = version
+        self.providers = providers
+        self.markers = MappingProxyType({provider_id: tuple(MappingProxyType(marker) for marker in provider_markers)
+                                         for provider_id, provider_markers in markers.items()})
+        self.popups = MappingProxyType(popups)
+        self.station_providers = MappingProxyType(station_providers)
+        self.station_countries = MappingProxyType(station_countries)
+
+        country_markers = {}
+
+        for provider_id, provider_markers in self.markers.items():
+            for marker in provider_markers:
+                key = (provider_id, marker['country'])
+
+                if key not in country_markers:
+                    country_markers[key] = []
+
+                country_markers[key].append(marker)
+
+        self.country_markers = MappingProxyType({key: tuple(value) for key, value in country_markers.items()})
+        self.countries = tuple(sorted({cn for provider_id, cn in self.country_markers}))
+
+        # The (code, name) of the countries sorted by name, by language
+        self.country_index = MappingProxyType({lang: self._index_countries(lang) for lang in LANGUAGES})
+
+    def _index_countries(self, lang):
+        """Return the (code, name) of the countries of the stations sorted by name, the code if it has no name."""
+        names = CountryNames.get(lang)
+
+        return tuple(sorted(((code, names.get(code, code)) for code in self.countries), key=lambda country: country[1]))
+
+    def get_countries(self, lang):
+        """Return the countries of the stations with their names in a language.
+
+        :param lang: the language code, one of LANGUAGES. Other languages get the names in the first one.
+        :type lang: str
+        :return: tuples (country_code, country_name) sorted by name.
+        :rtype: tuple
+        """
+        return self.country_index.get(lang, self.country_index[LANGUAGES[0]])
+
+    @classmethod
+    def build(cls):
+        """Build a snapshot of the current data from the serving backend.
+
+        :rtype: ServingSnapshot
+        """
+        stmt = get_serving_statements()
+
+        # Read first, so data published while building is loaded by the next snapshot
+        version = stmt.get_data_version()
+        providers = ProvidersCatalogue.get()
+
+        markers = {}
+        popups = {}
+        station_providers = {}
+        station_countries = {}
+
+        for provider_id in providers.keys():
+            markers[provider_id] = []
+
+            for row in stmt.iter_stations_data(provider_id):
+                markers[provider_id].append(station_marker(row, popup=False))
+                popups[row[0]] = row[7]
+                station_providers[row[0]] = provider_id
+                station_countries[row[0]] = row[3]
+
+        return cls(version, providers, markers, popups, station_providers, station_countries)
+
+    @classmethod
+    def _build_in_background(cls, app):
+        """Build a new snapshot and publish it."""
+        with app.app_context():
+            try:
+                snapshot = cls.build()
+                cls.current = snapshot
+                app.logger.info(f'Serving snapshot of data version {snapshot.version} published')
+            except Exception:
+                app.logger.exception('Could not build the serving snapshot, the previous one is kept')
+            finally:
+                with cls._lock:
+                    cls._builder = None
+
+    @classmethod
+    def refresh(cls):
+        """Build a new snapshot in the background, unless one is being built, and publish it when it is complete."""
+        with cls._lock:
+            cls._checked_at = time.monotonic()
+
+            if cls._builder is None:
+                cls._builder = threading.Thread(target=cls._build_in_background, args=(current_app._get_current_object(),), name='serving-snapshot', daemon=True)
+                cls._builder.start()
+
+    @classmethod
+    def get(cls):
+        """Return the current snapshot.
+
+        The first call builds it. Then the data version is checked at most every DATA_VERSION_CHECK_INTERVAL seconds,
+        and a new snapshot is built in the background when it changes, while the current one is still served.
+        :rtype: ServingSnapshot
+        """
+        snapshot = cls.current
+
+        if snapshot is None:
+            with cls._lock:
+                if cls.current is None:
+                    cls.current = cls.build()
+                    cls._checked_at = time.monotonic()
+
+                return cls.current
+
+        now = time.monotonic()
+
+        if cls._checked_at is None or now - cls._checked_at >= current_app.config['DATA_VERSION_CHECK_INTERVAL']:
+            cls._checked_at = now
+
+            if get_serving_statements().get_data_version() != snapshot.version:
+                cls.refresh()
+
+        return snapshot
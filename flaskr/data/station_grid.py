@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+"""Module to cluster the stations markers of a map tile with a grid hash index."""
+# Created: lun oct 19 09:37:05 2026 (+0200)
+# Last-Updated: lun oct 19 09:38:52 2026 (+0200)
+# Filename: station_grid.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import math
+import threading
+
+# Zoom of the tiles the stations are indexed by
+INDEX_ZOOM = 8
+
+# Latitude limits of the web mercator projection
+MAX_LAT = 85.05112878
+
+
+def to_world(lat, lon):
+    """Project a location to web mercator world coordinates, between 0 and 1 from the top left corner.
+
+    :rtype: tuple
+    """
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    sin_lat = math.sin(math.radians(lat))
+
+    wx = (lon + 180) / 360
+    wy = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+
+    return min(max(wx, 0.0), 1 - 1e-12), min(max(wy, 0.0), 1 - 1e-12)
+
+
+def to_lat_lon(wx, wy):
+    """Unproject web mercator world coordinates to a location.
+
+    :rtype: tuple
+    """
+    lon = wx * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * wy))))
+
+    return lat, lon
+
+
+def tile_bbox(z, x, y):
+    """Return the bounding box of a tile in the form (min_lon, min_lat, max_lon, max_lat)."""
+    n = 2 ** z
+    max_lat, min_lon = to_lat_lon(x / n, y / n)
+    min_lat, max_lon = to_lat_lon((x + 1) / n, (y + 1) / n)
+
+    return min_lon, min_lat, max_lon, max_lat
+
+
+class StationGrid():
+    """Index of the stations locations by provider and INDEX_ZOOM tile, built once per data version."""
+
+    # The data version of the index
+    version = None
+
+    # Stations by (provider_id, x, y) tile of INDEX_ZOOM, as tuples (data_staid, lat, lon, wx, wy, tooltip)
+    cells = {}
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def get(cls, version, load):
+        """Return the index of a data version, building it if needed.
+
+        :param version: the data version.
+        :type version: int
+        :param load: function returning the markers of all the stations, as Data.get_stations_markers.
+        :type load: callable
+        :return: the cells of the index.
+        :rtype: dict
+        """
+        with cls._lock:
+            if cls.version != version:
+                cls.cells = cls.index(load())
+                cls.version = version
+
+            return cls.cells
+
+    @classmethod
+    def index(cls, stations_markers):
+        """Index the markers of the stations by provider and INDEX_ZOOM tile.
+
+        :param stations_markers: the markers of all the stations, as returned by Data.get_stations_markers.
+        :type stations_markers: dict
+        :return: the cells of the index.
+        :rtype: dict
+        """
+        cells = {}
+        n = 2 ** INDEX_ZOOM
+
+        for provider_id, markers in stations_markers.items():
+            for marker in markers:
+                lat = float(marker['lat'])
+                lon = float(marker['lon'])
+                wx, wy = to_world(lat, lon)
+
+                key = (provider_id, int(wx * n), int(wy * n))
+
+                if key not in cells:
+                    cells[key] = []
+
+                cells[key].append((marker['station_id'], lat, lon, wx, wy, marker['tooltip']))
+
+        return cells
+
+    @classmethod
+    def tiles(cls, cells, provider_id, z):
+        """Return the tiles of a zoom with stations of a provider.
+
+        :return: the (x, y) of the tiles.
+        :rtype: set
+        """
+        if z <= INDEX_ZOOM:
+            shift = 2 ** (INDEX_ZOOM - z)
+
+            return {(ix // shift, iy // shift) for (pid, ix, iy) in cells if pid == provider_id}
+
+        n = 2 ** z
+
+        return {(int(station[3] * n), int(station[4] * n)) for (pid, ix, iy), stations in cells.items() if pid == provider_id for station in stations}
+
+    @classmethod
+    def _tile_stations(cls, cells, provider_id, z, x, y):
+        """Yield the stations of a provider inside a tile."""
+        if z <= INDEX_ZOOM:
+            # The tile covers several index cells
+            span = 2 ** (INDEX_ZOOM - z)
+
+            for ix in range(x * span, (x + 1) * span):
+                for iy in range(y * span, (y + 1) * span):
+                    yield from cells.get((provider_id, ix, iy), ())
+        else:
+            # The tile is inside an index cell
+            shift = 2 ** (z - INDEX_ZOOM)
+            n = 2 ** z
+
+            for station in cells.get((provider_id, x // shift, y // shift), ()):
+                if int(station[3] * n) == x and int(station[4] * n) == y:
+                    yield station
+
+    @classmethod
+    def cluster(cls, cells, provider_id, z, x, y, grid, max_zoom):
+        """Cluster the stations of a provider inside a tile.
+
+        The tile is split in grid x grid cells. The stations alone in a cell, and all of them from max_zoom on, are returned as they are.
+        :param cells: the index, as returned by get.
+        :type cells: dict
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param z: the zoom of the tile.
+        :type z: int
+        :param x: the column of the tile.
+        :type x: int
+        :param y: the row of the tile.
+        :type y: int
+        :param grid: the number of clustering cells per tile side.
+        :type grid: int
+        :param max_zoom: the zoom from which the stations are not clustered.
+        :type max_zoom: int
+        :return: dicts with the station_id, lat, lon and tooltip keys for stations, and with the count, lat and lon keys for clusters.
+        :rtype: list
+        """
+        stations = list(cls._tile_stations(cells, provider_id, z, x, y))
+
+        if z >= max_zoom:
+            return [{'station_id': station[0], 'lat': station[1], 'lon': station[2], 'tooltip': station[5]} for station in stations]
+
+        n = 2 ** z
+        groups = {}
+
+        for station in stations:
+            key = (int((station[3] * n - x) * grid), int((station[4] * n - y) * grid))
+
+            if key not in groups:
+                groups[key] = []
+
+            groups[key].append(station)
+
+        features = []
+
+        for group in groups.values():
+            if len(group) == 1:
+                station = group[0]
+                features.append({'station_id': station[0], 'lat': station[1], 'lon': station[2], 'tooltip': station[5]})
+            else:
+                # Centroid in world coordinates, so it is inside the cell
+                lat, lon = to_lat_lon(sum(station[3] for station in group) / len(group), sum(station[4] for station in group) / len(group))
+                features.append({'count': len(group), 'lat': round(lat, 5), 'lon': round(lon, 5)})
+
+        return features
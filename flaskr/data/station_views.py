@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""Module to count how many times each station graph is requested."""
+# Created: lun oct 19 10:05:41 2026 (+0200)
+# Last-Updated: lun oct 19 09:53:50 2026 (+0200)
+# Filename: station_views.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from db.statements import Statements
+from flask import current_app
+
+
+class StationViews():
+    """Class to count the station graph views.
+
+    The counters are kept in memory and flushed to the station_views table every STATION_VIEWS_FLUSH_INTERVAL seconds
+    by a background thread, and when the process exits.
+    """
+
+    # Views per data_staid not flushed yet, in the form {data_staid: [views, last_view]}
+    views = {}
+
+    # The thread flushing the counters, started with the first view
+    _flusher = None
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def _start(cls):
+        """Start the flusher thread, and flush the counters left when the process exits.
+
+        Must be called holding the lock.
+        """
+        if cls._flusher is None:
+            app = current_app._get_current_object()
+
+            cls._flusher = threading.Thread(target=cls._run, args=(app,), name='station-views', daemon=True)
+            cls._flusher.start()
+
+            atexit.register(cls._flush_at_exit, app)
+
+    @classmethod
+    def _run(cls, app):
+        """Flush the counters every STATION_VIEWS_FLUSH_INTERVAL seconds, with or without traffic."""
+        while True:
+            time.sleep(app.config['STATION_VIEWS_FLUSH_INTERVAL'])
+
+            with app.app_context():
+                cls.flush()
+
+    @classmethod
+    def _flush_at_exit(cls, app):
+        """Flush the counters left when the process exits."""
+        with app.app_context():
+            try:
+                cls.flush()
+            except Exception:
+                app.logger.exception('Could not flush the station views at exit')
+
+    @classmethod
+    def record(cls, data_staid):
+        """Count a view of the station graph. The counters are flushed in the background.
+
+        :param data_staid: the id of the station in the database table.
+        :type data_staid: int
+        """
+        with cls._lock:
+            if data_staid not in cls.views:
+                cls.views[data_staid] = [0, None]
+
+            cls.views[data_staid][0] += 1
+            cls.views[data_staid][1] = datetime.now()
+
+            cls._start()
+
+    @classmethod
+    def flush(cls):
+        """Write the counters to the database and reset them."""
+        with cls._lock:
+            views = cls.views
+            cls.views = {}
+
+        if views:
+            stmt = Statements()
+
+            try:
+                stmt.add_station_views([(data_staid, count, last_view) for data_staid, (count, last_view) in views.items()])
+            except Exception:
+                stmt.rollback()
+                current_app.logger.exception('Could not flush the station views')
+
+                # Keep the counters to flush them next time
+                with cls._lock:
+                    for data_staid, (count, last_view) in views.items():
+                        if data_staid not in cls.views:
+                            cls.views[data_staid] = [0, last_view]
+
+                        cls.views[data_staid][0] += count
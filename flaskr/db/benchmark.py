@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+"""Benchmark of the stations queries before and after the indexes of migration 0005."""
+# Created: lun oct 19 13:41:19 2026 (+0200)
+# Last-Updated: lun oct 19 10:07:38 2026 (+0200)
+# Filename: benchmark.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import random
+import statistics
+import time
+
+import click
+from db import db
+from flask.cli import with_appcontext
+
+# Tables like stations and ecad_elements before migration 0005, filled with synthetic data.
+# Executed with parameters, so the modulo operator is written %%
+CREATE_TABLES = """
+CREATE TEMP TABLE bench_stations (
+  id SERIAL PRIMARY KEY,
+  provider_id INTEGER NOT NULL,
+  station_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  cn TEXT NOT NULL,
+  lat TEXT NOT NULL,
+  lon TEXT NOT NULL,
+  height INTEGER NOT NULL,
+  popup TEXT NULL
+);
+
+INSERT INTO bench_stations (provider_id, station_id, name, cn, lat, lon, height, popup)
+SELECT 1 + i %% %(providers)s, i, 'Station ' || i, 'C' || (i %% 50), (35 + random() * 35)::text, (-25 + random() * 70)::text, (random() * 2000)::int, repeat('x', 300)
+FROM generate_series(1, %(stations)s) AS i;
+
+CREATE TEMP TABLE bench_elements (
+  id SERIAL PRIMARY KEY,
+  provider_id INTEGER NOT NULL,
+  magnitude_id INTEGER NOT NULL,
+  measurement_id INTEGER NOT NULL,
+  element_id TEXT NOT NULL,
+  description TEXT NOT NULL,
+  unit TEXT NOT NULL,
+  factor NUMERIC(3, 2) NOT NULL,
+  priority INTEGER NOT NULL
+);
+
+INSERT INTO bench_elements (provider_id, magnitude_id, measurement_id, element_id, description, unit, factor, priority)
+SELECT p, 1, m, 'T' || m || '_' || e, 'Element ' || e, 'C', 0.1, e
+FROM generate_series(1, %(providers)s) AS p, generate_series(1, 3) AS m, generate_series(1, 200) AS e;
+
+ANALYZE bench_stations;
+ANALYZE bench_elements;
+"""
+
+# The same changes as migration 0005
+MIGRATE_TABLES = """
+ALTER TABLE bench_stations ALTER COLUMN lat TYPE DOUBLE PRECISION USING lat::double precision;
+ALTER TABLE bench_stations ALTER COLUMN lon TYPE DOUBLE PRECISION USING lon::double precision;
+CREATE UNIQUE INDEX ON bench_stations (provider_id, station_id);
+CREATE INDEX ON bench_stations (provider_id, cn);
+CREATE INDEX ON bench_stations USING gist (point(lon, lat));
+CREATE INDEX ON bench_elements (provider_id, element_id);
+ANALYZE bench_stations;
+ANALYZE bench_elements;
+"""
+
+# Queries as (name, sql before, sql after, function returning the parameters)
+QUERIES = [
+    ('station by provider and id',
+     'SELECT lat, lon FROM bench_stations WHERE provider_id = %s AND station_id = %s',
+     None,
+     lambda n, providers: (random.randint(1, providers), random.randint(1, n))),
+    ('get_ecad_unit_factor',
+     'SELECT factor, unit FROM bench_elements WHERE provider_id = %s AND element_id = %s',
+     None,
+     lambda n, providers: (random.randint(1, providers), f'T{random.randint(1, 3)}_{random.randint(1, 200)}')),
+    ('country stations',
+     'SELECT id FROM bench_stations WHERE provider_id = %s AND cn = %s',
+     None,
+     lambda n, providers: (random.randint(1, providers), f'C{random.randint(0, 49)}')),
+    ('bbox stations',
+     'SELECT id FROM bench_stations WHERE provider_id = %s AND lon::double precision BETWEEN %s AND %s AND lat::double precision BETWEEN %s AND %s',
+     'SELECT id FROM bench_stations WHERE provider_id = %s AND point(lon, lat) <@ box(point(%s, %s), point(%s, %s))',
+     None),
+    ('get_stations_data',
+     'SELECT id, station_id, name, cn, lat, lon, height, popup FROM bench_stations WHERE provider_id = %s ORDER BY id',
+     None,
+     lambda n, providers: (random.randint(1, providers),)),
+]
+
+
+def _bbox_params(after, providers):
+    """Return the parameters of a bounding box of 2x1 degrees."""
+    provider_id = random.randint(1, providers)
+    min_lon = random.uniform(-25, 43)
+    min_lat = random.uniform(35, 69)
+
+    if after:
+        return (provider_id, min_lon, min_lat, min_lon + 2, min_lat + 1)
+
+    return (provider_id, min_lon, min_lon + 2, min_lat, min_lat + 1)
+
+
+def _time_queries(cur, after, stations, providers, repeat):
+    """Run each query repeat times.
+
+    :return: the median latency in milliseconds of each query, by name.
+    :rtype: dict
+    """
+    latencies = {}
+
+    for name, sql_before, sql_after, params in QUERIES:
+        sql = sql_after if after and sql_after else sql_before
+        times = []
+
+        for _ in range(repeat):
+            values = params(stations, providers) if params else _bbox_params(after, providers)
+
+            t1 = time.perf_counter()
+            cur.execute(sql, values)
+            cur.fetchall()
+            times.append((time.perf_counter() - t1) * 1000)
+
+        latencies[name] = statistics.median(times)
+
+    return latencies
+
+
+def benchmark(stations, providers, repeat):
+    """Measure the stations queries on synthetic temporary tables, without and with the indexes.
+
+    Nothing is written to the database: everything runs in a transaction which is rolled back.
+    :param stations: the number of synthetic stations.
+    :type stations: int
+    :param providers: the number of providers the stations are spread over.
+    :type providers: int
+    :param repeat: the number of times each query is run.
+    :type repeat: int
+    :return: tuples in the form (query name, median ms before, median ms after)
+    :rtype: list
+    """
+    conn = db.get_db()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_TABLES, {'stations': stations, 'providers': providers})
+            before = _time_queries(cur, False, stations, providers, repeat)
+
+            cur.execute(MIGRATE_TABLES)
+            after = _time_queries(cur, True, stations, providers, repeat)
+    finally:
+        conn.rollback()
+
+    return [(name, before[name], after[name]) for name in before]
+
+
+@click.command('benchmark-db')
+@click.option('--stations', default=20000, help='Number of synthetic stations.')
+@click.option('--providers', default=2, help='Number of providers the stations are spread over.')
+@click.option('--repeat', default=50, help='Times each query is run.')
+@with_appcontext
+def benchmark_db_command(stations, providers, repeat):
+    """
+    Compare the latency of the stations queries before and after the indexes of migration 0005.
+
+    Use command: export PYTHONPATH=/path/to/flaskr_directory; flask --app flaskr/app benchmark-db. It only uses temporary tables.
+    """
+    results = benchmark(stations, providers, repeat)
+
+    click.echo(f'{stations} stations, {providers} providers, median of {repeat} runs')
+    click.echo(f'{"query":<24}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+
+    for name, before, after in results:
+        click.echo(f'{name:<24}{before:>12.3f}{after:>12.3f}{before / after:>9.1f}x')
@@ -1,27 +1,136 @@
 """Module to create and handle a database connection."""
 # Created: vie jul 12 10:58:13 2024 (+0200)
-# Last-Updated: sáb nov  8 16:56:56 2025 (+0100)
+# Last-Updated: lun oct 19 09:34:34 2026 (+0200)
 # Filename: db.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
 import click
+from db.pool import ConnectionPool
+from db.query_stats import InstrumentedCursor
 from flask import current_app, g
 import psycopg2
+import psycopg2.extensions
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class Connection(psycopg2.extensions.connection):
+    """Database connection remembering the statements prepared in its session and counting the rows of its statements."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the class."""
+        super().__init__(*args, **kwargs)
+
+        # Count the rows of the statements for QueryStats
+        self.cursor_factory = InstrumentedCursor
+
+        # Names of the statements prepared in this session
+        self.prepared = set()
+
+        # Number of nested unit_of_work blocks running on this connection
+        self.unit_of_work_depth = 0
+
+
+def connect():
+    """Open a new database connection, not bound to the app context."""
+    return psycopg2.connect(host=current_app.config['DB_HOST'], database=current_app.config['DATABASE'], user=current_app.config['DB_USER'], password=current_app.config['DB_PASSWORD'],
+                            connection_factory=Connection)
+
+
+def get_pool():
+    """Return the process wide connection pool, creating it from the app configuration."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            config = current_app.config
+            _pool = ConnectionPool(connect, config['DB_POOL_MIN_CONNECTIONS'], config['DB_POOL_MAX_CONNECTIONS'], config['DB_POOL_TIMEOUT'], config['DB_POOL_CHECK_INTERVAL'])
+
+    return _pool
+
+
+def _close_idle_before_fork():
+    """Close the idle pooled connections, so forked children (i.e. pre-fork server workers) do not share them."""
+    if _pool is not None:
+        _pool.close_idle()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_close_idle_before_fork)
 
 
 def get_db():
-    """Return the database connection."""
+    """Return the database connection borrowed from the pool for this app context."""
     if 'db' not in g:
-        g.db = psycopg2.connect(host=current_app.config['DB_HOST'], database=current_app.config['DATABASE'], user=current_app.config['DB_USER'], password=current_app.config['DB_PASSWORD'])
+        g.db = get_pool().getconn()
 
     return g.db
 
 
 def close_db(e=None):
-    """Close the database connection."""
+    """Return the database connection to the pool."""
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
+
+
+@contextmanager
+def unit_of_work():
+    """Run the writes of a block in a single transaction, committed when the block ends and rolled back if it fails.
+
+    The commits of the Statements helpers called inside the block are suppressed.
+    A nested block runs in a savepoint: if it fails, only its writes are undone and the exception is raised.
+    """
+    conn = get_db()
+
+    if conn.unit_of_work_depth == 0:
+        conn.unit_of_work_depth = 1
+
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            conn.unit_of_work_depth = 0
+    else:
+        savepoint = f'unit_of_work_{conn.unit_of_work_depth}'
+
+        with conn.cursor() as cur:
+            cur.execute(f'SAVEPOINT {savepoint}')
+
+        conn.unit_of_work_depth += 1
+
+        try:
+            yield conn
+        except BaseException:
+            with conn.cursor() as cur:
+                cur.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+            raise
+        else:
+            with conn.cursor() as cur:
+                cur.execute(f'RELEASE SAVEPOINT {savepoint}')
+        finally:
+            conn.unit_of_work_depth -= 1
+
+
+def _migration_files():
+    """Return the migration files sorted by name.
+
+    :return: the paths of the sql files in the migrations directory.
+    :rtype: list
+    """
+    migrations_dir = Path(current_app.root_path).joinpath('db/migrations')
+
+    return sorted(migrations_dir.glob('*.sql'))
 
 
 def init_db():
@@ -32,9 +141,38 @@ def init_db():
         with current_app.open_resource('db/schema.sql') as f:
             cur.execute(f.read())
 
+        # The schema already contains all the migrations
+        for migration in _migration_files():
+            cur.execute('INSERT INTO schema_migrations (name) VALUES (%s)', (migration.name,))
+
         db.commit()
 
 
+def migrate_db():
+    """Apply the migrations not yet applied to the database.
+
+    :return: the names of the applied migrations.
+    :rtype: list
+    """
+    applied = []
+    db = get_db()
+
+    with db.cursor() as cur:
+        cur.execute('CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())')
+        cur.execute('SELECT name FROM schema_migrations')
+        done = {row[0] for row in cur.fetchall()}
+
+        for migration in _migration_files():
+            if migration.name not in done:
+                cur.execute(migration.read_text())
+                cur.execute('INSERT INTO schema_migrations (name) VALUES (%s)', (migration.name,))
+                applied.append(migration.name)
+
+        db.commit()
+
+    return applied
+
+
 @click.command('init-db')
 def init_db_command():
     """
@@ -49,7 +187,22 @@ def init_db_command():
         click.echo('Failed to inicializa database.')
 
 
+@click.command('migrate-db')
+def migrate_db_command():
+    """
+    Apply the pending migrations in db/migrations to an existing database.
+
+    Use command: export PYTHONPATH=/path/to/flaskr_directory; flask --app flaskr/app migrate-db. Data is kept.
+    """
+    try:
+        applied = migrate_db()
+        click.echo(f'Database migrated successfully. Applied migrations: {", ".join(applied) if applied else "none"}.')
+    except Exception as e:
+        click.echo(f'Failed to migrate database: {e}')
+
+
 def init_app(app):
     """Initialize application."""
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
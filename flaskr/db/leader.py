@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""Leader election with a PostgreSQL advisory lock, so only one process runs the ingestion pipeline."""
+# Created: lun oct 19 12:14:53 2026 (+0200)
+# Last-Updated:
+# Filename: leader.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import socket
+
+from db import db
+
+# Key of the advisory lock held by the ingestion leader ('mete' as an integer)
+INGESTION_LOCK_KEY = 0x6d657465
+
+
+class IngestionLeader():
+    """Hold the ingestion advisory lock.
+
+    The lock is a session lock on a dedicated connection, so it is held while this process lives
+    and released by PostgreSQL as soon as the process dies or the connection is lost.
+    """
+
+    def __init__(self):
+        """Initialize the class."""
+        self.leader_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._conn = None
+
+    @property
+    def is_leader(self):
+        """Return True if this process holds the lock."""
+        return self._conn is not None and not self._conn.closed
+
+    def try_acquire(self):
+        """Try to become the leader, without waiting.
+
+        :return: True if this process holds the lock.
+        :rtype: bool
+        """
+        if self.is_leader:
+            return True
+
+        conn = db.connect()
+        conn.autocommit = True
+
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_try_advisory_lock(%s)', (INGESTION_LOCK_KEY,))
+            acquired = cur.fetchall()[0][0]
+
+        if acquired:
+            self._conn = conn
+        else:
+            conn.close()
+
+        return acquired
+
+    def release(self):
+        """Stop being the leader."""
+        if self.is_leader:
+            with self._conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_unlock(%s)', (INGESTION_LOCK_KEY,))
+
+            self._conn.close()
+
+        self._conn = None
@@ -0,0 +1,7 @@
+-- Number of times each station graph has been requested
+CREATE TABLE IF NOT EXISTS station_views (
+  data_station_id INTEGER PRIMARY KEY,
+  views BIGINT NOT NULL DEFAULT 0,
+  last_view TIMESTAMP NULL,
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
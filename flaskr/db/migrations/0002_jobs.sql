@@ -0,0 +1,25 @@
+-- Queue of background tasks (station graphs, ...), drained by the run-worker processes
+CREATE TABLE IF NOT EXISTS jobs (
+  id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  provider_id INTEGER NOT NULL,
+  data_station_id INTEGER NOT NULL,
+  priority INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL,
+  run_after TIMESTAMP NOT NULL DEFAULT now(),
+  lease_until TIMESTAMP NULL,
+  locked_by TEXT NULL,
+  last_error TEXT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP NOT NULL DEFAULT now(),
+  FOREIGN KEY (provider_id) REFERENCES providers(id),
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
+
+-- Only one active job per task
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_task ON jobs (kind, data_station_id) WHERE status IN ('pending', 'running');
+
+-- Claim order
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (priority, run_after, id) WHERE status = 'pending';
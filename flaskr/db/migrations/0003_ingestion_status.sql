@@ -0,0 +1,9 @@
+-- State of the ingestion pipeline, written by the process holding the ingestion advisory lock
+CREATE TABLE IF NOT EXISTS ingestion_status (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  leader TEXT NOT NULL,
+  state TEXT NOT NULL,
+  started_at TIMESTAMP NULL,
+  finished_at TIMESTAMP NULL,
+  message TEXT NULL
+);
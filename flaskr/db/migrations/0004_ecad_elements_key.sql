@@ -0,0 +1,6 @@
+-- Remove repeated elements, keeping the first one saved
+DELETE FROM ecad_elements a USING ecad_elements b
+WHERE a.id > b.id AND a.provider_id = b.provider_id AND a.magnitude_id = b.magnitude_id AND a.measurement_id = b.measurement_id AND a.element_id = b.element_id;
+
+-- Key of the elements upserts
+CREATE UNIQUE INDEX IF NOT EXISTS ecad_elements_key ON ecad_elements (provider_id, magnitude_id, measurement_id, element_id);
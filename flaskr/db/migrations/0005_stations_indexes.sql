@@ -0,0 +1,35 @@
+-- Numeric coordinates, so they can be compared and indexed
+ALTER TABLE stations ALTER COLUMN lat TYPE DOUBLE PRECISION USING lat::double precision;
+ALTER TABLE stations ALTER COLUMN lon TYPE DOUBLE PRECISION USING lon::double precision;
+
+-- Add the views of the repeated stations to the first copy saved, which is the one kept
+INSERT INTO station_views (data_station_id, views, last_view)
+SELECT k.id, SUM(v.views), MAX(v.last_view)
+FROM station_views v
+JOIN stations d ON d.id = v.data_station_id
+JOIN stations k ON k.id = (SELECT MIN(s.id) FROM stations s WHERE s.provider_id = d.provider_id AND s.station_id = d.station_id)
+WHERE d.id <> k.id
+GROUP BY k.id
+ON CONFLICT (data_station_id) DO UPDATE SET views = station_views.views + EXCLUDED.views, last_view = GREATEST(station_views.last_view, EXCLUDED.last_view);
+
+-- Remove repeated stations, keeping the first one saved. Their views and jobs are deleted in cascade
+DELETE FROM stations a USING stations b
+WHERE a.id > b.id AND a.provider_id = b.provider_id AND a.station_id = b.station_id;
+
+-- A station is saved once per provider
+CREATE UNIQUE INDEX IF NOT EXISTS stations_key ON stations (provider_id, station_id);
+
+-- Stations of a country
+CREATE INDEX IF NOT EXISTS stations_country ON stations (provider_id, cn);
+
+-- Stations inside a bounding box: point(lon, lat) <@ box(point(min_lon, min_lat), point(max_lon, max_lat))
+CREATE INDEX IF NOT EXISTS stations_location ON stations USING gist (point(lon, lat));
+
+-- Unit and factor of an element
+CREATE INDEX IF NOT EXISTS ecad_elements_element ON ecad_elements (provider_id, element_id);
+
+-- Most viewed stations
+CREATE INDEX IF NOT EXISTS station_views_views ON station_views (views DESC, last_view DESC);
+
+ANALYZE stations;
+ANALYZE ecad_elements;
@@ -0,0 +1,12 @@
+-- Daily values of the stations, copied from the provider data files by the ingestion leader.
+-- Partitioned by provider (observations_<provider_id>) and decade (observations_<provider_id>_<decade>);
+-- the partitions are created by the ingestion when needed.
+CREATE TABLE IF NOT EXISTS observations (
+  provider_id INTEGER NOT NULL,
+  station_id INTEGER NOT NULL,
+  measurement_id INTEGER NOT NULL,
+  day DATE NOT NULL,
+  value DOUBLE PRECISION NULL,
+  quality SMALLINT NOT NULL,
+  PRIMARY KEY (provider_id, station_id, measurement_id, day)
+) PARTITION BY LIST (provider_id);
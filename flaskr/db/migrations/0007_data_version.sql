@@ -0,0 +1,2 @@
+-- Counter of the ingestions published, so serving processes know when their cached markers are stale
+ALTER TABLE ingestion_status ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- Averages per decade of the stations measurements, computed by the station_aggregates jobs and read by the graphs
+CREATE TABLE IF NOT EXISTS station_averages (
+  data_station_id INTEGER NOT NULL,
+  measurement TEXT NOT NULL,
+  decade INTEGER NOT NULL,
+  average DOUBLE PRECISION NOT NULL,
+  data_version INTEGER NOT NULL,
+  PRIMARY KEY (data_station_id, measurement, decade),
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
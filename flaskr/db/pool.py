@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+"""Process wide pool of database connections."""
+# Created: lun oct 19 12:52:36 2026 (+0200)
+# Last-Updated: lun oct 19 09:23:44 2026 (+0200)
+# Filename: pool.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolError(psycopg2.Error):
+    """No connection could be borrowed from the pool."""
+
+
+class ConnectionPool():
+    """Thread safe pool of database connections.
+
+    - Borrowers wait up to timeout seconds when max_size connections are in use.
+    - Idle connections are checked with a SELECT 1 before being borrowed if they were not used for check_interval seconds.
+    - It is fork safe: a forked child never uses nor closes the connections of its parent.
+    """
+
+    def __init__(self, connect, min_size, max_size, timeout, check_interval):
+        """Initialize the class.
+
+        :param connect: function opening a new connection.
+        :type connect: callable
+        :param min_size: number of connections opened the first time a connection is borrowed.
+        :type min_size: int
+        :param max_size: max number of connections, idle or in use.
+        :type max_size: int
+        :param timeout: seconds to wait for a free connection.
+        :type timeout: float
+        :param check_interval: seconds an idle connection is trusted without checking it.
+        :type check_interval: float
+        """
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self._reset()
+
+    def _reset(self):
+        """Forget all the connections."""
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        # Idle connections, as tuples (connection, time it was returned)
+        self._idle = deque()
+        self._size = 0
+        self._filled = False
+        # Connections inherited from the parent process. They are kept referenced
+        # because closing them, even by the garbage collector, would close the parent's sessions.
+        self._orphans = []
+
+    def _check_fork(self):
+        """Start a new pool if this is a forked child of the process which created the pool."""
+        if self._pid != os.getpid():
+            orphans = self._orphans + [conn for conn, _ in self._idle]
+            self._reset()
+            self._orphans = orphans
+
+    def _is_healthy(self, conn, idle_since):
+        """Check if a connection can be used."""
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        if time.monotonic() - idle_since >= self.check_interval:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def _discard(self, conn):
+        """Close a connection and free its slot.
+
+        Must be called holding the lock.
+        """
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+        self._size -= 1
+        self._cond.notify()
+
+    def _fill(self):
+        """Open the min_size connections.
+
+        Must be called holding the lock.
+        """
+        self._filled = True
+
+        while self._size < self.min_size:
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self):
+        """Borrow a connection.
+
+        :return: a connection, which must be returned with putconn.
+        :rtype: psycopg2.extensions.connection
+        """
+        self._check_fork()
+
+        deadline = time.monotonic() + self.timeout
+
+        with self._cond:
+            if not self._filled:
+                self._fill()
+
+            while True:
+                while self._idle:
+                    conn, idle_since = self._idle.pop()
+
+                    if self._is_healthy(conn, idle_since):
+                        return conn
+
+                    self._discard(conn)
+
+                if self._size < self.max_size:
+                    # Reserve the slot before connecting
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise PoolError(f'No database connection available after {self.timeout} seconds')
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn):
+        """Return a borrowed connection, rolling back any transaction left open.
+
+        :param conn: the borrowed connection.
+        :type conn: psycopg2.extensions.connection
+        """
+        if self._pid != os.getpid():
+            # Borrowed by the parent before forking
+            self._check_fork()
+            self._orphans.append(conn)
+            return
+
+        with self._cond:
+            if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_idle(self):
+        """Close the idle connections, i.e. before forking so children do not inherit them."""
+        if self._pid != os.getpid():
+            return
+
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+            self._filled = False
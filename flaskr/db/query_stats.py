@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+"""Module to time the Statements queries and keep their histograms."""
+# Created: lun oct 19 09:33:40 2026 (+0200)
+# Last-Updated: lun oct 19 09:59:19 2026 (+0200)
+# Filename: query_stats.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import bisect
+import functools
+import inspect
+import reprlib
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import current_app, has_app_context, has_request_context, request
+import psycopg2.extensions
+
+# Upper bounds in milliseconds of the histogram buckets. The last bucket holds the rest
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The pipeline stage running the queries, when they do not run in a request
+_source = ContextVar('query_source', default=None)
+
+# The rows counted for the Statements function running in this context
+_rows = ContextVar('query_rows', default=None)
+
+# Short representation of the parameters for the slow queries log
+_params_repr = reprlib.Repr()
+_params_repr.maxstring = 80
+_params_repr.maxother = 80
+_params_repr.maxlist = 5
+_params_repr.maxtuple = 9
+
+
+@contextmanager
+def query_source(name):
+    """Name the pipeline stage running the queries of a block in the stats and the slow queries log.
+
+    :param name: the name of the stage.
+    :type name: str
+    """
+    token = _source.set(name)
+
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+def current_source():
+    """Return the pipeline stage set by query_source, the route of the request or the name of the thread."""
+    source = _source.get()
+
+    if source is not None:
+        return source
+
+    if has_request_context():
+        return f'route:{request.endpoint}'
+
+    return f'thread:{threading.current_thread().name}'
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor adding the rows of its statements to the Statements function running them."""
+
+    def _count(self):
+        """Add the rows of the last statement."""
+        rows = _rows.get()
+
+        if rows is not None and self.rowcount > 0:
+            rows[0] += self.rowcount
+
+    def execute(self, query, vars=None):
+        """Execute a statement, counting its rows."""
+        res = super().execute(query, vars)
+        self._count()
+
+        return res
+
+    def executemany(self, query, vars_list):
+        """Execute a statement for each parameters tuple, counting its rows."""
+        res = super().executemany(query, vars_list)
+        self._count()
+
+        return res
+
+    def copy_expert(self, sql, file, size=8192):
+        """Run a COPY statement, counting its rows."""
+        res = super().copy_expert(sql, file, size)
+        self._count()
+
+        return res
+
+
+class QueryStats():
+    """Class to keep the calls, rows and latency histogram of each Statements function, per caller."""
+
+    # Stats per (function, caller), in the form {key: [calls, rows, total seconds, max seconds, buckets]}
+    stats = {}
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        """Initialize the class."""
+
+    @classmethod
+    def record(cls, name, source, elapsed, rows, params):
+        """Count a call of a Statements function and log it if it is slow.
+
+        :param name: the name of the function.
+        :type name: str
+        :param source: the route or pipeline stage calling it.
+        :type source: str
+        :param elapsed: the seconds the call took.
+        :type elapsed: float
+        :param rows: the rows read or written.
+        :type rows: int
+        :param params: the parameters of the call.
+        :type params: tuple
+        """
+        elapsed_ms = elapsed * 1000
+
+        with cls._lock:
+            key = (name, source)
+
+            if key not in cls.stats:
+                cls.stats[key] = [0, 0, 0.0, 0.0, [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)]
+
+            entry = cls.stats[key]
+            entry[0] += 1
+            entry[1] += rows
+            entry[2] += elapsed
+            entry[3] = max(entry[3], elapsed)
+            entry[4][bisect.bisect_left(HISTOGRAM_BUCKETS_MS, elapsed_ms)] += 1
+
+        if has_app_context() and elapsed_ms >= cls._slow_threshold(source):
+            current_app.logger.warning(f'Slow query {name} from {source}: {elapsed_ms:.1f} ms, {rows} rows, params {_params_repr.repr(params)}')
+
+    @classmethod
+    def _slow_threshold(cls, source):
+        """Return the milliseconds from which a call is slow: SLOW_QUERY_THRESHOLD for routes and threads, SLOW_STAGE_QUERY_THRESHOLD for pipeline stages."""
+        if source.startswith(('route:', 'thread:')):
+            return current_app.config['SLOW_QUERY_THRESHOLD']
+
+        return current_app.config['SLOW_STAGE_QUERY_THRESHOLD']
+
+    @classmethod
+    def snapshot(cls):
+        """Return a copy of the stats of this process, to get the stats of the calls made after it.
+
+        :return: the stats per (function, caller), in the form {key: (calls, rows, total seconds, buckets)}
+        :rtype: dict
+        """
+        with cls._lock:
+            return {key: (calls, rows, total, list(buckets)) for key, (calls, rows, total, max_elapsed, buckets) in cls.stats.items()}
+
+    @classmethod
+    def _percentile(cls, buckets, calls, fraction):
+        """Return the upper bound in milliseconds of the bucket holding a percentile, None if it is the last one."""
+        target = calls * fraction
+        seen = 0
+
+        for bound, count in zip(HISTOGRAM_BUCKETS_MS, buckets):
+            seen += count
+
+            if seen >= target:
+                return bound
+
+        return None
+
+    @classmethod
+    def get(cls):
+        """Return the stats of this process, the functions taking more time first.
+
+        :return: list of dicts with the name, source, calls, rows, total_ms, mean_ms, max_ms, p50_ms, p95_ms and histogram keys.
+            The histogram counts the calls by the upper bound of their bucket in milliseconds.
+        :rtype: list
+        """
+        with cls._lock:
+            items = [(name, source, calls, rows, total, max_elapsed, list(buckets))
+                     for (name, source), (calls, rows, total, max_elapsed, buckets) in cls.stats.items()]
+
+        stats = []
+
+        for name, source, calls, rows, total, max_elapsed, buckets in sorted(items, key=lambda item: item[4], reverse=True):
+            histogram = {str(bound): count for bound, count in zip(HISTOGRAM_BUCKETS_MS, buckets)}
+            histogram['+Inf'] = buckets[-1]
+
+            stats.append({
+                'name': name,
+                'source': source,
+                'calls': calls,
+                'rows': rows,
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total * 1000 / calls, 3),
+                'max_ms': round(max_elapsed * 1000, 3),
+                'p50_ms': cls._percentile(buckets, calls, 0.5),
+                'p95_ms': cls._percentile(buckets, calls, 0.95),
+                'histogram': histogram,
+            })
+
+        return stats
+
+    @classmethod
+    def log_summary(cls, logger, since=None, top=10):
+        """Log the functions taking more time.
+
+        :param logger: the logger.
+        :type logger: logging.Logger
+        :param since: a snapshot of the stats, to log only the calls made after it. None to log all the calls of this process.
+        :type since: dict|None
+        :param top: the number of functions logged.
+        :type top: int
+        """
+        since = since or {}
+
+        with cls._lock:
+            items = [(name, source, calls, rows, total, list(buckets))
+                     for (name, source), (calls, rows, total, max_elapsed, buckets) in cls.stats.items()]
+
+        summary = []
+
+        for name, source, calls, rows, total, buckets in items:
+            if (name, source) in since:
+                before_calls, before_rows, before_total, before_buckets = since[(name, source)]
+                calls -= before_calls
+                rows -= before_rows
+                total -= before_total
+                buckets = [count - before_count for count, before_count in zip(buckets, before_buckets)]
+
+            if calls:
+                summary.append((name, source, calls, rows, total, buckets))
+
+        for name, source, calls, rows, total, buckets in sorted(summary, key=lambda item: item[4], reverse=True)[:top]:
+            # The max can not be told for the calls after the snapshot, the p95 is given instead
+            p95_ms = cls._percentile(buckets, calls, 0.95)
+            p95 = f'{p95_ms} ms' if p95_ms is not None else f'> {HISTOGRAM_BUCKETS_MS[-1]} ms'
+
+            logger.info(f"Query {name} from {source}: {calls} calls, {rows} rows, "
+                        f"{round(total * 1000, 3)} ms total, {round(total * 1000 / calls, 3)} ms mean, {p95} p95")
+
+
+def _timed_rows(name, source, params, rows_iter, elapsed):
+    """Yield the rows of a generator returned by a Statements function, recording the time spent fetching them."""
+    rows = 0
+
+    try:
+        while True:
+            t1 = time.perf_counter()
+
+            try:
+                row = next(rows_iter)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - t1
+
+            rows += 1
+
+            yield row
+    finally:
+        QueryStats.record(name, source, elapsed, rows, params)
+
+
+def _timed(name, method):
+    """Return method recording its calls in QueryStats."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        source = current_source()
+        rows = [0]
+        token = _rows.set(rows)
+        t1 = time.perf_counter()
+
+        try:
+            res = method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t1
+            _rows.reset(token)
+
+        # Rows of server side cursors are counted while they are consumed
+        if inspect.isgenerator(res):
+            return _timed_rows(name, source, args, res, elapsed)
+
+        QueryStats.record(name, source, elapsed, rows[0], args)
+
+        return res
+
+    return wrapper
+
+
+def instrument(cls):
+    """Class decorator timing every public function of a Statements class, except commit and rollback."""
+    for name, method in list(vars(cls).items()):
+        if inspect.isfunction(method) and not name.startswith('_') and name not in ('commit', 'rollback'):
+            setattr(cls, name, _timed(name, method))
+
+    return cls
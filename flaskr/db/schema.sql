@@ -6,7 +6,13 @@
 -- CREATE USER meteo WITH ENCRYPTED PASSWORD 'meteo';
 -- CREATE DATABASE meteo OWNER meteo;
 -- GRANT ALL PRIVILEGES ON DATABASE meteo TO meteo;
+DROP TABLE IF EXISTS schema_migrations;
+DROP TABLE IF EXISTS station_averages;
+DROP TABLE IF EXISTS observations;
+DROP TABLE IF EXISTS ingestion_status;
 DROP TABLE IF EXISTS ecad_elements;
+DROP TABLE IF EXISTS jobs;
+DROP TABLE IF EXISTS station_views;
 DROP TABLE IF EXISTS stations;
 DROP TABLE IF EXISTS data_files;
 DROP TABLE IF EXISTS measurements;
@@ -15,6 +21,11 @@ DROP TABLE IF EXISTS magnitudes;
 DROP TABLE IF EXISTS providers_extra_data;
 DROP TABLE IF EXISTS providers;
 
+CREATE TABLE schema_migrations (
+  name TEXT PRIMARY KEY,
+  applied_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
 CREATE TABLE providers (
   id SERIAL PRIMARY KEY,
   name TEXT UNIQUE NOT NULL,
@@ -144,13 +155,22 @@ CREATE TABLE stations (
   station_id INTEGER NOT NULL,
   name TEXT NOT NULL,
   cn TEXT NOT NULL,
-  lat TEXT NOT NULL,
-  lon TEXT NOT NULL,
+  lat DOUBLE PRECISION NOT NULL,
+  lon DOUBLE PRECISION NOT NULL,
   height INTEGER NOT NULL,
   popup TEXT NULL,
   FOREIGN KEY (provider_id) REFERENCES providers(id)
 );
 
+-- A station is saved once per provider
+CREATE UNIQUE INDEX stations_key ON stations (provider_id, station_id);
+
+-- Stations of a country
+CREATE INDEX stations_country ON stations (provider_id, cn);
+
+-- Stations inside a bounding box: point(lon, lat) <@ box(point(min_lon, min_lat), point(max_lon, max_lat))
+CREATE INDEX stations_location ON stations USING gist (point(lon, lat));
+
 CREATE TABLE ecad_elements (
   id SERIAL PRIMARY KEY,
   provider_id INTEGER NOT NULL,
@@ -163,3 +183,80 @@ CREATE TABLE ecad_elements (
   priority INTEGER NOT NULL
 );
 
+-- Key of the elements upserts
+CREATE UNIQUE INDEX ecad_elements_key ON ecad_elements (provider_id, magnitude_id, measurement_id, element_id);
+
+-- Unit and factor of an element
+CREATE INDEX ecad_elements_element ON ecad_elements (provider_id, element_id);
+
+-- Number of times each station graph has been requested
+CREATE TABLE station_views (
+  data_station_id INTEGER PRIMARY KEY,
+  views BIGINT NOT NULL DEFAULT 0,
+  last_view TIMESTAMP NULL,
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
+
+-- Most viewed stations
+CREATE INDEX station_views_views ON station_views (views DESC, last_view DESC);
+
+-- Queue of background tasks (station graphs, ...), drained by the run-worker processes
+CREATE TABLE jobs (
+  id BIGSERIAL PRIMARY KEY,
+  kind TEXT NOT NULL,
+  provider_id INTEGER NOT NULL,
+  data_station_id INTEGER NOT NULL,
+  priority INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL,
+  run_after TIMESTAMP NOT NULL DEFAULT now(),
+  lease_until TIMESTAMP NULL,
+  locked_by TEXT NULL,
+  last_error TEXT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP NOT NULL DEFAULT now(),
+  FOREIGN KEY (provider_id) REFERENCES providers(id),
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
+
+-- Only one active job per task
+CREATE UNIQUE INDEX jobs_active_task ON jobs (kind, data_station_id) WHERE status IN ('pending', 'running');
+
+-- Claim order
+CREATE INDEX jobs_claim ON jobs (priority, run_after, id) WHERE status = 'pending';
+
+-- State of the ingestion pipeline, written by the process holding the ingestion advisory lock
+CREATE TABLE ingestion_status (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  leader TEXT NOT NULL,
+  state TEXT NOT NULL,
+  started_at TIMESTAMP NULL,
+  finished_at TIMESTAMP NULL,
+  message TEXT NULL,
+  data_version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Daily values of the stations, copied from the provider data files by the ingestion leader.
+-- Partitioned by provider (observations_<provider_id>) and decade (observations_<provider_id>_<decade>);
+-- the partitions are created by the ingestion when needed.
+CREATE TABLE observations (
+  provider_id INTEGER NOT NULL,
+  station_id INTEGER NOT NULL,
+  measurement_id INTEGER NOT NULL,
+  day DATE NOT NULL,
+  value DOUBLE PRECISION NULL,
+  quality SMALLINT NOT NULL,
+  PRIMARY KEY (provider_id, station_id, measurement_id, day)
+) PARTITION BY LIST (provider_id);
+
+-- Averages per decade of the stations measurements, computed by the station_aggregates jobs and read by the graphs
+CREATE TABLE station_averages (
+  data_station_id INTEGER NOT NULL,
+  measurement TEXT NOT NULL,
+  decade INTEGER NOT NULL,
+  average DOUBLE PRECISION NOT NULL,
+  data_version INTEGER NOT NULL,
+  PRIMARY KEY (data_station_id, measurement, decade),
+  FOREIGN KEY (data_station_id) REFERENCES stations(id) ON DELETE CASCADE
+);
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""Module to export a read only SQLite snapshot of the serving data and to query it."""
+# Created: lun oct 19 09:32:30 2026 (+0200)
+# Last-Updated: lun oct 19 10:12:03 2026 (+0200)
+# Filename: snapshot.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import click
+from db.statements import Statements
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Tables of the snapshot. Only what the web workers read: the stations with their popups, to build the markers
+SNAPSHOT_SCHEMA = """
+CREATE TABLE snapshot_info (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+
+CREATE TABLE providers (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL
+);
+
+CREATE TABLE stations (
+  id INTEGER PRIMARY KEY,
+  provider_id INTEGER NOT NULL,
+  station_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  cn TEXT NOT NULL,
+  lat REAL NOT NULL,
+  lon REAL NOT NULL,
+  height INTEGER NOT NULL,
+  popup TEXT NULL
+);
+"""
+
+# Created after the rows are inserted, which is faster than keeping them up to date
+SNAPSHOT_INDEXES = """
+CREATE INDEX stations_provider ON stations (provider_id, id);
+
+ANALYZE;
+"""
+
+STATION_COLUMNS = 'id, station_id, name, cn, lat, lon, height, popup'
+
+# Connections to the snapshot of each thread
+_local = threading.local()
+
+
+def export_snapshot(path, batch_size=2000):
+    """Copy the serving data from PostgreSQL to a new SQLite database and put it in place of the current snapshot.
+
+    The snapshot is written to a temporary file and renamed, so readers see the old or the new file, never a partial one.
+    :param path: the path of the snapshot.
+    :type path: Path
+    :param batch_size: the rows inserted per executemany call.
+    :type batch_size: int
+    :return: the number of stations exported.
+    :rtype: int
+    """
+    stmt = Statements()
+    stations = 0
+
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp_path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+
+    try:
+        # A file nobody reads yet: no journal needed
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(SNAPSHOT_SCHEMA)
+
+        conn.executemany('INSERT INTO providers (id, name) VALUES (?, ?)', [(provider_id, provider['name']) for provider_id, provider in stmt.get_providers_data().items()])
+
+        batch = []
+
+        for row in stmt.iter_all_stations():
+            batch.append(row)
+
+            if len(batch) == batch_size:
+                conn.executemany('INSERT INTO stations (id, provider_id, station_id, name, cn, lat, lon, height, popup) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                stations += len(batch)
+                batch = []
+
+        if batch:
+            conn.executemany('INSERT INTO stations (id, provider_id, station_id, name, cn, lat, lon, height, popup) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            stations += len(batch)
+
+        conn.executescript(SNAPSHOT_INDEXES)
+        conn.executemany('INSERT INTO snapshot_info (key, value) VALUES (?, ?)',
+                         [('created_at', datetime.now(timezone.utc).isoformat()), ('data_version', str(stmt.get_data_version()))])
+        conn.commit()
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    conn.close()
+    os.replace(tmp_path, path)
+
+    return stations
+
+
+def _connect(path):
+    """Open a snapshot read only and memory mapped.
+
+    The file at path is replaced, never modified, so it is opened as immutable and read without locks.
+    :param path: the path of the snapshot.
+    :type path: Path
+    :return: the connection.
+    :rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    conn.execute(f'PRAGMA mmap_size = {int(current_app.config["SQLITE_MMAP_SIZE"])}')
+
+    return conn
+
+
+def get_snapshot():
+    """Return the connection of this thread to the current snapshot, opening it again if the file has been replaced.
+
+    :return: the connection or None if there is no snapshot.
+    :rtype: sqlite3.Connection|None
+    """
+    path = current_app.config['SQLITE_SNAPSHOT_LOCATION']
+
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (os.getpid(), st.st_ino, st.st_mtime_ns)
+
+    if getattr(_local, 'key', None) != key:
+        # Connections inherited from the parent process are left alone
+        if getattr(_local, 'conn', None) is not None and _local.key[0] == os.getpid():
+            _local.conn.close()
+
+        _local.conn = _connect(path)
+        _local.key = key
+
+    return _local.conn
+
+
+def get_serving_statements():
+    """Return the statements the web workers read the stations from.
+
+    :return: a SnapshotStatements instance if SERVING_BACKEND is 'sqlite' and the snapshot exists, a Statements instance otherwise.
+    :rtype: SnapshotStatements|Statements
+    """
+    if current_app.config['SERVING_BACKEND'] == 'sqlite':
+        conn = get_snapshot()
+
+        if conn is not None:
+            return SnapshotStatements(conn)
+
+    return Statements()
+
+
+class SnapshotStatements():
+    """Functions to query the SQLite snapshot, returning the same as the Statements functions with the same name."""
+
+    def __init__(self, conn):
+        """Initialize the class."""
+        self._conn = conn
+
+    def iter_stations_data(self, provider_id):
+        """Iterate the stations of a provider, without loading all of them in memory.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :return: The same columns as Statements.get_stations_data, sorted by id
+        :rtype: sqlite3.Cursor
+        """
+        return self._conn.execute(f'SELECT {STATION_COLUMNS} FROM stations WHERE provider_id = ? ORDER BY id', (provider_id,))
+
+    def get_data_version(self):
+        """Get the version of the data exported to the snapshot.
+
+        :return: the data version, 0 if unknown.
+        :rtype: int
+        """
+        res = self._conn.execute("SELECT value FROM snapshot_info WHERE key = 'data_version'").fetchone()
+
+        return int(res[0]) if res is not None else 0
+
+
+@click.command('export-snapshot')
+@with_appcontext
+def export_snapshot_command():
+    """
+    Export the SQLite snapshot the web workers read when SERVING_BACKEND is 'sqlite'.
+
+    Use command: export PYTHONPATH=/path/to/flaskr_directory; flask --app flaskr/app export-snapshot. The ingestion leader also exports it after each ingestion.
+    """
+    path = current_app.config['SQLITE_SNAPSHOT_LOCATION']
+
+    try:
+        stations = export_snapshot(path)
+        click.echo(f'Snapshot exported to {path} with {stations} stations.')
+    except Exception as e:
+        click.echo(f'Failed to export snapshot: {e}')
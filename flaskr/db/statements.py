@@ -1,130 +1,179 @@
 """Module with functions to query the database."""
 # Created: sáb jul 13 18:14:26 2024 (+0200)
-# Last-Updated: mar nov 18 08:23:11 2025 (+0100)
+# Last-Updated: lun oct 19 10:12:03 2026 (+0200)
 # Filename: statements.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
+import itertools
+import threading
+import time
+
 from db import db
+from db.query_stats import instrument
+from flask import current_app
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 
+# Suffixes making the server side cursors names unique
+_cursor_ids = itertools.count()
 
-class Statements():
-    """Functions to query the database."""
+# Hot queries, prepared once per connection and run with EXECUTE. The parameters are written $1, $2...
+PREPARED_STATEMENTS = {
+    'get_station_data_by_id': 'SELECT id, station_id, name, cn, lat, lon, height, popup FROM stations WHERE id = $1',
+    'get_stations_data': 'SELECT id, station_id, name, cn, lat, lon, height, popup FROM stations WHERE provider_id = $1 ORDER BY id',
+    'get_station_data': 'SELECT id, station_id, name, cn, lat, lon, height, popup FROM stations WHERE provider_id = $1 AND station_id = $2',
+    'get_ecad_unit_factor': 'SELECT factor, unit FROM ecad_elements WHERE provider_id = $1 AND element_id = $2',
+    'get_station_observations': 'SELECT measurement_id, day, value FROM observations WHERE provider_id = $1 AND station_id = $2 AND quality = 0 AND value IS NOT NULL ORDER BY measurement_id, day',
+    'get_station_averages': 'SELECT measurement, decade, average FROM station_averages WHERE data_station_id = $1 AND data_version = $2',
+}
 
-    def __init__(self):
-        """Initialize the class."""
-        # Get the database connection object
-        self._conn = db.get_db()
 
-    def commit(self):
-        """Commit insert, update and delete statements."""
-        self._conn.commit()
+class PreparedStatementsStats():
+    """Class to count the executions of the prepared statements and the time they take."""
 
-    def get_provider_extra_data(self, provider_id):
-        """Get data from providers_extra_data table."""
-        extra_data = None
+    # Stats per statement name, in the form {name: [calls, total seconds, max seconds]}
+    stats = {}
 
-        stmt = 'SELECT key, value FROM providers_extra_data WHERE provider_id = %s'
+    _lock = threading.Lock()
 
-        with self._conn.cursor() as cur:
-            cur.execute(stmt, (provider_id,))
-            extra_data = cur.fetchall()
+    def __init__(self):
+        """Initialize the class."""
 
-        return extra_data
+    @classmethod
+    def record(cls, name, elapsed):
+        """Count an execution of a statement.
 
-    def get_providers_data(self):
-        """Return all providers data.
+        :param name: the name of the statement.
+        :type name: str
+        :param elapsed: the seconds the execution took.
+        :type elapsed: float
+        """
+        with cls._lock:
+            if name not in cls.stats:
+                cls.stats[name] = [0, 0.0, 0.0]
+
+            cls.stats[name][0] += 1
+            cls.stats[name][1] += elapsed
+            cls.stats[name][2] = max(cls.stats[name][2], elapsed)
 
-        Including its magnitudes and measurements
+    @classmethod
+    def get(cls):
+        """Return the stats of this process.
+
+        :return: dict in the form {name: {'calls': int, 'total_ms': float, 'mean_ms': float, 'max_ms': float}}
+        :rtype: dict
         """
-        providers = None
-        providers_data = {}
+        with cls._lock:
+            return {name: {'calls': calls, 'total_ms': round(total * 1000, 3), 'mean_ms': round(total * 1000 / calls, 3), 'max_ms': round(max_elapsed * 1000, 3)}
+                    for name, (calls, total, max_elapsed) in cls.stats.items()}
 
-        with self._conn.cursor() as cur:
-            cur.execute('SELECT id, name, description, url, update_data_period, acknowledgment FROM providers')
-            providers = cur.fetchall()
 
-        if providers:
-            for provider in providers:
-                provider_id = provider[0]
+@instrument
+class Statements():
+    """Functions to query the database.
 
-                if provider_id is not None:
-                    if provider_id not in providers_data:
-                        providers_data[provider_id] = {}
-                        providers_data[provider_id]['name'] = provider[1]
-                        providers_data[provider_id]['description'] = provider[2]
-                        providers_data[provider_id]['url'] = provider[3]
-                        providers_data[provider_id]['update_data_period'] = provider[4]
-                        providers_data[provider_id]['acknowledgment'] = provider[5]
+    Each public function is timed in QueryStats with the route or pipeline stage calling it.
+    """
+
+    def __init__(self):
+        """Initialize the class."""
+        # Get the database connection object
+        self._conn = db.get_db()
 
-                        extra_data = self.get_provider_extra_data(provider_id)
+    def _execute_prepared(self, cur, name, params):
+        """Execute one of the PREPARED_STATEMENTS, preparing it first if this connection has not done it yet.
 
-                        for row in extra_data:
-                            providers_data[provider_id][row[0]] = row[1]
+        :param cur: the cursor.
+        :type cur: psycopg2.extensions.cursor
+        :param name: the name of the statement in PREPARED_STATEMENTS.
+        :type name: str
+        :param params: the statement parameters.
+        :type params: tuple
+        """
+        if name not in self._conn.prepared:
+            cur.execute(sql.SQL('PREPARE {} AS {}').format(sql.Identifier(name), sql.SQL(PREPARED_STATEMENTS[name])))
+            self._conn.prepared.add(name)
 
-                    magnitudes = self.get_magnitude_id_name(provider_id=provider_id)
+        t1 = time.perf_counter()
+        cur.execute(sql.SQL('EXECUTE {} ({})').format(sql.Identifier(name), sql.SQL(', ').join(sql.Placeholder() * len(params))), params)
+        PreparedStatementsStats.record(name, time.perf_counter() - t1)
 
-                    if magnitudes:
-                        if 'magnitudes' not in providers_data[provider_id]:
-                            providers_data[provider_id]['magnitudes'] = {}
+    def _iterate(self, name, stmt, params=None):
+        """Yield the rows of a query from a server side cursor, fetching DB_ITERSIZE rows per round trip.
 
-                        for magnitude_id, magnitude_name in magnitudes:
-                            providers_data[provider_id]['magnitudes'][magnitude_id] = {}
-                            providers_data[provider_id]['magnitudes'][magnitude_id]['name'] = magnitude_name
+        The rows must be consumed before the transaction is committed or rolled back.
+        :param name: prefix of the cursor name.
+        :type name: str
+        :param stmt: the query.
+        :type stmt: str
+        :param params: the query parameters.
+        :type params: tuple|None
+        :return: generator of the rows.
+        :rtype: generator
+        """
+        with self._conn.cursor(name=f'{name}_{next(_cursor_ids)}') as cur:
+            cur.itersize = current_app.config['DB_ITERSIZE']
+            cur.execute(stmt, params)
 
-                            measurements = self.get_measurement_id_name(magnitude_id=magnitude_id)
+            yield from cur
 
-                            if measurements:
-                                if 'measurements' not in providers_data[provider_id]['magnitudes'][magnitude_id]:
-                                    providers_data[provider_id]['magnitudes'][magnitude_id]['measurements'] = {}
+    def commit(self):
+        """Commit insert, update and delete statements, unless they run inside a db.unit_of_work block, which commits them at its end."""
+        if not self._conn.unit_of_work_depth:
+            self._conn.commit()
 
-                                for measurement_id, measurement_name in measurements:
-                                    providers_data[provider_id]['magnitudes'][magnitude_id]['measurements'][measurement_id] = measurement_name
+    def rollback(self):
+        """Rollback the current transaction.
 
-        return providers_data
+        Inside a db.unit_of_work block it undoes the whole block: let the exception propagate, or use a nested block, instead.
+        """
+        self._conn.rollback()
 
-    def get_provider_data_by_station_id(self, data_station_id):
+    def get_providers_data(self):
         """Return all providers data.
 
-        Including its magnitudes and measurements
+        Including its extra data, magnitudes and measurements, loaded with a single query.
         """
-        provider_id = None
-        provider = None
-        provider_data = {}
+        providers = None
+        providers_data = {}
 
-        stmt = 'SELECT t1.id, t1.name, t1.description, t1.url, t1.update_data_period, t1acknowledgment FROM providers t1, stations t2 WHERE t2.data_station_id = %s And t1.provider_id = t2.provider_id'
+        stmt = """SELECT p.id, p.name, p.description, p.url, p.update_data_period, p.acknowledgment,
+                    (SELECT json_object_agg(e.key, e.value) FROM providers_extra_data e WHERE e.provider_id = p.id),
+                    (SELECT json_agg(json_build_array(m.id, m.name,
+                                                      (SELECT json_agg(json_build_array(me.id, me.name) ORDER BY me.id) FROM measurements me WHERE me.magnitude_id = m.id))
+                                     ORDER BY m.id)
+                     FROM magnitudes m, providers_magnitudes pm WHERE m.id = pm.magnitude_id AND pm.provider_id = p.id)
+                  FROM providers p ORDER BY p.id"""
 
         with self._conn.cursor() as cur:
-            cur.execute(stmt, (data_station_id,))
-            provider = cur.fetchall()
-
-        if provider:
-            provider_id = provider[0]
+            cur.execute(stmt)
+            providers = cur.fetchall()
 
-            if provider_id is not None:
-                provider_data[provider_id] = {}
-                provider_data[provider_id]['name'] = provider[1]
-                provider_data[provider_id]['description'] = provider[2]
-                provider_data[provider_id]['url'] = provider[3]
-                provider_data[provider_id]['update_data_period'] = provider[4]
-                provider_data[provider_id]['acknowledgment'] = provider[5]
+        if providers:
+            for provider_id, name, description, url, update_data_period, acknowledgment, extra_data, magnitudes in providers:
+                providers_data[provider_id] = {}
+                providers_data[provider_id]['name'] = name
+                providers_data[provider_id]['description'] = description
+                providers_data[provider_id]['url'] = url
+                providers_data[provider_id]['update_data_period'] = update_data_period
+                providers_data[provider_id]['acknowledgment'] = acknowledgment
 
-                magnitudes = self.get_magnitude_id_name(provider_id=provider_id)
+                if extra_data:
+                    providers_data[provider_id].update(extra_data)
 
                 if magnitudes:
-                    provider_data[provider_id]['magnitudes'] = {}
-
-                    for magnitude_id, magnitude_name in magnitudes:
-                        provider_data[provider_id]['magnitudes'][magnitude_id] = {}
-                        provider_data[provider_id]['magnitudes'][magnitude_id]['name'] = magnitude_name
+                    providers_data[provider_id]['magnitudes'] = {}
 
-                        measurements = self.get_measurement_id_name(magnitude_id=magnitude_id)
+                    for magnitude_id, magnitude_name, measurements in magnitudes:
+                        providers_data[provider_id]['magnitudes'][magnitude_id] = {}
+                        providers_data[provider_id]['magnitudes'][magnitude_id]['name'] = magnitude_name
 
                         if measurements:
-                            provider_data[provider_id]['magnitudes'][magnitude_id]['measurements'] = {}
+                            providers_data[provider_id]['magnitudes'][magnitude_id]['measurements'] = {}
 
                             for measurement_id, measurement_name in measurements:
-                                provider_data[provider_id]['magnitudes'][magnitude_id]['measurements'][measurement_id] = measurement_name
+                                providers_data[provider_id]['magnitudes'][magnitude_id]['measurements'][measurement_id] = measurement_name
 
-        return provider_id, provider_data
+        return providers_data
 
     def get_provider_id(self, name):
         """Return the id of the provider identified by name.
@@ -537,53 +586,49 @@ class Statements():
 
         return res
 
-    def check_station(self, provider_id, station_id):
-        """Check if a station exists in the database.
+    def get_station_ids(self, provider_id):
+        """Get the ids of the stations of a provider.
 
-        If it exists return the subtypes and the latitude and longitude values to check them.
         :param provider_id: The id of the provider
         :type provider_id: int
-        :param station_id: The id of the station
-        :type station_id: int
+        :return: The station ids of the provider
+        :rtype: set
         """
-        res = None
+        res = set()
 
         with self._conn.cursor() as cur:
-            cur.execute('SELECT lat, lon FROM stations WHERE provider_id = %s AND station_id = %s', (provider_id, station_id))
+            cur.execute('SELECT station_id FROM stations WHERE provider_id = %s', (provider_id,))
 
-            result = cur.fetchall()
-
-            res = result[0] if result else None
+            res = {row[0] for row in cur.fetchall()}
 
         return res
 
-    def insert_station(self, provider_id, station_id, name, cn, lat, lon, height):
-        """Insert a new station in the stations table.
+    def insert_stations(self, provider_id, stations, page_size=1000):
+        """Insert new stations in the stations table in a single transaction.
 
+        The stations are sent in pages of page_size rows.
         :param provider_id: The id of the provider
         :type provider_id: int
-        :param station_id: The id of the station
-        :type station_id: int
-        :param name: The name of the measurement.
-        :type name: str
-        :param cn: The country code for the station's country
-        :type cn: str
-        :param lat: The latitude in decimal format
-        :type lat: float
-        :param lon: The longitude in decimal format
-        :type lon: float
-        :param height: The height of the station in meters
-        :type height: int
+        :param stations: list of tuples in the form (station_id, name, cn, lat, lon, height)
+        :type stations: list
+        :param page_size: the number of stations inserted by each statement.
+        :type page_size: int
         :return: The number of rows affected
         :rtype: int
         """
         rowcount = 0
 
-        with self._conn.cursor() as cur:
-            cur.execute('INSERT into stations(provider_id, station_id, name, cn, lat, lon, height) VALUES (%s, %s, %s, %s, %s, %s, %s)', (provider_id, station_id, name, cn, lat, lon, height))
-            rowcount = cur.rowcount
+        stmt = 'INSERT INTO stations (provider_id, station_id, name, cn, lat, lon, height) VALUES %s'
+
+        if stations:
+            rows = [(provider_id, *station) for station in stations]
+
+            with self._conn.cursor() as cur:
+                # execute_values only keeps the rowcount of its last page
+                for i in range(0, len(rows), page_size):
+                    execute_values(cur, stmt, rows[i:i + page_size], page_size=page_size)
+                    rowcount += cur.rowcount
 
-            if rowcount == 1:
                 self.commit()
 
         return rowcount
@@ -600,39 +645,101 @@ class Statements():
         """
         res = None
 
-        stmt = "SELECT id, station_id, name, cn, lat, lon, height, popup FROM stations WHERE provider_id = %s"
-
         with self._conn.cursor() as cur:
             if station_id is not None:
-                stmt += ' AND station_id = %s'
-                cur.execute(stmt, (provider_id, station_id))
+                self._execute_prepared(cur, 'get_station_data', (provider_id, station_id))
             else:
-                stmt += ' ORDER BY id'
-                cur.execute(stmt, (provider_id,))
+                self._execute_prepared(cur, 'get_stations_data', (provider_id,))
 
             res = cur.fetchall()
 
         return res
 
-    def get_station_popup(self, station_id):
-        """Get the popup info from the stations table.
+    def iter_stations_data(self, provider_id):
+        """Iterate the stations of a provider from a server side cursor, without loading all of them in memory.
 
-        :param station_id: The id of the station
-        :type station_id: int|None
-        :return: the popup for the station
-        :rtype: list|None
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :return: The same columns as get_stations_data, sorted by id
+        :rtype: generator
         """
-        res = None
+        stmt = 'SELECT id, station_id, name, cn, lat, lon, height, popup FROM stations WHERE provider_id = %s ORDER BY id'
 
-        stmt = 'SELECT popup FROM stations WHERE id = %s'
+        return self._iterate('stations', stmt, (provider_id,))
 
-        with self._conn.cursor() as cur:
-            cur.execute(stmt, (station_id,))
+    def iter_station_locations(self, provider_id):
+        """Iterate the locations of the stations of a provider from a server side cursor, without their popups.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :return: The id, cn, lat and lon columns, sorted by id
+        :rtype: generator
+        """
+        stmt = 'SELECT id, cn, lat, lon FROM stations WHERE provider_id = %s ORDER BY id'
+
+        return self._iterate('station_locations', stmt, (provider_id,))
+
+    def get_station_locations(self, provider_id, cn=None, bbox=None):
+        """Get the locations of the stations of a provider in a country or inside a bounding box.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :param cn: The country code of the stations
+        :type cn: str|None
+        :param bbox: The bounding box of the stations in the form (min_lon, min_lat, max_lon, max_lat)
+        :type bbox: tuple|None
+        :return: The id, cn, lat and lon columns
+        :rtype: list
+        """
+        res = []
+
+        stmt = 'SELECT id, cn, lat, lon FROM stations WHERE provider_id = %s'
+        params = [provider_id]
 
+        if cn is not None:
+            stmt += ' AND cn = %s'
+            params.append(cn)
+        elif bbox is not None:
+            stmt += ' AND point(lon, lat) <@ box(point(%s, %s), point(%s, %s))'
+            params += list(bbox)
+        else:
+            return res
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, params)
             res = cur.fetchall()
 
         return res
 
+    def iter_all_stations(self):
+        """Iterate the stations of all the providers from a server side cursor.
+
+        :return: the id, provider_id, station_id, name, cn, lat, lon, height and popup columns, sorted by id
+        :rtype: generator
+        """
+        stmt = 'SELECT id, provider_id, station_id, name, cn, lat, lon, height, popup FROM stations ORDER BY id'
+
+        return self._iterate('all_stations', stmt)
+
+    def get_station_data_by_id(self, data_station_id):
+        """Get the data of a station from the stations table using its id.
+
+        :param data_station_id: The id of the station in the table
+        :type data_station_id: int
+        :return: The same columns as get_stations_data for this station
+        :rtype: tuple|None
+        """
+        res = None
+
+        with self._conn.cursor() as cur:
+            self._execute_prepared(cur, 'get_station_data_by_id', (data_station_id,))
+            result = cur.fetchall()
+
+            if result:
+                res = result[0]
+
+        return res
+
     def get_station_ids_from_staid(self, provider_id, staid):
         """Get the id (auto increment from database table) and the station_id (from provider) from stations given its station_id and provider_id.
 
@@ -653,29 +760,6 @@ class Statements():
 
         return res
 
-    def get_station_provider(self, station_id):
-        """Get the station's provider id and name.
-
-        :param station_id: The id of the station in the table
-        :type station_id: int
-        :return: The provider id and name
-        :rtype: tuple
-        """
-        provider_id = None
-        provider_name = None
-
-        stmt = 'SELECT t1.provider_id, t2.name FROM stations t1, providers t2 WHERE t1.id = %s AND t1.id = t2.id'
-
-        with self._conn.cursor() as cur:
-            cur.execute(stmt, (station_id,))
-            res = cur.fetchall()
-
-            if res:
-                provider_id = res[0][0]
-                provider_name = res[0][1]
-
-        return provider_id, provider_name
-
     def check_ecad_source(self, provider_id, magnitude_id, measurement_id, source_id):
         """Check if a source exists in the database.
 
@@ -746,31 +830,6 @@ class Statements():
 
         return res, rowcount
 
-    def update_source_popup_marker(self, popup, data_station_id):
-        """Update the source popup in the station table.
-
-        :param popup: The popup data to be updated.
-        :type popup: str
-        :param data_station_id: The id of the station in the table
-        :type data_station_id: int
-        :return: the number of rows affected and the new row id
-        :rtype: tuple
-        """
-        rowcount = 0
-        lastrowid = None
-
-        if popup:
-            with self._conn.cursor() as cur:
-                cur.execute('UPDATE stations SET popup = %s WHERE id = %s', (popup, data_station_id))
-                rowcount = cur.rowcount
-
-                if rowcount == 1:
-                    self.commit()
-
-                    lastrowid = cur.lastrowid
-
-        return rowcount, lastrowid
-
     def get_source_eleid_from_station_id(self, provider_id, staid, measurement_id, magnitude_id):
         """Get the element_id from source by station_id and measurement_id.
 
@@ -814,6 +873,31 @@ class Statements():
 
         return rowcount
 
+    def update_source_popup_markers(self, popups, page_size=1000):
+        """Update the source popups of many stations in a single transaction.
+
+        The popups are sent in pages of page_size rows. Stations whose popup did not change are not written.
+        :param popups: list of tuples in the form (data_station_id, popup)
+        :type popups: list
+        :param page_size: the number of popups updated by each statement.
+        :type page_size: int
+        :return: the number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = 'UPDATE stations SET popup = v.popup FROM (VALUES %s) AS v (id, popup) WHERE stations.id = v.id AND stations.popup IS DISTINCT FROM v.popup'
+
+        if popups:
+            with self._conn.cursor() as cur:
+                for i in range(0, len(popups), page_size):
+                    execute_values(cur, stmt, popups[i:i + page_size], page_size=page_size)
+                    rowcount += cur.rowcount
+
+                self.commit()
+
+        return rowcount
+
     def count_ecad_elements(self):
         """Count the number of rows in ecad_elements table.
 
@@ -830,8 +914,8 @@ class Statements():
 
         return res
 
-    def get_ecad_element(self, provider_id, magnitude_id, measurement_id, eleid):
-        """Get the element's data from database.
+    def upsert_ecad_elements(self, provider_id, magnitude_id, measurement_id, elements):
+        """Insert or update the elements of a measurement in a single statement and transaction.
 
         :param provider_id: The id of the provider
         :type provider_id: int
@@ -839,97 +923,514 @@ class Statements():
         :type magnitude_id: int
         :param measurement_id: The id of the measurement.
         :type measurement_id: int
-        :param eleid: The name of the element
-        :type eleid: str
-        :return: The data associated with the element.
+        :param elements: list of tuples in the form (eleid, descr, unit, factor, priority), without repeated element ids
+        :type elements: list
+        :return: The number of rows inserted or changed
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = 'INSERT INTO ecad_elements (provider_id, magnitude_id, measurement_id, element_id, description, unit, factor, priority) VALUES %s ON CONFLICT (provider_id, magnitude_id, measurement_id, element_id) DO UPDATE SET description = EXCLUDED.description, unit = EXCLUDED.unit, factor = EXCLUDED.factor, priority = EXCLUDED.priority WHERE (ecad_elements.description, ecad_elements.unit, ecad_elements.factor, ecad_elements.priority) IS DISTINCT FROM (EXCLUDED.description, EXCLUDED.unit, EXCLUDED.factor, EXCLUDED.priority)'
+
+        if elements:
+            with self._conn.cursor() as cur:
+                # A single page, so a single round trip
+                execute_values(cur, stmt, [(provider_id, magnitude_id, measurement_id, *element) for element in elements], page_size=len(elements))
+                rowcount = cur.rowcount
+
+                self.commit()
+
+        return rowcount
+
+    def get_ecad_unit_factor(self, provider_id, element_id):
+        """Get unit and factor from ecad_elements table by provider and element id.
+
+        :param provider_id: the id of the data provider
+        :type provider_id: int
+        :param element_id: the id of the element which is unique in the table.
+        :type element_id: str
+        :return: The factor and unit for this element.
         :rtype: list|None
         """
         res = None
 
         with self._conn.cursor() as cur:
-            cur.execute('SELECT element_id, description, unit, factor FROM ecad_elements WHERE provider_id = %s AND magnitude_id = %s AND measurement_id = %s AND element_id = %s', (provider_id, magnitude_id, measurement_id, eleid))
+            self._execute_prepared(cur, 'get_ecad_unit_factor', (provider_id, element_id))
+            result = cur.fetchall()
+
+            if result:
+                res = result[0]
+
+        return res
+
+    def get_preferred_measurements_type(self):
+        """Get the element ids ordered by priority.
+
+        :return: Dictionary with priority lists by measurement.
+        :rtype: dict
+        """
+        res = {}
+
+        stmt = 'SELECT t2.name, t1.element_id FROM ecad_elements t1, measurements t2 WHERE t1.measurement_id = t2.id ORDER BY t1.measurement_id, t1.priority'
+
+        for measurement, element_id in self._iterate('preferred_measurements_type', stmt):
+            if measurement not in res:
+                res[measurement] = []
+
+            res[measurement].append(element_id)
+
+        return res
+
+    def add_station_views(self, views):
+        """Add the number of views of some stations to the station_views table.
+
+        :param views: list of tuples in the form (data_station_id, views, last_view)
+        :type views: list
+        :return: The number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = 'INSERT INTO station_views (data_station_id, views, last_view) VALUES %s ON CONFLICT (data_station_id) DO UPDATE SET views = station_views.views + EXCLUDED.views, last_view = GREATEST(station_views.last_view, EXCLUDED.last_view)'
+
+        if views:
+            with self._conn.cursor() as cur:
+                execute_values(cur, stmt, views)
+                rowcount = cur.rowcount
+
+                self.commit()
+
+        return rowcount
+
+    def get_most_viewed_stations(self, provider_id, limit):
+        """Get the data of the most viewed stations of a provider.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :param limit: The max number of stations to return
+        :type limit: int
+        :return: The same columns as get_stations_data, the most viewed stations first
+        :rtype: list|None
+        """
+        res = None
+
+        stmt = 'SELECT t1.id, t1.station_id, t1.name, t1.cn, t1.lat, t1.lon, t1.height, t1.popup FROM stations t1, station_views t2 WHERE t1.id = t2.data_station_id AND t1.provider_id = %s ORDER BY t2.views DESC, t2.last_view DESC LIMIT %s'
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, (provider_id, limit))
             res = cur.fetchall()
 
         return res
 
-    def insert_ecad_element(self, provider_id, magnitude_id, measurement_id, eleid, descr, unit, factor, priority):
-        """Insert the element's data.
+    def enqueue_jobs(self, kind, provider_id, data_station_ids, priority, max_attempts):
+        """Add jobs to the jobs table, one per station.
 
+        If a station already has an active job of this kind, its priority is raised if needed.
+        :param kind: The kind of task, i.e. 'station_graph'
+        :type kind: str
         :param provider_id: The id of the provider
         :type provider_id: int
-        :param magnitude_id: The id of the magnitude
-        :type magnitude_id: int
-        :param measurement_id: The id of the measurement.
-        :type measurement_id: int
-        :param eleid: The name of the element
-        :type eleid: str
-        :param descr: The description of the element
-        :type descr: str
-        :param unit: The unit used in the sources using this element
-        :type unit: str
-        :param factor: The factor which is used to multiply the data on the sources using this element
-        :type factor: float
-        :param priority: The priority of the element id in order to use one or another.
+        :param data_station_ids: The ids of the stations in the table
+        :type data_station_ids: list
+        :param priority: The priority of the jobs, lower values are claimed first
         :type priority: int
-        :return: the number of rows affected and the new row id
-        :rtype: tuple
+        :param max_attempts: The number of times a job is tried before failing
+        :type max_attempts: int
+        :return: The number of rows affected
+        :rtype: int
         """
         rowcount = 0
-        lastrowid = None
 
-        with self._conn.cursor() as cur:
-            cur.execute('INSERT INTO ecad_elements (provider_id, magnitude_id, measurement_id, element_id, description, unit, factor, priority) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)', (provider_id, magnitude_id, measurement_id, eleid, descr, unit, factor, priority))
-            rowcount = cur.rowcount
-
-            if rowcount == 1:
-                self.commit()
+        stmt = "INSERT INTO jobs (kind, provider_id, data_station_id, priority, max_attempts) VALUES %s ON CONFLICT (kind, data_station_id) WHERE status IN ('pending', 'running') DO UPDATE SET priority = LEAST(jobs.priority, EXCLUDED.priority), updated_at = now()"
 
-                lastrowid = cur.lastrowid
+        if data_station_ids:
+            with self._conn.cursor() as cur:
+                execute_values(cur, stmt, [(kind, provider_id, data_station_id, priority, max_attempts) for data_station_id in data_station_ids])
+                rowcount = cur.rowcount
 
-        return rowcount, lastrowid
+                self.commit()
 
-    def get_ecad_unit_factor(self, provider_id, element_id):
-        """Get unit and factor from ecad_elements table by provider and element id.
+        return rowcount
 
-        :param provider_id: the id of the data provider
-        :type provider_id: int
-        :param element_id: the id of the element which is unique in the table.
-        :type element_id: str
-        :return: The factor and unit for this element.
-        :rtype: list|None
+    def claim_job(self, worker_id, lease_seconds, max_priority):
+        """Claim the next job to run, skipping the ones locked by other workers.
+
+        Jobs whose lease expired (their worker died) are claimed again while they have attempts left.
+        :param worker_id: The identifier of the claiming worker
+        :type worker_id: str
+        :param lease_seconds: The seconds the worker owns the job
+        :type lease_seconds: int
+        :param max_priority: The lowest priority to claim
+        :type max_priority: int
+        :return: A tuple (id, kind, provider_id, data_station_id, attempts) or None if there is nothing to run
+        :rtype: tuple|None
         """
         res = None
 
-        stmt = 'SELECT factor, unit FROM ecad_elements WHERE provider_id = %s AND element_id = %s'
+        stmt = ("UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = %s, lease_until = now() + %s * interval '1 second', updated_at = now() "
+                "WHERE id = (SELECT id FROM jobs WHERE priority <= %s AND ((status = 'pending' AND run_after <= now()) OR (status = 'running' AND lease_until < now() AND attempts < max_attempts)) "
+                "ORDER BY priority, run_after, id LIMIT 1 FOR UPDATE SKIP LOCKED) "
+                "RETURNING id, kind, provider_id, data_station_id, attempts")
 
         with self._conn.cursor() as cur:
-            cur.execute(stmt, (provider_id, element_id))
+            cur.execute(stmt, (worker_id, lease_seconds, max_priority))
             result = cur.fetchall()
 
+            self.commit()
+
             if result:
                 res = result[0]
 
         return res
 
-    def get_preferred_measurements_type(self):
-        """Get the element ids ordered by priority.
+    def complete_job(self, job_id, worker_id):
+        """Mark a job as done.
 
-        :return: Dictionary with priority lists by measurement.
+        :param job_id: The id of the job
+        :type job_id: int
+        :param worker_id: The identifier of the worker owning the job
+        :type worker_id: str
+        :return: The number of rows affected. Zero if the worker lost the job lease.
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = "UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = now() WHERE id = %s AND locked_by = %s AND status = 'running'"
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, (job_id, worker_id))
+            rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def fail_job(self, job_id, worker_id, error, retry_delay):
+        """Mark a job as failed, leaving it pending to be retried later if it has attempts left.
+
+        :param job_id: The id of the job
+        :type job_id: int
+        :param worker_id: The identifier of the worker owning the job
+        :type worker_id: str
+        :param error: The error message
+        :type error: str
+        :param retry_delay: The seconds to wait before the first retry. It grows with each attempt.
+        :type retry_delay: int
+        :return: The number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = ("UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                "run_after = now() + %s * attempts * attempts * interval '1 second', lease_until = NULL, last_error = %s, updated_at = now() "
+                "WHERE id = %s AND locked_by = %s AND status = 'running'")
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, (retry_delay, error, job_id, worker_id))
+            rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def cleanup_jobs(self, keep_days):
+        """Fail the jobs whose lease expired without attempts left, and delete the old finished jobs.
+
+        :param keep_days: The days the done jobs are kept
+        :type keep_days: int
+        :return: The number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        with self._conn.cursor() as cur:
+            cur.execute("UPDATE jobs SET status = 'failed', last_error = 'lease expired', updated_at = now() WHERE status = 'running' AND lease_until < now() AND attempts >= max_attempts")
+            rowcount = cur.rowcount
+
+            cur.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < now() - %s * interval '1 day'", (keep_days,))
+            rowcount += cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def promote_jobs(self, kinds, priority, data_station_id=None, provider_id=None, cn=None, bbox=None):
+        """Raise the priority of the pending jobs of a station, a country or a bounding box.
+
+        :param kinds: The kinds of task, i.e. ('station_aggregates', 'station_graph')
+        :type kinds: tuple
+        :param priority: The new priority, only applied if it is higher than the current one
+        :type priority: int
+        :param data_station_id: The id of the station in the table
+        :type data_station_id: int|None
+        :param provider_id: The id of the provider, with cn or bbox
+        :type provider_id: int|None
+        :param cn: The country code of the stations
+        :type cn: str|None
+        :param bbox: The bounding box of the stations in the form (min_lon, min_lat, max_lon, max_lat)
+        :type bbox: tuple|None
+        :return: The number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = "UPDATE jobs SET priority = %s, updated_at = now() WHERE kind = ANY(%s) AND status = 'pending' AND priority > %s"
+        params = [priority, list(kinds), priority]
+
+        if data_station_id is not None:
+            stmt += ' AND data_station_id = %s'
+            params.append(data_station_id)
+        elif cn is not None:
+            stmt += ' AND data_station_id IN (SELECT id FROM stations WHERE provider_id = %s AND cn = %s)'
+            params += [provider_id, cn]
+        elif bbox is not None:
+            stmt += ' AND data_station_id IN (SELECT id FROM stations WHERE provider_id = %s AND point(lon, lat) <@ box(point(%s, %s), point(%s, %s)))'
+            params += [provider_id, *bbox]
+        else:
+            return rowcount
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, params)
+            rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def notify(self, channel, payload):
+        """Send a notification to the sessions listening to a channel.
+
+        :param channel: The name of the channel
+        :type channel: str
+        :param payload: The payload of the notification, up to 8000 bytes
+        :type payload: str
+        """
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+
+            self.commit()
+
+    def count_jobs(self):
+        """Count the jobs per status.
+
+        :return: A dict with the number of jobs per status
         :rtype: dict
         """
         res = {}
 
-        stmt = 'SELECT t2.name, t1.element_id FROM ecad_elements t1, measurements t2 WHERE t1.measurement_id = t2.id ORDER BY t1.measurement_id, t1.priority'
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+
+            for status, count in cur.fetchall():
+                res[status] = count
+
+        return res
+
+    def set_ingestion_status(self, leader, state, message=None):
+        """Set the state of the ingestion pipeline.
+
+        :param leader: The identifier of the process running the pipeline
+        :type leader: str
+        :param state: The state of the pipeline: 'running', 'done' or 'failed'
+        :type state: str
+        :param message: An optional message, i.e. the error
+        :type message: str|None
+        :return: The number of rows affected
+        :rtype: int
+        """
+        rowcount = 0
+
+        stmt = ("INSERT INTO ingestion_status (id, leader, state, started_at, finished_at, message) "
+                "VALUES (1, %(leader)s, %(state)s, CASE WHEN %(state)s = 'running' THEN now() END, CASE WHEN %(state)s <> 'running' THEN now() END, %(message)s) "
+                "ON CONFLICT (id) DO UPDATE SET leader = EXCLUDED.leader, state = EXCLUDED.state, "
+                "started_at = COALESCE(EXCLUDED.started_at, ingestion_status.started_at), finished_at = EXCLUDED.finished_at, message = EXCLUDED.message")
+
+        with self._conn.cursor() as cur:
+            cur.execute(stmt, {'leader': leader, 'state': state, 'message': message})
+            rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def get_ingestion_status(self, lock_key):
+        """Get the state of the ingestion pipeline and if its advisory lock is held by some process.
+
+        :param lock_key: The key of the ingestion advisory lock
+        :type lock_key: int
+        :return: A dict with the leader, state, started_at, finished_at, message and leader_alive keys
+        :rtype: dict
+        """
+        res = {'leader': None, 'state': None, 'started_at': None, 'finished_at': None, 'message': None}
+
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT leader, state, started_at, finished_at, message FROM ingestion_status WHERE id = 1')
+            result = cur.fetchall()
+
+            if result:
+                res = dict(zip(res.keys(), result[0]))
+
+            # A bigint advisory lock is stored as two 32 bits halves
+            cur.execute("SELECT COUNT(*) FROM pg_locks WHERE locktype = 'advisory' AND granted AND classid = %s AND objid = %s AND objsubid = 1", (lock_key >> 32, lock_key & 0xFFFFFFFF))
+            res['leader_alive'] = cur.fetchall()[0][0] > 0
+
+        return res
+
+    def publish_data_version(self):
+        """Increment the version of the published data, once an ingestion has committed new data.
+
+        :return: the new data version, 0 if the ingestion status has not been written yet.
+        :rtype: int
+        """
+        res = 0
+
+        # The row is written when the ingestion starts running
+        stmt = 'UPDATE ingestion_status SET data_version = data_version + 1 WHERE id = 1 RETURNING data_version'
 
         with self._conn.cursor() as cur:
             cur.execute(stmt)
             result = cur.fetchall()
 
+            self.commit()
+
+            if result:
+                res = result[0][0]
+
+        return res
+
+    def get_data_version(self):
+        """Get the version of the published data, incremented by each ingestion saving new data.
+
+        :return: the data version, 0 if no ingestion has been done.
+        :rtype: int
+        """
+        res = 0
+
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT data_version FROM ingestion_status WHERE id = 1')
+            result = cur.fetchall()
+
             if result:
-                for measurement, element_id in result:
-                    if measurement not in res:
-                        res[measurement] = []
+                res = result[0][0]
+
+        return res
+
+    def ensure_observations_partitions(self, provider_id, decades):
+        """Create, if they do not exist, the partitions of the observations table for a provider and some decades.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :param decades: The first year of the decades, i.e. 1950
+        :type decades: iterable
+        """
+        provider_partition = sql.Identifier(f'observations_{provider_id}')
+
+        with self._conn.cursor() as cur:
+            cur.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF observations FOR VALUES IN (%s) PARTITION BY RANGE (day)').format(provider_partition), (provider_id,))
+
+            for decade in decades:
+                decade_partition = sql.Identifier(f'observations_{provider_id}_{decade}')
+                cur.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)').format(decade_partition, provider_partition), (f'{decade}-01-01', f'{decade + 10}-01-01'))
+
+            self.commit()
+
+    def replace_station_observations(self, provider_id, station_id, observations):
+        """Replace the observations of a station with COPY, in a single transaction.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :param station_id: The id of the station, as stated by the provider
+        :type station_id: int
+        :param observations: file like object with tab separated lines in the form provider_id, station_id, measurement_id, day, value, quality. Null values are written \\N
+        :type observations: io.TextIOBase
+        :return: The number of rows copied
+        :rtype: int
+        """
+        rowcount = 0
 
-                    res[measurement].append(element_id)
+        with self._conn.cursor() as cur:
+            cur.execute('DELETE FROM observations WHERE provider_id = %s AND station_id = %s', (provider_id, station_id))
+            cur.copy_expert('COPY observations (provider_id, station_id, measurement_id, day, value, quality) FROM STDIN', observations)
+            rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def get_station_observations(self, provider_id, station_id):
+        """Get the valid observations of a station.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :param station_id: The id of the station, as stated by the provider
+        :type station_id: int
+        :return: The rows in the form (measurement_id, day, value), sorted by measurement and day
+        :rtype: list
+        """
+        res = None
+
+        with self._conn.cursor() as cur:
+            self._execute_prepared(cur, 'get_station_observations', (provider_id, station_id))
+            res = cur.fetchall()
+
+        return res
+
+    def replace_station_averages(self, data_station_id, data_version, averages):
+        """Replace the averages per decade of a station, in a single transaction.
+
+        :param data_station_id: The id of the station in the table
+        :type data_station_id: int
+        :param data_version: The data version the averages are computed from
+        :type data_version: int
+        :param averages: The rows in the form (measurement, decade, average)
+        :type averages: list
+        :return: The number of rows inserted
+        :rtype: int
+        """
+        rowcount = 0
+
+        with self._conn.cursor() as cur:
+            cur.execute('DELETE FROM station_averages WHERE data_station_id = %s', (data_station_id,))
+
+            if averages:
+                execute_values(cur, 'INSERT INTO station_averages (data_station_id, measurement, decade, average, data_version) VALUES %s',
+                               [(data_station_id, measurement, decade, average, data_version) for measurement, decade, average in averages],
+                               page_size=len(averages))
+                rowcount = cur.rowcount
+
+            self.commit()
+
+        return rowcount
+
+    def get_station_averages(self, data_station_id, data_version):
+        """Get the averages per decade of a station computed from a data version.
+
+        :param data_station_id: The id of the station in the table
+        :type data_station_id: int
+        :param data_version: The data version
+        :type data_version: int
+        :return: The rows in the form (measurement, decade, average). Empty if they are not computed yet for this data version.
+        :rtype: list
+        """
+        res = None
+
+        with self._conn.cursor() as cur:
+            self._execute_prepared(cur, 'get_station_averages', (data_station_id, data_version))
+            res = cur.fetchall()
+
+        return res
+
+    def has_observations(self, provider_id):
+        """Check if the observations of a provider have been loaded.
+
+        :param provider_id: The id of the provider
+        :type provider_id: int
+        :rtype: bool
+        """
+        res = False
+
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT EXISTS (SELECT 1 FROM observations WHERE provider_id = %s)', (provider_id,))
+            res = cur.fetchall()[0][0]
 
         return res
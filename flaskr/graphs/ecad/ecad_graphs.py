@@ -1,18 +1,20 @@
 #!/usr/bin/python3
 """Class to generate the html files with interactive graphs."""
 # Created: lun ago 19 18:41:47 2024 (+0200)
-# Last-Updated: mar nov 18 09:00:22 2025 (+0100)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
 # Filename: ecad_graphs.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 import math
-import os
 
 from data.averages import Average
+from data.data_version import DataVersion
+from data.station_views import StationViews
 from db.statements import Statements
 from flask import current_app
+from graphs.graph_cache import get_graph_cache
+from graphs.graph_scheduler import BULK, POPULAR, get_graph_scheduler
 from graphs.graphs import Graphs
 import pandas as pd
-from tqdm import tqdm
 
 
 class EcadGraphs(Graphs):
@@ -28,6 +30,7 @@ class EcadGraphs(Graphs):
         self.max_temp_dir = self.provider_data_dir / 'temperature' / 'max'
         self.min_temp_dir = self.provider_data_dir / 'temperature' / 'min'
         self.mean_temp_dir = self.provider_data_dir / 'temperature' / 'mean'
+        self.current_graph_dir = self.provider_data['dirs']['curr_graph_dir'] / self.provider
 
         self.ecad_measurements_translations = {
             'es': {
@@ -130,16 +133,18 @@ class EcadGraphs(Graphs):
 
         return year - (year % 10)
 
-    def _generate_station_data_dict(self, ecad_source_files):
+    def _generate_station_data_dict(self, ecad_source_files, station_averages=None):
         """Generate Panda's dataframe from station sources.
 
         :param ecad_source_files: dictionary with data for each measurement.
         :type ecad_source_files: dict
+        :param station_averages: the averages per decade of each measurement computed by a station_aggregates job, as returned by _get_station_averages. None to compute them.
+        :type station_averages: dict|None
         :returns: a dictionary with the x axis dates and the y axis lists with data.
         :rtype: dict
         """
-        # Initialize averages
-        Average.initialize()
+        # Averages of this station
+        averages = Average()
 
         # dates is our x axis
         data_dict = {'x_axis': None}
@@ -160,64 +165,197 @@ class EcadGraphs(Graphs):
             graph_line_name = self.graph_lines_names[idx]
 
             # Read file
-            dates, values, meas_average = ecad_file.read()
+            dates, values, meas_average = ecad_file.read(station_averages is None)
+
+            if station_averages is not None:
+                meas_average = station_averages.get(measurement, {})
 
             # Set x axis
             if data_dict['x_axis'] is None:
                 data_dict['x_axis'] = dates
 
             # Set EcadSourceFile average to the average dict
-            Average.merge_measurement_averages(meas_average, graph_line_name)
+            averages.merge_measurement_averages(meas_average, graph_line_name)
 
             # Store the list of values in the data_dict using the y axis names
             data_dict[graph_line_name] = values
 
         # Ensure that the average dict meets the Bokeh plots requirements
-        average = Average.normalize_averages()
+        average = averages.normalize_averages()
 
         return data_dict, legend, average
 
-    def generate_stations_html_graphs(self, source_files):
-        """Generate the stations graphs as html files.
+    def _get_station_averages(self, stmt, data_station_id):
+        """Get the averages per decade of a station stored by a station_aggregates job for the current data version.
+
+        :param stmt: the Statements instance.
+        :type stmt: Statements
+        :param data_station_id: the id of the station in the database table.
+        :type data_station_id: int
+        :return: the averages in the form {measurement: {decade: {'average': value}}}, or None if they are not computed yet.
+        :rtype: dict|None
+        """
+        station_averages = None
+        rows = stmt.get_station_averages(data_station_id, DataVersion.get())
+
+        if rows:
+            station_averages = {}
+
+            for measurement, decade, average in rows:
+                station_averages.setdefault(measurement, {})[decade] = {'average': average}
+
+        return station_averages
+
+    def _compute_station_averages(self, ecad_source_files):
+        """Compute the averages per decade of each measurement of a station.
+
+        :param ecad_source_files: dictionary with data for each measurement.
+        :type ecad_source_files: dict
+        :return: the averages in the form (measurement, decade, average).
+        :rtype: list
+        """
+        averages = []
+
+        for measurement, ecad_file in ecad_source_files.items():
+            _, _, meas_average = ecad_file.read()
+
+            for decade, data in meas_average.items():
+                if data['average'] is not None:
+                    averages.append((measurement, decade, data['average']))
+
+        return averages
+
+    def _render_station_graph(self, station_data, source_files, html_file_name):
+        """Render the graph of a station into a file.
+
+        :param station_data: the station row, as returned by get_stations_data.
+        :type station_data: tuple
+        :param source_files: The EcadSourceFiles or EcadObservations instance object.
+        :type source_files: EcadSourceFiles|EcadObservations
+        :param html_file_name: the path of the html file, as given by the graph cache.
+        :type html_file_name: Path
+        :return: the html of the graph or None if the station has no sources.
+        :rtype: str|None
+        """
+        html = None
+        station_id = station_data[1]
+
+        ecad_source_files = source_files.get_source_files(station_id)
+
+        if ecad_source_files:
+            station_averages = self._get_station_averages(Statements(), station_data[0])
+            data_dict, legend, average = self._generate_station_data_dict(ecad_source_files, station_averages)
+
+            if data_dict:
+                html_file_name.parent.mkdir(parents=True, exist_ok=True)
+
+                html = self._build_bokeh_plots(html_file_name, station_data, data_dict, legend, average)
+
+        return html
+
+    def get_station_graph(self, data_station_id, get_source_files, write=False):
+        """Get the html graph of a station, rendering it the first time it is requested.
 
-        :param source_files: The EcadSourceFiles instance object.
-        :type source_files: EcadSourceFiles
+        :param data_station_id: the id of the station in the database table.
+        :type data_station_id: int
+        :param get_source_files: function returning the EcadSourceFiles or EcadObservations instance object. Only called if the graph has to be rendered.
+        :type get_source_files: callable
+        :param write: True to write the graph file even if the graph is cached in memory.
+        :type write: bool
+        :return: the html of the graph or None if the station has no graph.
+        :rtype: str|None
+        """
+        def render(html_file_name):
+            stmt = Statements()
+            station_data = stmt.get_station_data_by_id(data_station_id)
+
+            if station_data is None:
+                return None
+
+            source_files = get_source_files()
+
+            if source_files is None:
+                return None
+
+            current_app.logger.info(f'{self.provider.title()}: Rendering graph for station {data_station_id}')
+
+            return self._render_station_graph(station_data, source_files, html_file_name)
+
+        return get_graph_cache().get(self.provider, self.current_graph_dir, data_station_id, render, DataVersion.get(), write)
+
+    def aggregate_station(self, data_station_id, get_source_files):
+        """Compute the averages per decade of a station and store them for the current data version, so its graph is rendered without computing them.
+
+        :param data_station_id: the id of the station in the database table.
+        :type data_station_id: int
+        :param get_source_files: function returning the EcadSourceFiles or EcadObservations instance object.
+        :type get_source_files: callable
+        :return: the number of averages stored or None if the station has no sources.
+        :rtype: int|None
         """
-        current_app.logger.info(f"{self.provider.title()}: Generating stations static html graph files.")
         stmt = Statements()
+        station_data = stmt.get_station_data_by_id(data_station_id)
+
+        if station_data is None:
+            return None
+
+        source_files = get_source_files()
 
-        current_graph_dir = self.provider_data['dirs']['curr_graph_dir'] / self.provider
-        temp_graph_dir = self.provider_data['dirs']['tmp_graph_dir'] / self.provider
+        if source_files is None:
+            return None
 
-        # Get the stations data
-        stations = stmt.get_stations_data(self.provider_id)
+        ecad_source_files = source_files.get_source_files(station_data[1])
 
-        if stations:
-            # Set the progress bar
-            num_graph_files = len(os.listdir(current_graph_dir))
-            num_meas_files = max(len(os.listdir(self.max_temp_dir)), len(os.listdir(self.min_temp_dir)), len(os.listdir(self.mean_temp_dir)))
+        if not ecad_source_files:
+            return None
 
-            num_files_left = num_meas_files - num_graph_files
-            progress_bar = tqdm(range(num_files_left), file=open(os.devnull, 'w'))
+        current_app.logger.info(f'{self.provider.title()}: Computing averages for station {data_station_id}')
 
-            for row in stations:
-                data_staid = row[0]
-                station_id = row[1]
+        return stmt.replace_station_averages(data_station_id, DataVersion.get(), self._compute_station_averages(ecad_source_files))
 
-                html_file_name = current_graph_dir / f'STA_{data_staid}.html'
+    def _render_scheduled_station_graph(self, data_station_id, source_files):
+        """Render the graph of a station taken from the scheduler queue, unless it is already cached.
+
+        :param data_station_id: the id of the station in the database table.
+        :type data_station_id: int
+        :param source_files: The EcadSourceFiles or EcadObservations instance object.
+        :type source_files: EcadSourceFiles|EcadObservations
+        """
+        def render(html_file_name):
+            stmt = Statements()
+            station_data = stmt.get_station_data_by_id(data_station_id)
+
+            if station_data is None:
+                return None
+
+            return self._render_station_graph(station_data, source_files, html_file_name)
+
+        get_graph_cache().get(self.provider, self.current_graph_dir, data_station_id, render, DataVersion.get())
+
+    def schedule_stations_html_graphs(self, source_files, top_n):
+        """Queue the stations graphs in the background renderer.
+
+        The most viewed stations go first. The rest are rendered only if pre-rendering is enabled,
+        or when their country is requested through the map.
+        :param source_files: The EcadSourceFiles or EcadObservations instance object.
+        :type source_files: EcadSourceFiles|EcadObservations
+        :param top_n: the number of most viewed stations to render first.
+        :type top_n: int
+        """
+        current_app.logger.info(f"{self.provider.title()}: Scheduling stations static html graph files.")
+
+        StationViews.flush()
+
+        stmt = Statements()
+        scheduler = get_graph_scheduler()
 
-                if not html_file_name.exists():
-                    # Get the sources related to the station
-                    ecad_source_files = source_files.get_source_files(station_id)
+        def render(data_station_id):
+            self._render_scheduled_station_graph(data_station_id, source_files)
 
-                    if ecad_source_files:
-                        # Generate the data dictionary to be used by bokeh
-                        data_dict, legend, average = self._generate_station_data_dict(ecad_source_files)
+        # Only the locations of the stations are read and queued, the cursor is not even opened without pre-rendering
+        scheduler.schedule(self.provider_id, stmt.iter_station_locations(self.provider_id), render, BULK)
 
-                        if data_dict:
-                            # create html file with bokeh
-                            self.create_html_file(data_dict, legend, row, average, current_graph_dir, temp_graph_dir)
+        popular_stations = stmt.get_most_viewed_stations(self.provider_id, top_n)
 
-                            # Update progress and print in log
-                            progress_bar.update()
-                            current_app.logger.info(str(progress_bar))
+        if popular_stations:
+            scheduler.schedule(self.provider_id, [(row[0], row[3], row[4], row[5]) for row in popular_stations], render, POPULAR)
@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+"""Bounded cache of the stations html graphs, rendered on demand."""
+# Created: lun oct 19 09:32:10 2026 (+0200)
+# Last-Updated: lun oct 19 10:12:52 2026 (+0200)
+# Filename: graph_cache.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class _Flight():
+    """A render in progress, shared by all the requests asking for the same graph."""
+
+    def __init__(self):
+        """Initialize the class."""
+        self.done = threading.Event()
+        self.html = None
+        self.error = None
+
+
+class GraphCache():
+    """LRU cache of the stations html graphs of the current data version.
+
+    It has two tiers:
+    - memory: the html of the most recently used graphs.
+    - disk: the html files in the directory of the data version, inside the current graphs directory, bounded by number of files.
+
+    Concurrent requests for the same graph wait for a single render (single-flight).
+    When a new data version is seen, every process drops the graphs of the previous one, and the renders of the previous one still in flight are not cached.
+    """
+
+    def __init__(self, max_entries, max_disk_files):
+        """Initialize the class.
+
+        :param max_entries: max number of graphs kept in memory.
+        :type max_entries: int
+        :param max_disk_files: max number of graph files kept on disk per provider.
+        :type max_disk_files: int
+        """
+        self.max_entries = max_entries
+        self.max_disk_files = max_disk_files
+
+        # The data version of the cached graphs
+        self.version = None
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = {}
+        self._flights = {}
+
+    def _graph_file(self, graph_dir, version, data_staid):
+        """Return the path of the station graph file of a data version."""
+        return graph_dir / f'{version}' / f'STA_{data_staid}.html'
+
+    def _set_version(self, version):
+        """Drop the graphs of the previous data version when a newer one is seen.
+
+        Must be called holding the lock.
+        :return: the data version of the cache, the newest seen.
+        :rtype: int
+        """
+        if self.version is None or version > self.version:
+            self._memory = OrderedDict()
+            self._disk = {}
+            self.version = version
+
+        return self.version
+
+    def _remove_old_versions(self, graph_dir, version):
+        """Delete the graph files of the data versions previous to version.
+
+        Runs in a background thread, without holding the lock.
+        """
+        if not graph_dir.exists():
+            return
+
+        for path in graph_dir.iterdir():
+            if path.is_dir() and path.name.isdigit() and int(path.name) < version:
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.is_file() and path.match('STA_*.html'):
+                # Written before the graphs were kept by data version
+                path.unlink(missing_ok=True)
+
+    def _scan_disk(self, graph_dir, version):
+        """Build the LRU index of the graph files of a data version, the least recently written first.
+
+        Called without holding the lock.
+        """
+        index = OrderedDict()
+        version_dir = graph_dir / f'{version}'
+        files = []
+
+        if version_dir.exists():
+            for path in version_dir.glob('STA_*.html'):
+                try:
+                    files.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    # Evicted by another process while scanning
+                    pass
+
+        for _, path in sorted(files, key=lambda item: item[0]):
+            index[path.name] = path
+
+        return index
+
+    def _ensure_disk_index(self, provider, graph_dir, version):
+        """Build the LRU index of the graph files of a provider the first time the data version is used.
+
+        The directory is scanned without holding the lock. Whoever installs the index also starts
+        the removal of the previous data versions in a background thread.
+        """
+        with self._lock:
+            if self.version != version or provider in self._disk:
+                return
+
+        index = self._scan_disk(graph_dir, version)
+
+        with self._lock:
+            # Installed by another request, or a newer data version seen, while scanning
+            if self.version != version or provider in self._disk:
+                return
+
+            self._disk[provider] = index
+
+        threading.Thread(target=self._remove_old_versions, args=(graph_dir, version), name='graph-cache-cleanup', daemon=True).start()
+
+    def _remember(self, key, html):
+        """Store html in the memory tier, evicting the least recently used graphs.
+
+        Must be called holding the lock.
+        """
+        self._memory[key] = html
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _remember_file(self, provider, path):
+        """Store a file in the disk tier, evicting the least recently used files.
+
+        Must be called holding the lock.
+        :return: the paths of the evicted files, to be deleted after releasing the lock.
+        :rtype: list
+        """
+        evicted = []
+        index = self._disk.get(provider)
+
+        # Not indexed yet for this data version: the next scan finds the file
+        if index is None:
+            return evicted
+
+        index[path.name] = path
+        index.move_to_end(path.name)
+
+        while len(index) > self.max_disk_files:
+            _, old_path = index.popitem(last=False)
+            evicted.append(old_path)
+
+        return evicted
+
+    def _store(self, provider, data_staid, version, html, path):
+        """Store a graph in the memory tier and its file in the disk tier, unless a newer data version has been seen.
+
+        The evicted files are deleted after releasing the lock.
+        """
+        evicted = []
+
+        with self._lock:
+            if self.version == version:
+                self._remember((provider, data_staid), html)
+                evicted = self._remember_file(provider, path)
+
+        for old_path in evicted:
+            old_path.unlink(missing_ok=True)
+
+    def _write_file(self, path, html):
+        """Write the file of a graph cached in memory, if it is not on disk.
+
+        Called without holding the lock.
+        :return: True if the file has been written.
+        :rtype: bool
+        """
+        if path.exists():
+            return False
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write a temporary file and rename it, so readers never see it partially written
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_text(html)
+        os.replace(tmp_path, path)
+
+        return True
+
+    def _read_file(self, path):
+        """Read the file of a graph from the disk tier.
+
+        Called without holding the lock.
+        :return: the html of the graph or None if it is not on disk.
+        :rtype: str|None
+        """
+        try:
+            return path.read_text()
+        except FileNotFoundError:
+            return None
+
+    def _lookup(self, key):
+        """Look for the graph in the memory tier.
+
+        Must be called holding the lock.
+        :return: the html of the graph or None if it is not in memory.
+        :rtype: str|None
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        return None
+
+    def get(self, provider, graph_dir, data_staid, render, version, write=False):
+        """Get the graph of a station, rendering it if it is not cached.
+
+        The lock only guards the in-memory state: the files are read, written, scanned and deleted without holding it.
+        :param provider: the name of the provider.
+        :type provider: str
+        :param graph_dir: the directory where the provider graph files are written.
+        :type graph_dir: Path
+        :param data_staid: the id of the station in the database table.
+        :type data_staid: int
+        :param render: function rendering the graph into the file path it receives. It returns the html or None.
+        :type render: callable
+        :param version: the current data version, as returned by DataVersion.get.
+        :type version: int
+        :param write: True to write the graph file even if the graph is cached in memory, i.e. by the jobs rendering graphs for other processes.
+        :type write: bool
+        :return: the html of the graph or None if it could not be rendered.
+        :rtype: str|None
+        """
+        key = (provider, data_staid)
+
+        with self._lock:
+            version = self._set_version(version)
+            html = self._lookup(key)
+
+        self._ensure_disk_index(provider, graph_dir, version)
+        path = self._graph_file(graph_dir, version, data_staid)
+
+        if html is not None:
+            if write and self._write_file(path, html):
+                self._store(provider, data_staid, version, html, path)
+
+            return html
+
+        html = self._read_file(path)
+
+        if html is not None:
+            self._store(provider, data_staid, version, html, path)
+
+            return html
+
+        with self._lock:
+            # Rendered by another request since the first lookup
+            html = self._lookup(key)
+
+            if html is not None:
+                return html
+
+            flight_key = (provider, version, data_staid)
+            flight = self._flights.get(flight_key)
+            owner = flight is None
+
+            if owner:
+                flight = _Flight()
+                self._flights[flight_key] = flight
+
+        if not owner:
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.html
+
+        try:
+            flight.html = render(path)
+
+            if flight.html is not None:
+                self._store(provider, data_staid, version, flight.html, path)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+
+            flight.done.set()
+
+        return flight.html
+
+
+_graph_cache = None
+_graph_cache_lock = threading.Lock()
+
+
+def get_graph_cache():
+    """Return the process wide graph cache, creating it from the app configuration."""
+    global _graph_cache
+
+    with _graph_cache_lock:
+        if _graph_cache is None:
+            _graph_cache = GraphCache(current_app.config['GRAPH_CACHE_MAX_ENTRIES'], current_app.config['GRAPH_CACHE_MAX_DISK_FILES'])
+
+    return _graph_cache
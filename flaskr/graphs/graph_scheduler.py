@@ -0,0 +1,487 @@
+#!/usr/bin/python3
+"""Background renderer of the stations graphs, driven by a priority queue."""
+# Created: lun oct 19 10:48:02 2026 (+0200)
+# Last-Updated: lun oct 19 10:11:40 2026 (+0200)
+# Filename: graph_scheduler.py
+# Author: Joaquin Moncanut <quimm2003@gmail.com>
+import heapq
+import itertools
+import json
+import select
+import threading
+import time
+
+from db import db
+from db.statements import Statements
+from flask import current_app
+
+# Priorities, lower values are rendered first
+DEMANDED = 0
+VIEWED = 1
+POPULAR = 2
+BULK = 3
+
+# Channel the processes not running the renderer send their promotions to
+INTEREST_CHANNEL = 'graph_interest'
+
+# Number of stations read from the database before adding them to the queue, without holding the lock while reading
+SCHEDULE_CHUNK_SIZE = 1000
+
+# Seconds to wait before listening again when the listener connection fails
+LISTEN_RETRY_INTERVAL = 5
+
+# Number of recent promotions from which the expired ones are purged
+RECENT_PROMOTIONS_PURGE_SIZE = 10000
+
+
+class _RecentPromotions():
+    """The promotions made by this process during the last seconds, so the read routes make each one at most once per period."""
+
+    def __init__(self, ttl):
+        """Initialize the class.
+
+        :param ttl: seconds a promotion is not made again.
+        :type ttl: int
+        """
+        self.ttl = ttl
+        self._expiries = {}
+        self._lock = threading.Lock()
+
+    def is_recent(self, key):
+        """Check if a promotion was made during the last ttl seconds, recording it if it was not.
+
+        :param key: the promotion, i.e. ('country', provider_id, cn).
+        :type key: tuple
+        :rtype: bool
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self._expiries.get(key, 0) > now:
+                return True
+
+            if len(self._expiries) >= RECENT_PROMOTIONS_PURGE_SIZE:
+                self._expiries = {item: expiry for item, expiry in self._expiries.items() if expiry > now}
+
+            self._expiries[key] = now + self.ttl
+
+        return False
+
+
+class _Job():
+    """A station graph waiting to be rendered. Only the station location is kept, the station row is read when it is rendered."""
+
+    __slots__ = ('provider_id', 'data_staid', 'cn', 'lat', 'lon', 'priority')
+
+    def __init__(self, provider_id, data_staid, cn, lat, lon, priority):
+        """Initialize the class."""
+        self.provider_id = provider_id
+        self.data_staid = data_staid
+        self.cn = cn
+        self.lat = lat
+        self.lon = lon
+        self.priority = priority
+
+
+class GraphScheduler():
+    """Render the stations graphs in a background thread, most wanted first.
+
+    - DEMANDED: stations requested through the station route.
+    - VIEWED: stations in countries or bounding boxes recently requested through the map.
+    - POPULAR: the most viewed stations.
+    - BULK: the rest of the stations. Only scheduled if run_bulk is True.
+
+    The renderer runs in the ingestion leader, which calls start when it gets the leadership. The other processes serving the map
+    send their promotions to it through the INTEREST_CHANNEL PostgreSQL channel (NOTIFY), and it applies them as its own.
+    The stations of a promoted country or bounding box are read from the database, so they are queued even if they were not scheduled.
+    """
+
+    def __init__(self, app, run_bulk, interest_ttl):
+        """Initialize the class.
+
+        :param app: The Flask app, to run the renders under its context.
+        :type app: flask
+        :param run_bulk: True to render the BULK stations, False to render only the promoted and popular ones.
+        :type run_bulk: bool
+        :param interest_ttl: seconds a country or bounding box is considered viewed after being requested.
+        :type interest_ttl: int
+        """
+        self.app = app
+        self.run_bulk = run_bulk
+        self.interest_ttl = interest_ttl
+
+        # True in the process running the renderer, the ingestion leader
+        self.is_renderer = False
+
+        self._recent = _RecentPromotions(interest_ttl)
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._pending = {}
+        self._renders = {}
+        self._countries = {}
+        self._bboxes = []
+        self._thread = None
+        self._listener = None
+
+        # Promotions that can be received from other processes
+        self._promotions = {
+            'promote_country': self._promote_country,
+            'promote_bbox': self._promote_bbox,
+            'demand': self._demand,
+        }
+
+    def _is_viewed(self, provider_id, cn, lat, lon):
+        """Check if the station is in a country or bounding box recently requested.
+
+        Must be called holding the lock.
+        """
+        now = time.monotonic()
+
+        if self._countries.get((provider_id, cn), 0) > now:
+            return True
+
+        for bbox_provider_id, bbox, expiry in self._bboxes:
+            if expiry > now and bbox_provider_id == provider_id and bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]:
+                return True
+
+        return False
+
+    def _push(self, job, priority):
+        """Set the priority of a job, pushing it into the heap if it is higher than the current one.
+
+        Must be called holding the lock.
+        """
+        if priority < job.priority or self._pending.get(job.data_staid) is not job:
+            job.priority = min(job.priority, priority)
+            self._pending[job.data_staid] = job
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job.data_staid))
+            self._cond.notify()
+
+    def _queue(self, provider_id, stations, priority):
+        """Queue stations with a priority, or raise it if they are already queued.
+
+        Must be called holding the lock.
+        :param stations: the stations in the form (data_staid, cn, lat, lon).
+        :type stations: iterable
+        """
+        for data_staid, cn, lat, lon in stations:
+            lat = float(lat)
+            lon = float(lon)
+
+            if priority > VIEWED and self._is_viewed(provider_id, cn, lat, lon):
+                job_priority = VIEWED
+            else:
+                job_priority = priority
+
+            job = self._pending.get(data_staid)
+
+            if job is None:
+                job = _Job(provider_id, data_staid, cn, lat, lon, job_priority)
+
+            self._push(job, job_priority)
+
+    def _next_job(self):
+        """Pop the job with the highest priority, discarding the outdated heap entries.
+
+        Must be called holding the lock.
+        :return: the job to render or None if there is nothing to render.
+        :rtype: _Job|None
+        """
+        while self._heap:
+            priority, _, data_staid = heapq.heappop(self._heap)
+            job = self._pending.get(data_staid)
+
+            if job is None or job.priority != priority:
+                continue
+
+            del self._pending[data_staid]
+
+            return job
+
+        return None
+
+    def _run(self):
+        """Render the jobs as they come."""
+        while True:
+            with self._cond:
+                job = self._next_job()
+
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+
+                render = self._renders.get(job.provider_id)
+
+            if render is None:
+                continue
+
+            with self.app.app_context():
+                try:
+                    render(job.data_staid)
+                except Exception:
+                    current_app.logger.exception(f'Could not render the graph of station {job.data_staid}')
+
+    def _apply(self, payload):
+        """Apply a promotion received from another process."""
+        promotion, *args = json.loads(payload)
+        handler = self._promotions.get(promotion)
+
+        if handler is not None:
+            with self.app.app_context():
+                handler(*args)
+
+    def _listen(self):
+        """Apply the promotions sent by the other processes through INTEREST_CHANNEL."""
+        while True:
+            conn = None
+
+            try:
+                with self.app.app_context():
+                    conn = db.connect()
+
+                conn.autocommit = True
+
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {INTEREST_CHANNEL}')
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+
+                    conn.poll()
+
+                    while conn.notifies:
+                        try:
+                            self._apply(conn.notifies.pop(0).payload)
+                        except Exception:
+                            with self.app.app_context():
+                                current_app.logger.exception('Could not apply a graph promotion')
+            except Exception:
+                with self.app.app_context():
+                    current_app.logger.exception(f'Could not listen to the {INTEREST_CHANNEL} channel')
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            time.sleep(LISTEN_RETRY_INTERVAL)
+
+    def start(self):
+        """Make this process the one running the renderer: start the renderer thread, and the thread listening to the promotions of the other processes.
+
+        From then on the promotions of this process are applied here instead of being sent through INTEREST_CHANNEL.
+        """
+        with self._cond:
+            if self._thread is None:
+                self.is_renderer = True
+
+                self._thread = threading.Thread(target=self._run, name='graph-scheduler', daemon=True)
+                self._thread.start()
+
+                self._listener = threading.Thread(target=self._listen, name='graph-interest', daemon=True)
+                self._listener.start()
+
+    def _forward(self, promotion, *args):
+        """Send a promotion to the process running the renderer, if it is not this one.
+
+        :return: True if the promotion was sent.
+        :rtype: bool
+        """
+        if self.is_renderer:
+            return False
+
+        stmt = Statements()
+        stmt.notify(INTEREST_CHANNEL, json.dumps([promotion, *args]))
+
+        return True
+
+    def schedule(self, provider_id, stations, render, priority=BULK):
+        """Add stations to the queue.
+
+        Stations in a country or bounding box recently viewed get the VIEWED priority if it is higher.
+        BULK stations are not queued if run_bulk is False: they are queued when they are promoted.
+        The stations are read in chunks of SCHEDULE_CHUNK_SIZE outside the lock, so the renderer and the promotions
+        do not wait for the database round trips of a server side cursor.
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param stations: the stations in the form (data_staid, cn, lat, lon).
+        :type stations: iterable
+        :param render: function rendering the graph of a station, given its id in the database table.
+        :type render: callable
+        :param priority: the priority of the stations.
+        :type priority: int
+        """
+        self.start()
+
+        with self._cond:
+            self._renders[provider_id] = render
+
+        if priority == BULK and not self.run_bulk:
+            return
+
+        rows = iter(stations)
+
+        while True:
+            chunk = list(itertools.islice(rows, SCHEDULE_CHUNK_SIZE))
+
+            if not chunk:
+                break
+
+            with self._cond:
+                self._queue(provider_id, chunk, priority)
+
+    def promote_country(self, provider_id, cn):
+        """Render first the stations of a country requested through the map.
+
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param cn: the country code.
+        :type cn: str
+        """
+        if self._recent.is_recent(('country', provider_id, cn)):
+            return
+
+        if not self._forward('promote_country', provider_id, cn):
+            self._promote_country(provider_id, cn)
+
+    def _promote_country(self, provider_id, cn):
+        """Queue with the VIEWED priority the stations of a country, in this process."""
+        stations = Statements().get_station_locations(provider_id, cn=cn)
+
+        with self._cond:
+            self._countries[(provider_id, cn)] = time.monotonic() + self.interest_ttl
+            self._queue(provider_id, stations, VIEWED)
+
+    def promote_bbox(self, provider_id, bbox):
+        """Render first the stations inside a bounding box requested through the map.
+
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param bbox: the bounding box in the form (min_lon, min_lat, max_lon, max_lat).
+        :type bbox: tuple
+        """
+        if self._recent.is_recent(('bbox', provider_id, tuple(bbox))):
+            return
+
+        if not self._forward('promote_bbox', provider_id, bbox):
+            self._promote_bbox(provider_id, bbox)
+
+    def _promote_bbox(self, provider_id, bbox):
+        """Queue with the VIEWED priority the stations inside a bounding box, in this process."""
+        stations = Statements().get_station_locations(provider_id, bbox=bbox)
+
+        with self._cond:
+            now = time.monotonic()
+            self._bboxes = [item for item in self._bboxes if item[2] > now]
+            self._bboxes.append((provider_id, bbox, now + self.interest_ttl))
+            self._queue(provider_id, stations, VIEWED)
+
+    def demand(self, provider_id, data_staid, cn):
+        """Render first a station requested through the station route, and the stations of its country.
+
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param data_staid: the id of the station in the database table.
+        :type data_staid: int
+        :param cn: the country code of the station.
+        :type cn: str
+        """
+        if not self._forward('demand', provider_id, data_staid, cn):
+            self._demand(provider_id, data_staid, cn)
+
+    def _demand(self, provider_id, data_staid, cn):
+        """Raise to DEMANDED the priority of a queued station, and queue with the VIEWED priority the ones of its country, in this process."""
+        with self._cond:
+            job = self._pending.get(data_staid)
+
+            if job is not None:
+                self._push(job, DEMANDED)
+
+        self._promote_country(provider_id, cn)
+
+
+class JobQueueScheduler():
+    """Queue the stations graphs in the jobs table, to be rendered by the run-worker processes of any node.
+
+    It offers the same interface as GraphScheduler. The priorities are kept in the table.
+    """
+
+    # Each station gets one job of each kind. The averages are queued first, so with the same priority
+    # they are claimed before the graph, which then reads them instead of computing them.
+    kinds = ('station_aggregates', 'station_graph')
+
+    def __init__(self, max_attempts, interest_ttl):
+        """Initialize the class.
+
+        :param max_attempts: The number of times a job is tried before failing.
+        :type max_attempts: int
+        :param interest_ttl: seconds a country or bounding box is not promoted again by this process.
+        :type interest_ttl: int
+        """
+        self.max_attempts = max_attempts
+
+        self._recent = _RecentPromotions(interest_ttl)
+
+    def start(self):
+        """Nothing to start, the run-worker processes render the jobs."""
+
+    def schedule(self, provider_id, stations, render=None, priority=BULK):
+        """Add stations to the jobs table.
+
+        :param provider_id: the id of the provider.
+        :type provider_id: int
+        :param stations: the stations in the form (data_staid, cn, lat, lon).
+        :type stations: iterable
+        :param render: not used, workers render with their own handlers.
+        :type render: callable|None
+        :param priority: the priority of the stations.
+        :type priority: int
+        """
+        stmt = Statements()
+        data_station_ids = [station[0] for station in stations]
+
+        for kind in self.kinds:
+            stmt.enqueue_jobs(kind, provider_id, data_station_ids, priority, self.max_attempts)
+
+    def promote_country(self, provider_id, cn):
+        """Render first the stations of a country requested through the map."""
+        if self._recent.is_recent(('country', provider_id, cn)):
+            return
+
+        stmt = Statements()
+        stmt.promote_jobs(self.kinds, VIEWED, provider_id=provider_id, cn=cn)
+
+    def promote_bbox(self, provider_id, bbox):
+        """Render first the stations inside a bounding box requested through the map."""
+        if self._recent.is_recent(('bbox', provider_id, tuple(bbox))):
+            return
+
+        stmt = Statements()
+        stmt.promote_jobs(self.kinds, VIEWED, provider_id=provider_id, bbox=bbox)
+
+    def demand(self, provider_id, data_staid, cn):
+        """Render first a station requested through the station route, and the stations of its country."""
+        stmt = Statements()
+        stmt.promote_jobs(self.kinds, DEMANDED, data_station_id=data_staid)
+        stmt.promote_jobs(self.kinds, VIEWED, provider_id=provider_id, cn=cn)
+
+
+_graph_scheduler = None
+_graph_scheduler_lock = threading.Lock()
+
+
+def get_graph_scheduler():
+    """Return the process wide graph scheduler, creating it from the app configuration.
+
+    With JOB_QUEUE_ENABLED the graphs are queued in the jobs table, otherwise rendered by a thread of this process.
+    """
+    global _graph_scheduler
+
+    with _graph_scheduler_lock:
+        if _graph_scheduler is None and current_app.config['JOB_QUEUE_ENABLED']:
+            _graph_scheduler = JobQueueScheduler(current_app.config['JOB_MAX_ATTEMPTS'], current_app.config['GRAPH_INTEREST_TTL'])
+        elif _graph_scheduler is None:
+            _graph_scheduler = GraphScheduler(current_app._get_current_object(), current_app.config['PRERENDER_GRAPHS'], current_app.config['GRAPH_INTEREST_TTL'])
+
+    return _graph_scheduler
@@ -1,18 +1,20 @@
 #!/usr/bin/python3
 """Base class for all graph classes."""
 # Created: sáb ago 31 09:46:25 2024 (+0200)
-# Last-Updated: mié oct  2 23:31:36 2024 (+0200)
+# Last-Updated: lun oct 19 10:12:56 2026 (+0200)
 # Filename: graphs.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
 import math
+import os
+import threading
 
 from bokeh.embed import file_html
 from bokeh.models import ColumnDataSource, HoverTool, Legend, Title
 from bokeh.models import CrosshairTool, Grid, LinearAxis, SingleIntervalTicker, Span
 from bokeh.plotting import curdoc, figure
 from bokeh.resources import CDN
-from country_list import countries_for_language
 from data.averages import Average
+from data.country_names import CountryNames
 
 
 class Graphs():
@@ -24,7 +26,7 @@ class Graphs():
         self.graph_lines_colors = ['red', 'blue', 'green', 'black', '#00ffff', '#8a2be2', '#42280E', '#7fff00', '#006400', '#8b008b', '#ff8c00', '#ff1493', '#ffd700', '#808080', '#550000', '#808000', '#DA70D6', '#800080', '#008080', '#ff6347', '#ee82ee', '#a0522d ', '#272840']
 
         # Countries in spanish
-        self.es_countries = dict(countries_for_language('es'))
+        self.es_countries = CountryNames.get('es')
 
     def _dd_to_dms(self, dd, lat_or_lon):
         """Convert decimal to degrees, minutes, seconds.
@@ -254,6 +256,8 @@ class Graphs():
         :type meang: Figure
         :param html_file_name: the path to the static html file to be generated
         :type html_file_name: Path
+        :return: the html contents written to the file.
+        :rtype: str
         """
         template = """
         {% block contents %}
@@ -274,9 +278,16 @@ class Graphs():
 
         html = file_html(models=[maing, meang], template=template, resources=CDN, title=title)
 
-        with open(html_file_name, 'w') as f:
+        # Write a temporary file and rename it, so readers never see it partially written
+        tmp_file_name = html_file_name.with_name(f'{html_file_name.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+        with open(tmp_file_name, 'w') as f:
             f.write(html)
 
+        os.replace(tmp_file_name, html_file_name)
+
+        return html
+
     def _build_bokeh_plots(self, html_file_name, station_data, data_dict, legend, average):
         """Configure the Bokeh Plots.
 
@@ -290,6 +301,8 @@ class Graphs():
         :type legend: dict
         :param average: data to be plotted into the Bokeh meang figure
         :type average: dict
+        :return: the html contents of the generated file.
+        :rtype: str
         """
         # Get a list of the data_dict keys
         dict_keys = list(data_dict)
@@ -310,37 +323,4 @@ class Graphs():
 
         mean = self._configure_mean_graph(average, legend)
 
-        self._render_template(maing, mean, html_file_name, title)
-
-    def create_html_file(self, data_dict, legend, station_data, average, current_graph_dir, tmp_graph_dir):
-        """Create the html file with the interactive graph.
-
-        :param data_dict: Dictionary which contains the data for x and y axis.
-        :type data_dict: dict
-        :param legend: list with the texts for sources legend
-        :param legend: list
-        :param station_data: Dictionary with the station data.
-        :type data_staid: dict
-        :param average: Dictionary containing the average per decade
-        :type average: dict
-        :param current_graph_dir: directory where to place the resulting html file
-        :type current_graph_dir: str
-        :param tmp_graph_dir: directory where to place the temporary html file
-        :type tmp_graph_dir: str
-        """
-        data_staid = station_data[0]
-
-        # Create the html file path. If the file exists, then write it first into the tmp directory
-        html_file_name = current_graph_dir / f'STA_{data_staid}.html'
-
-        file_exists = html_file_name.exists()
-
-        if file_exists:
-            return
-            html_file_name = tmp_graph_dir / f'STA_{data_staid}.html'
-
-        self._build_bokeh_plots(html_file_name, station_data, data_dict, legend, average)
-
-        # If html file existed then move it from tmp to current directory
-        if file_exists and html_file_name.exists():
-            html_file_name.replace(current_graph_dir / f'STA_{data_staid}.html')
+        return self._render_template(maing, mean, html_file_name, title)
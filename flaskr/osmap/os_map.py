@@ -1,12 +1,13 @@
 #!/usr/bin/python3
 """Initialize the Flask Blueprint which will show the OpenStreet map into the browser."""
 # Created: sáb jul  6 18:13:02 2024 (+0200)
-# Last-Updated: dom nov 17 18:08:27 2024 (+0100)
+# Last-Updated: lun oct 19 09:59:35 2026 (+0200)
 # Filename: os_map.py
 # Author: Joaquin Moncanut <quimm2003@gmail.com>
-from flask import Blueprint, render_template, request
-from db.statements import Statements
-from country_list import countries_for_language
+from pathlib import Path
+
+from flask import Blueprint, current_app, render_template, request, url_for
+from data.serving_snapshot import ServingSnapshot
 
 
 # Supported UI languages
@@ -40,12 +41,10 @@ TRANSLATIONS = {
 class OSMap():
     """Shows the OpenStreet Map."""
 
-    def __init__(self, markers=None, providers=None):
+    def __init__(self):
         """Initialize the class."""
         self.bp = Blueprint('osmap', __name__, url_prefix='/')
         self.bp.add_url_rule('/', view_func=self.show_map)
-        self.markers = markers if markers else [{'lat': 0, 'lon': 0, 'popup': 'This is the middle of the map.'}]
-        self.providers = providers if providers else {}
 
     def _get_language(self) -> str:
         """Determine the current UI language from the request.
@@ -58,34 +57,31 @@ class OSMap():
         return lang
 
     def _get_available_countries(self, lang: str):
-        """Get list of countries that have stations in the database.
-        
+        """Get list of countries that have stations, from the index of the serving snapshot.
+
         :param lang: Language code (e.g. 'en', 'es') for country names
         :type lang: str
-        :return: A list of tuples (country_code, country_name) sorted by name
-        :rtype: list
+        :return: A tuple of tuples (country_code, country_name) sorted by name
+        :rtype: tuple
         """
-        stmt = Statements()
-
-        # Fallback to English if the requested language is not supported
-        language_for_countries = lang if lang in {"en", "es"} else "en"
-        countries_dict = dict(countries_for_language(language_for_countries))
-        available_countries = []
-        
-        # Get distinct country codes from stations table
-        with stmt._conn.cursor() as cur:
-            cur.execute('SELECT DISTINCT cn FROM stations ORDER BY cn')
-            country_codes = [row[0] for row in cur.fetchall()]
-        
-        # Map country codes to names
-        for code in country_codes:
-            name = countries_dict.get(code, code)
-            available_countries.append((code, name))
-        
-        # Sort by country name
-        available_countries.sort(key=lambda x: x[1])
-        
-        return available_countries
+        return ServingSnapshot.get().get_countries(lang)
+
+    def _get_marker_tiles_url(self):
+        """Get the URL of the static marker tiles in MARKER_TILES_LOCATION.
+
+        :return: The URL, or None if the tiles are disabled or not inside the static folder, so the map uses the tiles route.
+        :rtype: str|None
+        """
+        if not current_app.config['MARKER_TILES_ENABLED']:
+            return None
+
+        try:
+            tiles_path = current_app.config['MARKER_TILES_LOCATION'].relative_to(Path(current_app.static_folder).resolve())
+        except ValueError:
+            current_app.logger.warning(f'MARKER_TILES_LOCATION {current_app.config["MARKER_TILES_LOCATION"]} is not inside the static folder, the map uses the tiles route')
+            return None
+
+        return url_for('static', filename=tiles_path.as_posix())
 
     def show_map(self):
         """Render the map."""
@@ -94,8 +90,10 @@ class OSMap():
         texts = TRANSLATIONS.get(lang, TRANSLATIONS["en"])
         return render_template(
             'index.html',
-            markers=self.markers,
-            providers=self.providers,
+            marker_tiles_url=self._get_marker_tiles_url(),
+            cluster_max_zoom=current_app.config['CLUSTER_MAX_ZOOM'],
+            popups_batch_max=current_app.config['POPUPS_BATCH_MAX'],
+            providers=ServingSnapshot.get().providers,
             countries=countries,
             lang=lang,
             texts=texts,